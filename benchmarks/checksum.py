@@ -0,0 +1,48 @@
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Optional
+
+from botocore.compat import HAS_CRT
+from botocore.httpchecksum import AwsChunkedWrapper, Crc32Checksum, CrtCrc32cChecksum, Sha1Checksum, Sha256Checksum
+
+from benchmarks.range_server import RangeServer
+from shared.constants import MiB
+from uploader.index import open_range
+
+CHECKSUMS = {"CRC32": Crc32Checksum, "SHA1": Sha1Checksum, "SHA256": Sha256Checksum}
+if HAS_CRT:
+    CHECKSUMS["CRC32C"] = CrtCrc32cChecksum
+
+
+def send(url: str, size: int, chunk_size: int, algorithm: Optional[str]) -> float:
+    """Reads a part the way botocore sends it to UploadPart, with the checksum trailer when ``algorithm`` is set."""
+    began = perf_counter()
+    with open_range(url, 0, size - 1, chunk_size) as body:
+        if algorithm is not None:
+            body = AwsChunkedWrapper(body, CHECKSUMS[algorithm], f"x-amz-checksum-{algorithm.lower()}")
+
+        for _ in iter(lambda: body.read(MiB), b""):
+            pass
+
+    return perf_counter() - began
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Uploader part throughput by checksum algorithm.")
+    parser.add_argument("--part-size", type=int, default=256, help="part size in MiB")
+    parser.add_argument("--chunk-size", type=int, default=8, help="stream chunk size in MiB")
+    parser.add_argument("--algorithm", nargs="+", default=["NONE", *CHECKSUMS])
+    args = parser.parse_args()
+
+    size = args.part_size * MiB
+    with RangeServer({"part.bin": size}) as server:
+        print(f"{'algorithm':>9} {'seconds':>8} {'MiB/s':>8}")
+        for algorithm in args.algorithm:
+            seconds = send(
+                server.url("part.bin"), size, args.chunk_size * MiB, None if algorithm == "NONE" else algorithm
+            )
+            print(f"{algorithm:>9} {seconds:>8.2f} {args.part_size / seconds:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from argparse import ArgumentParser
+from io import BytesIO
+from os import environ, urandom
+from time import process_time
+
+from shared.constants import MiB
+from uploader.compress import compress_part
+
+
+def sample(kind: str, size: int) -> bytes:
+    """Part content which compresses like logs (``text``), media or archives (``random``), or sparse files."""
+    if kind == "random":
+        return urandom(size)
+    if kind == "zeros":
+        return bytes(size)
+
+    lines = b"".join(b"2024-01-01T00:00:%02d request %d served in %d ms\n" % (i % 60, i, i % 997) for i in range(4096))
+    return (lines * (size // len(lines) + 1))[:size]
+
+
+def measure(content: bytes, level: int) -> tuple[float, int]:
+    environ["COMPRESSION_LEVEL"] = str(level)
+    began = process_time()
+    with compress_part(BytesIO(content), "gzip", False) as compressed:
+        size = compressed.seek(0, 2)
+
+    return process_time() - began, size
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Uploader CPU time against bytes saved by gzip level.")
+    parser.add_argument("--part-size", type=int, default=64, help="part size in MiB")
+    parser.add_argument("--kind", nargs="+", default=["text", "random", "zeros"])
+    parser.add_argument("--level", type=int, nargs="+", default=[1, 3, 6, 9])
+    args = parser.parse_args()
+
+    print(f"{'kind':>6} {'level':>5} {'cpu s':>6} {'MiB/s':>7} {'ratio':>6} {'saved MiB':>9}")
+    for kind in args.kind:
+        content = sample(kind, args.part_size * MiB)
+        for level in args.level:
+            seconds, size = measure(content, level)
+            saved = (len(content) - size) / MiB
+            print(
+                f"{kind:>6} {level:>5} {seconds:>6.2f} {args.part_size / seconds:>7.1f} "
+                f"{size / len(content):>6.3f} {saved:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
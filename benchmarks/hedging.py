@@ -0,0 +1,86 @@
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from moto import mock_s3
+
+from benchmarks.pipeline import percentiles
+from benchmarks.range_server import RangeServer
+from partitioner.index import get_hedge
+from shared import metrics
+from shared.connection import get_s3_client
+from shared.constants import MiB
+from shared.metrics import MetricsCollector
+from uploader import hedge
+from uploader.index import handler as upload
+
+BUCKET = "benchmark-bucket"
+
+
+def run_parts(url: str, parts: int, part_size: int, concurrency: int, hedge_config: dict) -> list[float]:
+    """Uploads every part in an invocation of its own, ``concurrency`` at a time, returning their latencies."""
+    key = f"hedge-{bool(hedge_config)}.bin"
+    upload_id = get_s3_client().create_multipart_upload(Bucket=BUCKET, Key=key)["UploadId"]
+    batch_input = {"URL": url, "Bucket": BUCKET, "Key": key, "MultipartUploadId": upload_id, "Hedge": hedge_config}
+
+    def invoke(index: int) -> float:
+        began = perf_counter()
+        start = index * part_size
+        upload(
+            {"BatchInput": batch_input, "Items": [{"index": index + 1, "start": start, "end": start + part_size - 1}]},
+            {},
+        )
+        return perf_counter() - began
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(invoke, range(parts)))
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Part tail latency with and without hedging against an origin with stragglers.")
+    parser.add_argument("--parts", type=int, default=200)
+    parser.add_argument("--part-size", type=int, default=1, help="part size in MiB")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent uploader invocations of the Map")
+    parser.add_argument("--stragglers", type=float, default=0.02, help="fraction of responses which stall")
+    parser.add_argument("--straggler-delay", type=float, default=3.0, help="seconds a straggler stalls")
+    parser.add_argument("--stream-rate", type=float, default=50, help="per-connection cap in MiB/s, 0 to disable")
+    parser.add_argument("--overhead", type=float, default=0.05, help="PART_OVERHEAD_SECONDS of the hedge floor")
+    parser.add_argument("--percentile", type=int, default=95, help="HEDGE_PERCENTILE")
+    args = parser.parse_args()
+
+    for name, value in {
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "LOGGER_LEVEL": "WARNING",
+    }.items():
+        os.environ.setdefault(name, value)
+    os.environ["HEDGE_PERCENTILE"] = str(args.percentile)
+    collector = MetricsCollector()
+    metrics.set_sink(collector)
+
+    part_size = args.part_size * MiB
+    files = {"file.bin": args.parts * part_size}
+    with mock_s3(), RangeServer(files, args.stream_rate * MiB or None, args.stragglers, args.straggler_delay) as server:
+        get_s3_client().create_bucket(Bucket=BUCKET)
+
+        print(f"{'hedge':>6} {'p50 s':>8} {'p99 s':>8} {'max s':>8} {'total s':>8} {'hedged':>8}")
+        for hedge_config in ({}, get_hedge(part_size, args.overhead, (args.stream_rate or 1000) * MiB)):
+            # every run starts from a cold container, without part times to take the percentile of
+            hedge.reset()
+            collector.records.clear()
+            began = perf_counter()
+            latencies = run_parts(server.url("file.bin"), args.parts, part_size, args.concurrency, hedge_config)
+            seconds = perf_counter() - began
+
+            p50, p99 = percentiles(latencies)
+            label = "on" if hedge_config else "off"
+            print(
+                f"{label:>6} {p50:>8.2f} {p99:>8.2f} {max(latencies):>8.2f} {seconds:>8.2f} "
+                f"{collector.total('HedgedParts'):>8.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
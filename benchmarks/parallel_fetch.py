@@ -0,0 +1,37 @@
+from argparse import ArgumentParser
+from time import perf_counter
+
+from benchmarks.range_server import RangeServer
+from shared.constants import MiB
+from uploader.index import open_range
+
+
+def fetch(url: str, size: int, chunk_size: int, concurrency: int) -> float:
+    began = perf_counter()
+    with open_range(url, 0, size - 1, chunk_size, concurrency) as body:
+        received = sum(len(chunk) for chunk in iter(lambda: body.read(MiB), b""))
+
+    if received != size:
+        raise ValueError(f"received {received} bytes, expected {size}")
+
+    return perf_counter() - began
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Uploader ranged download throughput by degree of parallelism.")
+    parser.add_argument("--part-size", type=int, default=256, help="part size in MiB")
+    parser.add_argument("--chunk-size", type=int, default=8, help="sub-range size in MiB")
+    parser.add_argument("--stream-rate", type=float, default=50, help="per-connection cap in MiB/s, 0 to disable")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    size = args.part_size * MiB
+    with RangeServer({"part.bin": size}, args.stream_rate * MiB or None) as server:
+        print(f"{'concurrency':>11} {'seconds':>8} {'MiB/s':>8}")
+        for concurrency in args.concurrency:
+            seconds = fetch(server.url("part.bin"), size, args.chunk_size * MiB, concurrency)
+            print(f"{concurrency:>11} {seconds:>8.2f} {args.part_size / seconds:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
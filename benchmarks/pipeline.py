@@ -0,0 +1,205 @@
+import json
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from os.path import join
+from resource import RUSAGE_SELF, getrusage
+from statistics import quantiles
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import perf_counter
+from typing import Tuple
+
+from moto import mock_s3
+
+from benchmarks.range_server import RangeServer
+from executor.engine import BATCH_FIELDS, INPUT_DEFAULTS, SINGLE_FIELDS
+from partitioner.complete import complete_multipart_upload
+from partitioner.index import get_create_args
+from partitioner.index import handler as partition
+from shared import metrics
+from shared.connection import get_s3_client
+from shared.constants import MiB
+from shared.metrics import MetricsCollector
+from uploader.index import handler as upload
+
+BUCKET = "benchmark-bucket"
+COLUMNS = ("mode", "file MiB", "part MiB", "MB/s", "p50 s", "p99 s", "RSS MiB", "tmp MiB")
+
+
+class DiskSampler(Thread):
+    """Tracks the peak disk usage of the files the uploader stages in ``directory`` while a run is in progress.
+
+    The staged files have no name, so they are found among the open file descriptors of the process. Only those
+    are counted, as the S3 stand-in spools large objects to the temp directory.
+    """
+
+    def __init__(self, directory: str, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.interval = interval
+        self.peak = 0
+        self._stopped = Event()
+
+    def usage(self) -> int:
+        usage = 0
+        for fd in os.listdir("/proc/self/fd"):
+            path = join("/proc/self/fd", fd)
+            try:
+                if os.readlink(path).startswith(self.directory + os.sep):
+                    usage += os.stat(path).st_blocks * 512
+            except OSError:
+                # closed since it was listed
+                continue
+
+        return usage
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, self.usage())
+
+    def __enter__(self) -> "DiskSampler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stopped.set()
+        self.join()
+
+
+def invoke_uploader(batch: dict) -> Tuple[float, list[dict]]:
+    began = perf_counter()
+    parts = upload(batch, {})
+    return perf_counter() - began, parts
+
+
+def run_pipeline(url: str, part_size: int, concurrency: int) -> Tuple[int, list[float]]:
+    """Runs partition, the Map fan-out over the manifest and completion the way the state machine does, with its
+    input defaults, returning the uploaded size and the latency of every uploader invocation."""
+    s3 = get_s3_client()
+    event = {**INPUT_DEFAULTS, "URL": url, "Bucket": BUCKET, "SingleTaskSize": part_size, "Concurrency": concurrency}
+    # moto stores a part sent with a trailing checksum along with its aws-chunked framing, so parts are sent
+    # without one, benchmarks.checksum measures what it costs
+    event["ChecksumAlgorithm"] = None
+    result = partition(event, {})
+    if "Error" in result:
+        raise ValueError(result["Error"])
+
+    key, batch_size = result["Key"], result["Plan"]["BatchSize"]
+    if result["Mode"] == "single":
+        latency, _ = invoke_uploader({**{name: result[name] for name in SINGLE_FIELDS}, "Task": result["Task"]})
+        size = s3.head_object(Bucket=BUCKET, Key=key)["ContentLength"]
+        s3.delete_object(Bucket=BUCKET, Key=key)
+        return size, [latency]
+
+    create_args = get_create_args(result["ChecksumAlgorithm"], result["Compression"], result["Metadata"])
+    upload_id = s3.create_multipart_upload(Bucket=BUCKET, Key=key, **create_args)["UploadId"]
+    manifest = s3.get_object(Bucket=result["Manifest"]["Bucket"], Key=result["Manifest"]["Key"])
+    items = json.loads(manifest["Body"].read())
+
+    batch_input = {
+        **{name: result[name] for name in BATCH_FIELDS},
+        "MultipartUploadId": upload_id,
+        "TotalSize": result["Plan"]["TotalSize"],
+    }
+    batches = [
+        {"BatchInput": batch_input, "Items": items[i : i + batch_size]} for i in range(0, len(items), batch_size)
+    ]
+    with ThreadPoolExecutor(concurrency) as executor:
+        invocations = list(executor.map(invoke_uploader, batches))
+
+    # the parts are listed from S3, like the Completer does
+    complete_multipart_upload(
+        {
+            "Bucket": BUCKET,
+            "Key": key,
+            "MultipartUploadId": upload_id,
+            "TotalSize": result["Plan"]["TotalSize"],
+            "PartSize": result["Plan"]["PartSize"],
+            "Compression": result["Compression"],
+        }
+    )
+    size = s3.head_object(Bucket=BUCKET, Key=key)["ContentLength"]
+    s3.delete_object(Bucket=BUCKET, Key=key)
+
+    return size, [seconds for seconds, _ in invocations]
+
+
+def run_configuration(
+    url: str, part_size: int, concurrency: int, staging: str
+) -> Tuple[int, list[float], float, float, int]:
+    """Runs the pipeline in a process of its own, so the peak RSS it reports belongs to this configuration alone,
+    returning the uploaded size, the invocation latencies, the seconds taken, the peak RSS in MiB and the peak
+    staging usage in bytes."""
+    # the handlers write an EMF record per invocation to stdout, which would interleave with the table
+    metrics.set_sink(MetricsCollector())
+    with mock_s3():
+        get_s3_client().create_bucket(Bucket=BUCKET)
+
+        began = perf_counter()
+        with DiskSampler(staging) as disk:
+            size, latencies = run_pipeline(url, part_size, concurrency)
+        seconds = perf_counter() - began
+
+    # ru_maxrss is in KiB on Linux
+    return size, latencies, seconds, getrusage(RUSAGE_SELF).ru_maxrss / 1024, disk.peak
+
+
+def percentiles(latencies: list[float]) -> Tuple[float, float]:
+    if len(latencies) == 1:
+        return latencies[0], latencies[0]
+
+    cuts = quantiles(latencies, n=100, method="inclusive")
+    return cuts[49], cuts[98]
+
+
+def main() -> None:
+    parser = ArgumentParser(description="End-to-end partition, upload and complete throughput against local stand-ins.")
+    parser.add_argument("--file-size", type=int, nargs="+", default=[64, 256], help="file sizes in MiB")
+    parser.add_argument("--part-size", type=int, nargs="+", default=[8, 32], help="part sizes in MiB")
+    parser.add_argument("--mode", nargs="+", default=["stream", "disk"], help="uploader UPLOAD_MODE")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent uploader invocations of the Map")
+    parser.add_argument("--stream-rate", type=float, default=0, help="per-connection cap in MiB/s, 0 to disable")
+    parser.add_argument("--batch-target", type=int, default=0, help="BATCH_TARGET_MIB, 0 for one part per invocation")
+    parser.add_argument("--single-upload-max", type=int, default=0, help="SINGLE_UPLOAD_MAX_MIB for a single PutObject")
+    args = parser.parse_args()
+
+    for name, value in {
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "LOGGER_LEVEL": "WARNING",
+    }.items():
+        os.environ.setdefault(name, value)
+    os.environ["BATCH_TARGET_MIB"] = str(args.batch_target)
+    os.environ["SINGLE_UPLOAD_MAX_MIB"] = str(args.single_upload_max)
+    # removed with its files when the benchmark exits
+    staging = TemporaryDirectory(prefix="staging-")
+    os.environ["STAGING_DIR"] = staging.name
+
+    files = {f"file-{size}.bin": size * MiB for size in args.file_size}
+    with RangeServer(files, args.stream_rate * MiB or None) as server:
+        print(" ".join(f"{column:>8}" for column in COLUMNS))
+        for mode in args.mode:
+            os.environ["UPLOAD_MODE"] = mode
+            for name, total in files.items():
+                for part_size in args.part_size:
+                    # a fresh interpreter per configuration, as ru_maxrss never goes down within a process
+                    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                        size, latencies, seconds, rss, disk_peak = executor.submit(
+                            run_configuration, server.url(name), part_size * MiB, args.concurrency, staging.name
+                        ).result()
+
+                    if size != total:
+                        raise ValueError(f"uploaded {size} bytes, expected {total}")
+
+                    p50, p99 = percentiles(latencies)
+                    print(
+                        f"{mode:>8} {total // MiB:>8} {part_size:>8} {total / seconds / 1e6:>8.1f} "
+                        f"{p50:>8.2f} {p99:>8.2f} {rss:>8.0f} {disk_peak / MiB:>8.0f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
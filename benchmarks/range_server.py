@@ -0,0 +1,129 @@
+import re
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Optional
+
+PATTERN_SIZE = 251
+BLOCK_SIZE = 64 * 1024
+PATTERN = bytes(range(PATTERN_SIZE)) * (BLOCK_SIZE // PATTERN_SIZE + 2)
+
+
+def synthetic_bytes(offset: int, length: int) -> bytes:
+    """Deterministic file content, byte ``i`` of every file is ``i % 251``."""
+    result = bytearray()
+    while len(result) < length:
+        shift = (offset + len(result)) % PATTERN_SIZE
+        result += PATTERN[shift : shift + min(length - len(result), BLOCK_SIZE)]
+
+    return bytes(result)
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    range_pattern = re.compile(r"bytes=(\d+)-(\d*)")
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        size = self.server.files.get(self.path)
+        if size is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        size = self.server.files.get(self.path)
+        if size is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        start, end, status = 0, size - 1, HTTPStatus.OK
+        match = self.range_pattern.fullmatch(self.headers.get("Range", ""))
+        if match is not None:
+            start, status = int(match.group(1)), HTTPStatus.PARTIAL_CONTENT
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+
+        if start >= size:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        try:
+            self.write_body(start, end)
+        except ConnectionError:
+            # the client gave up on the response, as a hedged or failed part does
+            self.close_connection = True
+
+    def write_body(self, start: int, end: int) -> None:
+        # emulates a straggler, a response held up by a slow origin edge or a degraded connection
+        if self.server.is_straggler():
+            sleep(self.server.straggler_delay)
+
+        began, sent = monotonic(), 0
+        for offset in range(start, end + 1, BLOCK_SIZE):
+            block = synthetic_bytes(offset, min(BLOCK_SIZE, end + 1 - offset))
+            self.wfile.write(block)
+            sent += len(block)
+
+            # emulates the per-connection throughput cap of a single TCP stream from a remote origin
+            if self.server.stream_rate is not None:
+                ahead = sent / self.server.stream_rate - (monotonic() - began)
+                if ahead > 0:
+                    sleep(ahead)
+
+
+class RangeServer:
+    """Local HTTP server which serves synthetic files of the given sizes and honours ``Range`` requests.
+
+    A ``stragglers`` fraction of the responses, picked at random from ``seed``, stall ``straggler_delay`` seconds.
+    """
+
+    def __init__(
+        self,
+        files: dict[str, int],
+        stream_rate: Optional[float] = None,
+        stragglers: float = 0.0,
+        straggler_delay: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+        self._server.daemon_threads = True
+        self._server.files = {f"/{name}": size for name, size in files.items()}
+        self._server.stream_rate = stream_rate
+        self._server.straggler_delay = straggler_delay
+        random, lock = Random(seed), Lock()
+
+        def is_straggler() -> bool:
+            with lock:
+                return random.random() < stragglers
+
+        self._server.is_straggler = is_straggler
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self) -> "RangeServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._server.shutdown()
+        self._server.server_close()
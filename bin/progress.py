@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+from argparse import ArgumentParser
+from time import sleep
+from typing import Optional
+
+from shared.progress import DEFAULT_WINDOW_SECONDS, get_progress, get_store, list_uploads
+
+COLUMNS = ("key", "percent", "MB/s", "ETA s", "parts", "upload")
+
+
+def format_value(value: Optional[float]) -> str:
+    return "-" if value is None else str(value)
+
+
+def report(location: Optional[str], uploads: list[str], window: float) -> None:
+    store = get_store(location)
+    if store is None:
+        raise ValueError("either --store or PROGRESS_STORE is required")
+
+    print(f"{COLUMNS[0]:<32} " + " ".join(f"{column:>8}" for column in COLUMNS[1:-1]) + f" {COLUMNS[-1]}")
+    for upload_id in uploads or list_uploads(store):
+        try:
+            progress = get_progress(store, upload_id, window=window)
+        except ValueError:
+            # nothing recorded yet, or the records have expired
+            progress = {"Key": "-", "PercentComplete": None, "MBps": None, "ETASeconds": None, "PartsCompleted": 0}
+
+        values = (progress["PercentComplete"], progress["MBps"], progress["ETASeconds"], progress["PartsCompleted"])
+        print(f"{progress['Key'] or '-':<32} " + " ".join(f"{format_value(v):>8}" for v in values) + f" {upload_id}")
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Percent complete, aggregate MB/s and projected completion of uploads.")
+    parser.add_argument("uploads", nargs="*", help="multipart upload ids, or keys of single uploads, all by default")
+    parser.add_argument("--store", help="s3://bucket/prefix or a local directory, PROGRESS_STORE by default")
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW_SECONDS, help="seconds the MB/s is taken over")
+    parser.add_argument("--watch", type=float, default=0, help="seconds between reports, 0 to report once")
+    args = parser.parse_args()
+
+    report(args.store, args.uploads, args.window)
+    while args.watch > 0:
+        sleep(args.watch)
+        print()
+        report(args.store, args.uploads, args.window)
+
+
+if __name__ == "__main__":
+    main()
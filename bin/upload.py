@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import os
+import sys
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import Union
+
+from executor.engine import DEFAULT_CONCURRENCY, upload_file
+from partitioner.index import AUTO_TASK_SIZE, Logger, UploadMode
+from shared import metrics
+from shared.connection import DEFAULT_POOL_SIZE
+from shared.metrics import MetricsCollector
+
+
+def task_size(value: str) -> Union[int, str]:
+    return value if value == AUTO_TASK_SIZE else int(value)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Uploads urls to S3 in this process, the way the upload state machine does.")
+    parser.add_argument("urls", nargs="+", help="urls to upload, one after another, each to its file name")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="parts uploaded at a time")
+    parser.add_argument("--task-size", type=task_size, default=AUTO_TASK_SIZE, help="part size in bytes, or auto")
+    parser.add_argument("--checksum-algorithm", default="CRC32", help="CRC32, SHA1, SHA256 or none")
+    parser.add_argument("--compression", default="identity")
+    parser.add_argument("--resume", action="store_true", help="keep the uploaded parts of a failed upload")
+    parser.add_argument("--emf", action="store_true", help="print the metrics record of every file")
+    args = parser.parse_args()
+
+    Logger.init(os.getenv("LOGGER_LEVEL", "INFO"))
+    # every part stream needs a connection of its own, or the pool keeps discarding them
+    parts = args.concurrency * int(os.getenv("DOWNLOAD_CONCURRENCY", 1))
+    os.environ.setdefault("HTTP_POOL_SIZE", str(max(parts, DEFAULT_POOL_SIZE)))
+    os.environ.setdefault("ORIGIN_CONCURRENCY", str(parts))
+    if not args.emf:
+        metrics.set_sink(MetricsCollector())
+
+    failed = 0
+    for url in args.urls:
+        began = perf_counter()
+        try:
+            result = upload_file(
+                url,
+                args.bucket,
+                args.concurrency,
+                SingleTaskSize=args.task_size,
+                ChecksumAlgorithm=None if args.checksum_algorithm == "none" else args.checksum_algorithm,
+                Compression=args.compression,
+                Resume=args.resume,
+            )
+        except Exception as e:
+            failed += 1
+            print(f"failed to upload {url}: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+
+        if result["Mode"] == UploadMode.UNCHANGED:
+            print(f"s3://{result['Bucket']}/{result['Key']} is unchanged, skipped")
+            continue
+
+        seconds, total = perf_counter() - began, result["Plan"]["TotalSize"]
+        print(
+            f"s3://{result['Bucket']}/{result['Key']} {total} bytes in {result.get('PartCount', 1)} parts, "
+            f"{seconds:.1f} s, {total / seconds / 1e6:.1f} MB/s"
+        )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from functools import partial
+from random import uniform
+from threading import Event
+from typing import Callable, Optional, TypeVar
+
+from loguru import logger
+
+from partitioner.index import UploadMode, get_create_args, plan_upload
+from shared import metrics, progress
+from shared.connection import get_s3_client
+from shared.constants import MAX_PARTS
+from uploader.index import record_throughput, upload_parts
+
+DEFAULT_CONCURRENCY = 16
+# the defaults the state machine merges into its input
+INPUT_DEFAULTS = {"SingleTaskSize": "auto", "Resume": False, "ChecksumAlgorithm": "CRC32", "Compression": "identity"}
+ALL_ERRORS = "States.ALL"
+# the Retry of the Map's "Upload File Part" and of "Upload Single Object", less the Lambda service errors which an
+# upload run in process cannot raise
+UPLOAD_RETRY = [
+    {
+        "ErrorEquals": ["ThrottledError"],
+        "IntervalSeconds": 5,
+        "MaxAttempts": 6,
+        "BackoffRate": 2,
+        "MaxDelaySeconds": 120,
+        "JitterStrategy": "FULL",
+    },
+    {"ErrorEquals": ["SourceChangedError"], "MaxAttempts": 0},
+    {"ErrorEquals": [ALL_ERRORS], "MaxAttempts": 3},
+]
+BATCH_FIELDS = ("URL", "Bucket", "Key", "ChecksumAlgorithm", "IfRange", "Compression", "Hedge", "CopySource")
+SINGLE_FIELDS = (*BATCH_FIELDS, "Metadata")
+
+T = TypeVar("T")
+
+
+def get_retry_delay(retry: list[dict], attempts: list[int], error: Exception) -> Optional[float]:
+    """Seconds to wait before retrying after ``error`` the way Step Functions does, or None once the first retrier
+    which matches its name is out of attempts. ``attempts`` holds the retries taken by every retrier so far."""
+    for idx, retrier in enumerate(retry):
+        if type(error).__name__ not in retrier["ErrorEquals"] and ALL_ERRORS not in retrier["ErrorEquals"]:
+            continue
+
+        if attempts[idx] >= retrier.get("MaxAttempts", 3):
+            return None
+
+        delay = retrier.get("IntervalSeconds", 1) * retrier.get("BackoffRate", 2.0) ** attempts[idx]
+        delay = min(delay, retrier.get("MaxDelaySeconds", delay))
+        attempts[idx] += 1
+        return uniform(0, delay) if retrier.get("JitterStrategy") == "FULL" else delay
+
+    return None
+
+
+def run_with_retry(call: Callable[[], T], retry: list[dict], stopped: Optional[Event] = None) -> T:
+    """Calls ``call`` until it succeeds or ``retry`` gives up, waiting out each delay unless ``stopped`` is set."""
+    stopped = stopped or Event()
+    attempts = [0] * len(retry)
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            delay = get_retry_delay(retry, attempts, e)
+            if delay is None:
+                raise
+
+            logger.warning(f"retrying in {delay:.1f} seconds after {type(e).__name__}: {e}")
+            if stopped.wait(delay):
+                raise
+
+
+def upload_tasks(batch_input: dict, tasks: list[dict], concurrency: int) -> list[dict]:
+    """Uploads every task on its own, ``concurrency`` at a time, and retries it like an iteration of the Map.
+
+    Like a Map without tolerated failures, the first part which fails for good cancels the parts not started yet,
+    and the error is raised once the running ones are done.
+    """
+    stopped = Event()
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = [
+            executor.submit(run_with_retry, partial(upload_parts, batch_input, [task]), UPLOAD_RETRY, stopped)
+            for task in tasks
+        ]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        stopped.set()
+        for future in pending:
+            future.cancel()
+
+    errors = [future.exception() for future in done if future.exception() is not None]
+    if errors:
+        raise errors[0]
+
+    return sorted((part for future in futures for part in future.result()), key=lambda part: part["PartNumber"])
+
+
+def upload_multipart(upload: dict, tasks: list[dict], concurrency: int) -> dict:
+    s3, bucket, key = get_s3_client(), upload["Bucket"], upload["Key"]
+    part_count = upload["Plan"]["PartCount"]
+    if not 0 < part_count <= MAX_PARTS:
+        raise ValueError(f"{upload['URL']} is planned in {part_count} parts, not 1 to {MAX_PARTS}")
+
+    upload_id = upload["MultipartUpload"].get("UploadId")
+    if upload_id is None:
+        create_args = get_create_args(upload["ChecksumAlgorithm"], upload["Compression"], upload["Metadata"])
+        upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, **create_args)["UploadId"]
+
+    batch_input = {
+        **{name: upload[name] for name in BATCH_FIELDS},
+        "MultipartUploadId": upload_id,
+        "TotalSize": upload["Plan"]["TotalSize"],
+    }
+    try:
+        parts = upload_tasks(batch_input, tasks, concurrency)
+        resp = s3.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        # a resumable upload keeps its uploaded parts, so running it again only transfers the missing ones
+        if not upload["Resume"]:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+    return {"ETag": resp["ETag"], "MultipartUploadId": upload_id, "PartCount": len(parts)}
+
+
+def upload_file(url: str, bucket: str, concurrency: int = DEFAULT_CONCURRENCY, **options) -> dict:
+    """Runs the upload state machine for ``url`` in this process: partitions it, then uploads it in one
+    ``PutObject`` or as a multipart upload of ``concurrency`` parts at a time, which is completed, or aborted on
+    failure unless it is resumable. ``options`` are the rest of the state machine input, such as ``Resume``."""
+    event = {**INPUT_DEFAULTS, **options, "URL": url, "Bucket": bucket, "Concurrency": concurrency}
+
+    with metrics.invocation("executor") as m:
+        try:
+            with progress.recording():
+                upload, tasks = plan_upload(event)
+                if upload["Mode"] == UploadMode.UNCHANGED:
+                    result = {}
+                elif upload["Mode"] == UploadMode.SINGLE:
+                    file = {name: upload[name] for name in SINGLE_FIELDS}
+                    result = run_with_retry(lambda: upload_parts(file, [upload["Task"]])[0], UPLOAD_RETRY)
+                else:
+                    result = upload_multipart(upload, tasks, concurrency)
+        finally:
+            record_throughput(m)
+
+    if upload["Mode"] != UploadMode.UNCHANGED:
+        logger.info(f"uploaded {url} to s3://{bucket}/{upload['Key']}")
+    return {"Bucket": bucket, "Key": upload["Key"], "Mode": upload["Mode"], "Plan": upload["Plan"], **result}
@@ -0,0 +1,6 @@
+from partitioner import probe
+from shared.tests.fixtures import reset_fixture
+from uploader import buffers, hedge
+
+# autouse, clears what the partitioner and uploader it runs keep besides the shared clients and limiters
+reset = reset_fixture(probe.reset, buffers.reset, hedge.reset)
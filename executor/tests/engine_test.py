@@ -0,0 +1,129 @@
+from http import HTTPStatus
+
+import boto3
+import pytest
+import requests_mock
+from moto import mock_s3
+
+from executor.engine import ALL_ERRORS, UPLOAD_RETRY, get_retry_delay, upload_file
+from shared import metrics
+from shared.constants import MiB
+from shared.metrics import MetricsCollector
+from shared.tests.fixtures import serve_range
+from shared.throttle import ThrottledError
+from uploader.index import SourceChangedError
+
+URL = "https://download.test/file_name.bin"
+ETAG = '"v1"'
+
+
+class TestEngine:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    @pytest.fixture(scope="function", autouse=True)
+    def collector(self):
+        metrics.reset()
+        collector = MetricsCollector()
+        metrics.set_sink(collector)
+        yield collector
+        metrics.reset()
+
+    @pytest.fixture(scope="function")
+    def s3_client(self):
+        with mock_s3():
+            s3_client = boto3.client("s3")
+            s3_client.create_bucket(Bucket="bucket_name")
+            yield s3_client
+
+    def origin(self, mock: requests_mock.Mocker, content: bytes, **kwargs) -> None:
+        mock.head(URL, headers={"Accept-Ranges": "bytes", "Content-Length": str(len(content)), "ETag": ETAG})
+        mock.get(URL, content=serve_range(content, **kwargs))
+
+    @pytest.mark.parametrize(
+        "retry,error,expected",
+        [
+            (UPLOAD_RETRY, ValueError("failed"), [1, 2, 4, None]),
+            (UPLOAD_RETRY, SourceChangedError("changed"), [None]),
+            (
+                [{"ErrorEquals": ["ThrottledError"], "IntervalSeconds": 5, "MaxAttempts": 2}],
+                ThrottledError(),
+                [5, 10, None],
+            ),
+            ([{"ErrorEquals": [ALL_ERRORS], "IntervalSeconds": 10, "MaxDelaySeconds": 15}], ValueError(), [10, 15, 15]),
+            ([{"ErrorEquals": ["ThrottledError"]}], ValueError("failed"), [None]),
+        ],
+    )
+    def test_get_retry_delay(self, retry: list[dict], error: Exception, expected: list) -> None:
+        attempts = [0] * len(retry)
+
+        assert [get_retry_delay(retry, attempts, error) for _ in expected] == expected
+
+    def test_get_retry_delay_with_jitter(self) -> None:
+        attempts = [0] * len(UPLOAD_RETRY)
+        delays = [get_retry_delay(UPLOAD_RETRY, attempts, ThrottledError("throttled")) for _ in range(7)]
+
+        assert all(0 <= delay <= cap for delay, cap in zip(delays, [5, 10, 20, 40, 80, 120]))
+        assert delays[-1] is None
+
+    @pytest.mark.parametrize(
+        "mocked_env", [{"SINGLE_UPLOAD_MAX_MIB": "0", "HTTP_RETRIES": "0", "LOGGER_LEVEL": "INFO"}], indirect=True
+    )
+    def test_upload_file(self, collector, s3_client, mocked_env) -> None:
+        content = bytes(range(256)) * (11 * MiB // 256)
+        with requests_mock.Mocker() as mock:
+            # the failed part is retried like an iteration of the Map
+            self.origin(mock, content, failures=1)
+            result = upload_file(URL, "bucket_name", 4, SingleTaskSize=5 * MiB, ChecksumAlgorithm=None)
+
+        assert (result["Key"], result["Mode"], result["PartCount"]) == ("file_name.bin", "multipart", 3)
+        assert s3_client.get_object(Bucket="bucket_name", Key="file_name.bin")["Body"].read() == content
+        assert collector.total("BytesTransferred") == len(content)
+        assert len(collector.records) == 1
+
+    @pytest.mark.parametrize("mocked_env", [{"SINGLE_UPLOAD_MAX_MIB": "0", "LOGGER_LEVEL": "INFO"}], indirect=True)
+    @pytest.mark.parametrize("resume", [False, True])
+    def test_upload_file_aborts_on_failure(self, s3_client, mocked_env, resume: bool) -> None:
+        content = bytes(11 * MiB)
+        with requests_mock.Mocker() as mock, pytest.raises(SourceChangedError):
+            # the file changed after it was planned, so every part fails without a retry
+            self.origin(mock, content, failures=3, status_code=HTTPStatus.OK)
+            upload_file(URL, "bucket_name", 1, SingleTaskSize=5 * MiB, ChecksumAlgorithm=None, Resume=resume)
+
+        assert len(s3_client.list_multipart_uploads(Bucket="bucket_name").get("Uploads", [])) == int(resume)
+
+    def test_upload_file_with_single_object(self, s3_client) -> None:
+        content = b"0123456789" * 10
+        with requests_mock.Mocker() as mock:
+            self.origin(mock, content)
+            result = upload_file(URL, "bucket_name")
+
+        head = s3_client.head_object(Bucket="bucket_name", Key="file_name.bin")
+        assert (result["Mode"], result["ETag"], "ChecksumCRC32" in result) == ("single", head["ETag"], True)
+        assert s3_client.get_object(Bucket="bucket_name", Key="file_name.bin")["Body"].read() == content
+
+    def test_upload_file_unchanged(self, collector, s3_client) -> None:
+        content = b"0123456789" * 10
+        with requests_mock.Mocker() as mock:
+            self.origin(mock, content)
+            upload_file(URL, "bucket_name")
+            result = upload_file(URL, "bucket_name")
+
+        # the source is probed once and downloaded once, for the first upload only
+        assert (result["Mode"], mock.call_count) == ("unchanged", 2)
+        assert collector.total("UnchangedCount") == 1
+
+    @pytest.mark.parametrize("mocked_env", [{"SINGLE_UPLOAD_MAX_MIB": "0", "LOGGER_LEVEL": "INFO"}], indirect=True)
+    def test_upload_file_with_s3_source(self, collector, s3_client, mocked_env) -> None:
+        content = bytes(range(256)) * (11 * MiB // 256)
+        s3_client.create_bucket(Bucket="source-bucket")
+        s3_client.put_object(Bucket="source-bucket", Key="dir/file_name.bin", Body=content)
+
+        with requests_mock.Mocker() as mock:
+            result = upload_file("s3://source-bucket/dir/file_name.bin", "bucket_name", 4, SingleTaskSize=5 * MiB)
+
+        assert (result["Key"], result["PartCount"], mock.call_count) == ("file_name.bin", 3, 0)
+        assert s3_client.get_object(Bucket="bucket_name", Key="file_name.bin")["Body"].read() == content
+        assert collector.total("CopiedBytes") == len(content)
@@ -0,0 +1,244 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from os import getenv
+from typing import Optional, Tuple
+
+from loguru import logger
+from requests import RequestException
+
+from shared import metrics
+from shared.connection import get_s3_client
+from shared.constants import MiB
+
+from .complete import IncompleteUploadError, complete_multipart_upload
+from .dedup import get_source_metadata, is_unchanged
+from .index import (
+    DEFAULT_BATCH_TARGET,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_PART_OVERHEAD,
+    DEFAULT_PART_THROUGHPUT,
+    DEFAULT_SINGLE_UPLOAD_MAX,
+    Logger,
+    UploadMode,
+    get_checksum_algorithm,
+    get_compression,
+    get_copy_source,
+    get_create_args,
+    get_error,
+    get_file_name,
+    get_hedge,
+    get_metadata,
+    get_task_size,
+    get_tasks,
+    write_manifest,
+)
+from .planner import plan_ranges, validate_multipart_plan
+from .probe import probe
+
+DEFAULT_PLAN_CONCURRENCY = 16
+
+
+def read_json(location: dict):
+    return json.loads(get_s3_client().get_object(Bucket=location["Bucket"], Key=location["Key"])["Body"].read())
+
+
+def get_urls(event: dict) -> list[str]:
+    """Reads the urls to upload from ``URLs``, or from the JSON list in the S3 object at ``Manifest``."""
+    if "URLs" in event:
+        urls = event["URLs"]
+    elif "Manifest" in event:
+        urls = read_json(event["Manifest"])
+    else:
+        raise ValueError("either URLs or Manifest is required")
+
+    urls = [url["URL"] if isinstance(url, dict) else url for url in urls]
+    if not urls:
+        raise ValueError("no url to upload")
+
+    keys = {}
+    for url in urls:
+        key = get_file_name(url)
+        if key in keys:
+            raise ValueError(f"{url} and {keys[key]} would both be uploaded to {key}")
+
+        keys[key] = url
+
+    return urls
+
+
+def plan_file(event: dict, url: str, concurrency: int) -> Tuple[dict, list[dict]]:
+    """Plans one file of a bulk upload, returning the file and its tasks.
+
+    Every task carries its file, so tasks of different files can share a batch. A file which cannot be planned
+    is returned with its ``Error`` and no tasks, so the rest of the files are still uploaded.
+    """
+    bucket, key = event.get("Bucket"), get_file_name(url)
+    algorithm, compression = get_checksum_algorithm(event), get_compression(event)
+    file = {"URL": url, "Bucket": bucket, "Key": key, "ChecksumAlgorithm": algorithm, "Compression": compression}
+    overhead = float(getenv("PART_OVERHEAD_SECONDS", DEFAULT_PART_OVERHEAD))
+    throughput = float(getenv("PART_THROUGHPUT_MIB", DEFAULT_PART_THROUGHPUT)) * MiB
+
+    from botocore.exceptions import ClientError
+
+    try:
+        with metrics.timed("ProbeSeconds"):
+            source = probe(url)
+
+        total = source["TotalSize"]
+        # the uploader reports progress against TotalSize, and pads every compressed part short of it
+        file.update(IfRange=source["IfRange"], TotalSize=total, CopySource=get_copy_source(url, source, compression))
+        source_metadata = get_source_metadata(url, source)
+        if is_unchanged(bucket, key, {**get_metadata(compression, total, total), **source_metadata}):
+            logger.info(f"{url} is unchanged since it was uploaded to s3://{bucket}/{key}, skipping it")
+            return {**file, "Mode": UploadMode.UNCHANGED}, []
+
+        if total <= int(getenv("SINGLE_UPLOAD_MAX_MIB", DEFAULT_SINGLE_UPLOAD_MAX)) * MiB:
+            file["Hedge"] = get_hedge(total, overhead, throughput)
+            file["Metadata"] = {**get_metadata(compression, total, total), **source_metadata}
+            return {**file, "Mode": UploadMode.SINGLE}, [{**file, "index": 1, "start": 0, "end": total - 1}]
+
+        ranges = plan_ranges(total, get_task_size(event, total, concurrency, overhead, throughput))
+        validate_multipart_plan(ranges)
+        file["Hedge"] = get_hedge(ranges.part_size, overhead, throughput)
+        file["Metadata"] = {**get_metadata(compression, ranges.part_size, total), **source_metadata}
+        create_args = get_create_args(algorithm, compression, file["Metadata"])
+        resp = get_s3_client().create_multipart_upload(Bucket=bucket, Key=key, **create_args)
+    except (ValueError, RequestException, ClientError) as e:
+        # an origin which cannot be reached fails its own file, not the whole bulk upload
+        logger.error(f"failed to plan {url}: {e}")
+        return {**file, "Error": str(e)}, []
+
+    file["MultipartUploadId"] = resp["UploadId"]
+    tasks = [{**file, **task} for task in get_tasks(ranges)]
+
+    return {**file, "Mode": UploadMode.MULTIPART, "PartSize": ranges.part_size}, tasks
+
+
+def abort_uploads(files: list[dict]) -> None:
+    for file in files:
+        if file.get("MultipartUploadId") is not None:
+            get_s3_client().abort_multipart_upload(
+                Bucket=file["Bucket"], Key=file["Key"], UploadId=file["MultipartUploadId"]
+            )
+
+
+def batch_tasks(tasks: list[dict], concurrency: int, target: int) -> list[dict]:
+    """Groups tasks of about ``target`` bytes into one uploader invocation, so small files share an invocation
+    and parts of large files get one each, but never so many that fewer than ``concurrency`` invocations are left
+    to run in parallel."""
+    limit = max(1, min(target, ceil(sum(task["end"] - task["start"] + 1 for task in tasks) / concurrency)))
+    batches, size = [], 0
+    for task in tasks:
+        task_size = task["end"] - task["start"] + 1
+        if not batches or size + task_size > limit:
+            batches.append({"Items": []})
+            size = 0
+
+        batches[-1]["Items"].append(task)
+        size += task_size
+
+    return batches
+
+
+def plan_handler(event, context):
+    Logger.init(getenv("LOGGER_LEVEL"))
+    logger.debug(event)
+    bucket = event.get("Bucket")
+    concurrency = event.get("Concurrency", DEFAULT_CONCURRENCY)
+    batch_target = int(getenv("BATCH_TARGET_MIB", DEFAULT_BATCH_TARGET)) * MiB
+
+    with metrics.invocation("bulk-planner"):
+        try:
+            get_checksum_algorithm(event)
+            urls = get_urls(event)
+        except ValueError as e:
+            logger.error(e)
+            return get_error(str(e))
+
+        with ThreadPoolExecutor(int(getenv("PLAN_CONCURRENCY", DEFAULT_PLAN_CONCURRENCY))) as executor:
+            futures = [executor.submit(plan_file, event, url, concurrency) for url in urls]
+
+        planned = [future.result() for future in futures if future.exception() is None]
+        files = [file for file, _ in planned]
+        try:
+            errors = [future.exception() for future in futures if future.exception() is not None]
+            if errors:
+                raise errors[0]
+
+            tasks = [task for _, file_tasks in planned for task in file_tasks]
+            batches = batch_tasks(tasks, concurrency, batch_target)
+            result = {
+                "Bucket": bucket,
+                "FileCount": len(files),
+                "TaskCount": len(tasks),
+                "BatchCount": len(batches),
+                "Files": write_manifest(bucket, files),
+                "Manifest": write_manifest(bucket, batches),
+            }
+        except Exception:
+            # no completer runs for a failed plan, so nothing else would ever abort its uploads
+            abort_uploads(files)
+            raise
+
+        metrics.add("FileCount", len(files))
+        metrics.add("PartCount", len(tasks))
+        metrics.add("UnchangedCount", sum(file.get("Mode") == UploadMode.UNCHANGED for file in files))
+        logger.info(f"bulk upload plan: {len(files)} files, {len(tasks)} tasks in {len(batches)} batches")
+
+        return result
+
+
+def complete_file(file: dict) -> Optional[str]:
+    """Completes the multipart upload of a file once all of its parts are uploaded, or aborts it, returning
+    why the file was not uploaded, if it was not."""
+    if "Error" in file:
+        return file["Error"]
+
+    if file["Mode"] == UploadMode.UNCHANGED:
+        return None
+
+    s3, bucket, key = get_s3_client(), file["Bucket"], file["Key"]
+    if file["Mode"] == UploadMode.SINGLE:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = s3.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            return str(e)
+
+        # an object left by an earlier upload may have the same size, but not the validator of this version
+        validator = head.get("Metadata", {}).get("source-validator")
+        if file["IfRange"] is not None and validator != file["IfRange"]:
+            return f"uploaded version {validator}, expected {file['IfRange']}"
+
+        # a compressed object is checked against the source size it records
+        size = int(head.get("Metadata", {}).get("uncompressed-size", head["ContentLength"]))
+        return None if size == file["TotalSize"] else f"uploaded {size} bytes, expected {file['TotalSize']}"
+
+    try:
+        complete_multipart_upload(file)
+    except IncompleteUploadError as e:
+        s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=file["MultipartUploadId"])
+        return str(e)
+
+    return None
+
+
+def complete_handler(event, context):
+    Logger.init(getenv("LOGGER_LEVEL"))
+    logger.debug(event)
+
+    with metrics.invocation("bulk-completer"):
+        files = read_json(event["Files"])
+        with ThreadPoolExecutor(int(getenv("PLAN_CONCURRENCY", DEFAULT_PLAN_CONCURRENCY))) as executor:
+            errors = list(executor.map(complete_file, files))
+
+        failed = [{"URL": file["URL"], "Error": error} for file, error in zip(files, errors) if error is not None]
+        for file in failed:
+            logger.error(f"failed to upload {file['URL']}: {file['Error']}")
+
+        metrics.add("FailedCount", len(failed))
+        logger.info(f"bulk upload completed: {len(files) - len(failed)} of {len(files)} files uploaded")
+
+        return {"Completed": len(files) - len(failed), "Failed": failed}
@@ -0,0 +1,56 @@
+from os import getenv
+
+from loguru import logger
+
+from shared import metrics
+from shared.connection import get_s3_client
+from shared.constants import CHECKSUM_FIELDS
+
+from .index import Logger
+from .planner import plan_ranges
+from .resume import list_uploaded_parts
+
+
+class IncompleteUploadError(ValueError):
+    pass
+
+
+def complete_multipart_upload(file: dict) -> dict:
+    """Completes the multipart upload of a file from its parts as S3 lists them, so the Map results never pass
+    through the state. Raises IncompleteUploadError, leaving the upload as it is, while a part is missing."""
+    s3, bucket, key, upload_id = get_s3_client(), file["Bucket"], file["Key"], file["MultipartUploadId"]
+    ranges = plan_ranges(file["TotalSize"], file["PartSize"])
+    uploaded = list_uploaded_parts(bucket, key, upload_id)
+    # the size of a compressed part is not known up front, so it only has to be there
+    sizes = [None if file.get("Compression") else end - start + 1 for start, end in ranges]
+    missing = [
+        idx + 1
+        for idx, size in enumerate(sizes)
+        if idx + 1 not in uploaded or size not in (None, uploaded[idx + 1].get("Size"))
+    ]
+    if missing:
+        raise IncompleteUploadError(f"{len(missing)} of {len(ranges)} parts are not uploaded")
+
+    parts = [
+        {
+            "ETag": part["ETag"],
+            "PartNumber": part_num,
+            **{field: part[field] for field in CHECKSUM_FIELDS if field in part},
+        }
+        for part_num, part in sorted(uploaded.items())
+    ]
+    resp = s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+
+    return {"ETag": resp["ETag"], "PartCount": len(parts)}
+
+
+def handler(event, context):
+    Logger.init(getenv("LOGGER_LEVEL"))
+    logger.debug(event)
+
+    # a failure is raised, so the state machine decides whether to keep the uploaded parts
+    with metrics.invocation("completer"):
+        result = complete_multipart_upload(event)
+        logger.info(f"completed upload {event['MultipartUploadId']} of {event['Key']} in {result['PartCount']} parts")
+
+        return result
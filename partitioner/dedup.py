@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+from hashlib import sha256
+from os import getenv
+from typing import Optional
+
+from loguru import logger
+
+from shared.connection import get_s3_client
+
+DEFAULT_DEDUP_TTL_HOURS = 168
+SOURCE_FIELDS = ("source-id", "source-size", "source-validator")
+
+
+def get_source_metadata(url: str, source: dict) -> dict:
+    """Object metadata which identifies the source an object is uploaded from, so a later run can tell whether it
+    changed since. A source without a validator cannot be told apart from a changed one, so it gets none."""
+    if source.get("IfRange") is None:
+        return {}
+
+    # a presigned url is signed anew every time, while the object it points to stays the same
+    location = source.get("CopySource")
+    source_id = f"s3://{location['Bucket']}/{location['Key']}" if location else url
+    return {
+        # the url may be longer than the 2 KB S3 allows for all of the metadata
+        "source-id": sha256(source_id.encode()).hexdigest(),
+        "source-size": str(source["TotalSize"]),
+        "source-validator": source["IfRange"],
+    }
+
+
+def is_unchanged(bucket: str, key: str, metadata: dict, now: Optional[datetime] = None) -> bool:
+    """Whether ``key`` was uploaded from the source ``metadata`` identifies, with the same size, validator and
+    compression, less than ``DEDUP_TTL_HOURS`` ago.
+
+    The object itself is the index entry: its metadata is written with it by ``PutObject`` or
+    ``CompleteMultipartUpload``, so concurrent runs never see a partial entry, and an entry goes with its object
+    when it is overwritten, deleted or expired. ``DEDUP_TTL_HOURS=0`` turns the lookup off.
+    """
+    ttl = float(getenv("DEDUP_TTL_HOURS", DEFAULT_DEDUP_TTL_HOURS)) * 3600
+    if not ttl or not metadata.get("source-validator"):
+        return False
+
+    from botocore.exceptions import ClientError
+
+    try:
+        head = get_s3_client().head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        logger.debug(f"s3://{bucket}/{key} is not uploaded yet: {e}")
+        return False
+
+    stored = head.get("Metadata", {})
+    if any(stored.get(name) != metadata.get(name) for name in (*SOURCE_FIELDS, "compression")):
+        return False
+
+    age = ((now or datetime.now(timezone.utc)) - head["LastModified"]).total_seconds()
+    return age < ttl
@@ -1,12 +1,42 @@
+import json
 import logging
 from math import ceil
 from os import getenv
 from os.path import basename
 from sys import stdout
-from typing import Optional, Union
+from typing import Iterable, Optional, Tuple, Union
+from urllib.parse import urlsplit
+from uuid import uuid4
 
 from loguru import logger
-from requests import head
+
+from shared import metrics
+from shared.connection import get_s3_client
+from shared.constants import COMPRESSIONS, MAX_PART_SIZE, MAX_PARTS, MIN_PART_SIZE, NO_COMPRESSION, MiB
+
+from .dedup import get_source_metadata, is_unchanged
+from .planner import RangePlan, plan_ranges, validate_multipart_plan
+from .probe import S3_SCHEME, probe
+from .resume import create_upload, find_upload_id, list_uploaded_parts, merge_uploaded_parts
+
+AUTO_TASK_SIZE = "auto"
+DEFAULT_CONCURRENCY = 100
+DEFAULT_PART_OVERHEAD = 1.0
+DEFAULT_PART_THROUGHPUT = 50
+DEFAULT_BATCH_TARGET = 256
+MANIFEST_PREFIX = "manifests"
+# CRC32C needs awscrt, which the uploader does not bundle, so every UploadPart would fail after the upload is created
+CHECKSUM_ALGORITHMS = ("CRC32", "SHA1", "SHA256")
+DEFAULT_SINGLE_UPLOAD_MAX = 64
+DEFAULT_COMPRESSED_PART_SIZE = 64
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_FACTOR = 2.0
+
+
+class UploadMode:
+    SINGLE = "single"
+    MULTIPART = "multipart"
+    UNCHANGED = "unchanged"
 
 
 class Logger:
@@ -24,56 +54,268 @@ class Logger:
 
 
 def get_file_name(url: str) -> str:
-    return basename(url)
+    # the query of a presigned url is not part of the name
+    return basename(urlsplit(url).path)
+
+
+def estimate_seconds(total: int, part_size: int, concurrency: int, overhead: float, throughput: float) -> float:
+    waves = ceil(len(plan_ranges(total, part_size)) / concurrency)
+    return waves * (overhead + min(part_size, total) / throughput)
+
+
+def plan_part_size(total: int, concurrency: int, overhead: float, throughput: float) -> int:
+    """Picks the part size with the lowest estimated wall-clock time within the S3 multipart upload limits.
+
+    Every wave of ``concurrency`` parts costs ``overhead`` seconds plus the time to transfer one part at
+    ``throughput`` bytes per second, so for each possible number of waves the smallest part size that
+    fits is the best candidate.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency {concurrency} must be at least 1")
+
+    if total > MAX_PART_SIZE * MAX_PARTS:
+        raise ValueError(f"file size {total} exceeds the maximum multipart upload size {MAX_PART_SIZE * MAX_PARTS}")
+
+    if total <= MIN_PART_SIZE:
+        return max(total, 1)
+
+    candidates = {
+        min(max(ceil(total / (waves * concurrency) / MiB) * MiB, MIN_PART_SIZE), MAX_PART_SIZE)
+        for waves in range(1, ceil(MAX_PARTS / concurrency) + 1)
+    }
+
+    return min(
+        (size for size in candidates if len(plan_ranges(total, size)) <= MAX_PARTS),
+        key=lambda size: (estimate_seconds(total, size, concurrency, overhead, throughput), size),
+    )
+
+
+def get_task_size(event: dict, total: int, concurrency: int, overhead: float, throughput: float) -> int:
+    size = event.get("SingleTaskSize")
+    if size is not None and size != AUTO_TASK_SIZE:
+        return size
+
+    size = plan_part_size(total, concurrency, overhead, throughput)
+    if get_compression(event) is not None:
+        # a compressed part is smaller than its source, and every part but the last must reach MIN_PART_SIZE
+        size = max(size, min(int(getenv("COMPRESSED_PART_MIB", DEFAULT_COMPRESSED_PART_SIZE)) * MiB, MAX_PART_SIZE))
+
+    return size
+
+
+def get_batch_size(ranges: RangePlan, concurrency: int, target: int) -> int:
+    """Groups small parts into batches of about ``target`` bytes per invocation, but never so many that
+    fewer than ``concurrency`` invocations are left to run in parallel."""
+    return max(1, min(target // ranges.part_size, ceil(len(ranges) / concurrency)))
+
+
+def get_plan(ranges: RangePlan, concurrency: int, overhead: float, throughput: float, batch_target: int) -> dict:
+    return {
+        "TotalSize": ranges.total,
+        "PartSize": ranges.part_size,
+        "PartCount": len(ranges),
+        "Concurrency": concurrency,
+        "Waves": ceil(len(ranges) / concurrency),
+        "BatchSize": get_batch_size(ranges, concurrency, batch_target),
+        "EstimatedSeconds": round(
+            estimate_seconds(ranges.total, ranges.part_size, concurrency, overhead, throughput), 1
+        ),
+    }
+
+
+def get_checksum_algorithm(event: dict) -> Optional[str]:
+    algorithm = event.get("ChecksumAlgorithm")
+    if algorithm is not None and algorithm not in CHECKSUM_ALGORITHMS:
+        raise ValueError(f"checksum algorithm {algorithm} is not one of {', '.join(CHECKSUM_ALGORITHMS)}")
+
+    return algorithm
+
+
+def get_compression(event: dict) -> Optional[str]:
+    compression = event.get("Compression")
+    if compression == NO_COMPRESSION:
+        return None
+
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"compression {compression} is not one of {', '.join(COMPRESSIONS)}")
 
+    return compression
 
-def get_file_size(url: str) -> int:
-    resp = head(url)
-    headers = resp.headers
 
-    if headers.get("Accept-Ranges") != "bytes":
-        raise ValueError("accept-range is not supported")
+def get_metadata(compression: Optional[str], part_size: int, total: int) -> dict:
+    """Object metadata of the layout of a compressed object, one member per part of ``part_size`` source bytes,
+    so a reader can fetch and decompress any part on its own."""
+    if compression is None:
+        return {}
 
-    size = headers.get("Content-Length")
-    if size is None:
-        raise ValueError("content-length is not found in response header")
+    return {"compression": compression, "compression-frame-size": str(part_size), "uncompressed-size": str(total)}
 
-    return int(size)
 
+def get_create_args(checksum_algorithm: Optional[str], compression: Optional[str], metadata: dict) -> dict:
+    """CreateMultipartUpload arguments of a file, a compressed object is served with its ``Content-Encoding``."""
+    create_args = {"ChecksumAlgorithm": checksum_algorithm, "ContentEncoding": compression, "Metadata": metadata}
+    return {name: value for name, value in create_args.items() if value}
 
-def split(total: int, size: int) -> list[(int, int)]:
-    result = []
-    for i in range(ceil(total / size)):
-        start = (size + min(1, i)) * i
-        end = min(start + size, total)
-        result.append((start, end))
 
-        if end == total:
-            break
+def get_copy_source(url: str, source: dict, compression: Optional[str]) -> dict:
+    """The object S3 copies the parts from, if the url is one, unless they are compressed, which only the uploader
+    can do with the bytes."""
+    copy_source = source.get("CopySource", {})
+    if not copy_source or compression is None:
+        return copy_source
 
-    return result
+    if url.startswith(S3_SCHEME):
+        raise ValueError(f"compression {compression} is not supported for {url}, which can only be copied")
 
+    return {}
 
-def get_tasks(tasks: list[(int, int)]) -> list[dict]:
+
+def get_hedge(part_size: int, overhead: float, throughput: float) -> dict:
+    """When the uploader starts a second attempt of a part still running: once it is slower than ``Percentile`` of
+    the parts its container completed, but never before ``MinSeconds``, ``HEDGE_FACTOR`` times the estimated part
+    time. ``HEDGE_PERCENTILE=0`` turns hedging off."""
+    percentile = int(getenv("HEDGE_PERCENTILE", DEFAULT_HEDGE_PERCENTILE))
+    if percentile <= 0:
+        return {}
+
+    factor = float(getenv("HEDGE_FACTOR", DEFAULT_HEDGE_FACTOR))
+    return {"Percentile": percentile, "MinSeconds": round(factor * (overhead + part_size / throughput), 1)}
+
+
+def get_tasks(tasks: Iterable[Tuple[int, int]]) -> list[dict]:
     return [{"index": idx + 1, "start": start, "end": end} for idx, (start, end) in enumerate(tasks)]
 
 
+def write_manifest(bucket: str, tasks: list[dict]) -> dict:
+    key = f"{MANIFEST_PREFIX}/{uuid4()}.json"
+    get_s3_client().put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(tasks, separators=(",", ":")).encode(),
+        ContentType="application/json",
+    )
+
+    return {"Bucket": bucket, "Key": key}
+
+
+def resume_tasks(bucket: str, key: str, tasks: list[dict], entry: dict, **create_args) -> Tuple[dict, list[dict]]:
+    """Resumes the upload of ``key`` created for the same source version and plan as ``entry``, or creates one
+    which a later run can resume."""
+    upload_id = find_upload_id(bucket, key, entry)
+    if upload_id is None:
+        return {"UploadId": create_upload(bucket, key, entry, **create_args)}, tasks
+
+    resumed = merge_uploaded_parts(tasks, list_uploaded_parts(bucket, key, upload_id), entry["Compression"])
+    logger.info(f"resuming upload {upload_id} of {key}, {sum('ETag' in task for task in resumed)} parts uploaded")
+
+    return {"UploadId": upload_id}, resumed
+
+
 def get_error(msg: str) -> dict:
     return {"Error": msg}
 
 
-def handler(event, context):
-    Logger.init(getenv("LOGGER_LEVEL"))
-    logger.debug(event)
+def plan_upload(event: dict) -> Tuple[dict, list[dict]]:
+    """Probes and plans the upload of ``URL``, returning the result of the handler without its manifest, and the
+    tasks to write to it."""
     download_url = event.get("URL")
+    concurrency = event.get("Concurrency", DEFAULT_CONCURRENCY)
+    overhead = float(getenv("PART_OVERHEAD_SECONDS", DEFAULT_PART_OVERHEAD))
+    throughput = float(getenv("PART_THROUGHPUT_MIB", DEFAULT_PART_THROUGHPUT)) * MiB
+    batch_target = int(getenv("BATCH_TARGET_MIB", DEFAULT_BATCH_TARGET)) * MiB
+    single_upload_max = int(getenv("SINGLE_UPLOAD_MAX_MIB", DEFAULT_SINGLE_UPLOAD_MAX)) * MiB
+
+    checksum_algorithm = get_checksum_algorithm(event)
+    compression = get_compression(event)
+    with metrics.timed("ProbeSeconds"):
+        source = probe(download_url)
+
+    total = source["TotalSize"]
+    bucket, key = event.get("Bucket"), get_file_name(download_url)
+    copy_source = get_copy_source(download_url, source, compression)
+    source_metadata = get_source_metadata(download_url, source)
+
+    unchanged = is_unchanged(bucket, key, {**get_metadata(compression, total, total), **source_metadata})
+    if unchanged or total <= single_upload_max:
+        # an unchanged file needs no upload at all, and one PutObject is cheaper than a multipart upload and a Map
+        # run for the whole file
+        plan = get_plan(plan_ranges(total, max(total, 1)), 1, overhead, throughput, batch_target)
+        if unchanged:
+            logger.info(f"{download_url} is unchanged since it was uploaded to s3://{bucket}/{key}, skipping it")
+            metrics.add("UnchangedCount", 1)
+        else:
+            logger.info(f"single upload of {download_url}: {plan}")
 
-    try:
         return {
             "URL": download_url,
-            "Bucket": event.get("Bucket"),
-            "Key": get_file_name(download_url),
-            "Tasks": get_tasks(split(get_file_size(download_url), event.get("SingleTaskSize"))),
+            "Bucket": bucket,
+            "Key": key,
+            "Mode": UploadMode.UNCHANGED if unchanged else UploadMode.SINGLE,
+            "Plan": plan,
+            "Resume": bool(event.get("Resume")),
+            "ChecksumAlgorithm": checksum_algorithm,
+            "IfRange": source["IfRange"],
+            "Compression": compression,
+            "Metadata": {**get_metadata(compression, total, total), **source_metadata},
+            "Hedge": get_hedge(total, overhead, throughput),
+            "CopySource": copy_source,
+            "Task": {} if unchanged else {"index": 1, "start": 0, "end": total - 1},
+            "MultipartUpload": {},
+            "Manifest": {},
+        }, []
+
+    with metrics.timed("PlanSeconds"):
+        ranges = plan_ranges(total, get_task_size(event, total, concurrency, overhead, throughput))
+        validate_multipart_plan(ranges)
+        plan = get_plan(ranges, concurrency, overhead, throughput, batch_target)
+        tasks = get_tasks(ranges)
+
+    logger.info(f"upload plan for {download_url}: {plan}")
+    metrics.add("PartCount", len(tasks))
+    metadata = {**get_metadata(compression, ranges.part_size, total), **source_metadata}
+    multipart_upload = {}
+    if event.get("Resume"):
+        # parts can only be reused for the same version of the source, split the same way
+        entry = {
+            "IfRange": source["IfRange"],
+            "TotalSize": total,
+            "PartSize": ranges.part_size,
+            "Compression": compression,
+            "ChecksumAlgorithm": checksum_algorithm,
         }
-    except ValueError as e:
-        logger.error(e)
-        return get_error(str(e))
+        create_args = get_create_args(checksum_algorithm, compression, metadata)
+        multipart_upload, tasks = resume_tasks(bucket, key, tasks, entry, **create_args)
+
+    return {
+        "URL": download_url,
+        "Bucket": bucket,
+        "Key": key,
+        "Mode": UploadMode.MULTIPART,
+        "Plan": plan,
+        "Resume": bool(event.get("Resume")),
+        "ChecksumAlgorithm": checksum_algorithm,
+        "IfRange": source["IfRange"],
+        "Compression": compression,
+        "Metadata": metadata,
+        "Hedge": get_hedge(ranges.part_size, overhead, throughput),
+        "CopySource": copy_source,
+        "Task": {},
+        "MultipartUpload": multipart_upload,
+        "Manifest": {},
+    }, tasks
+
+
+def handler(event, context):
+    Logger.init(getenv("LOGGER_LEVEL"))
+    logger.debug(event)
+
+    with metrics.invocation("partitioner"):
+        try:
+            result, tasks = plan_upload(event)
+            if result["Mode"] == UploadMode.MULTIPART:
+                result["Manifest"] = write_manifest(result["Bucket"], tasks)
+
+            return result
+        except ValueError as e:
+            logger.error(e)
+            return get_error(str(e))
@@ -0,0 +1,68 @@
+from collections.abc import Sequence
+from typing import Iterator, Tuple, Union
+
+from shared.constants import MAX_PART_SIZE, MAX_PARTS, MIN_PART_SIZE
+
+
+class RangePlan(Sequence):
+    """Contiguous, byte-inclusive ``(start, end)`` ranges covering a file of ``total`` bytes.
+
+    Every range is ``part_size`` bytes long except the last one, which holds the remainder. Ranges are
+    computed from their index on access, so planning costs the same for one part or 10,000.
+    """
+
+    def __init__(self, total: int, part_size: int) -> None:
+        if total < 0:
+            raise ValueError(f"total size {total} must not be negative")
+
+        if part_size < 1:
+            raise ValueError(f"part size {part_size} must be at least 1")
+
+        self.total = total
+        self.part_size = part_size
+        self._count = -(-total // part_size)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Tuple[int, int], list[Tuple[int, int]]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+
+        if index < 0:
+            index += self._count
+
+        if not 0 <= index < self._count:
+            raise IndexError(f"part index {index} out of range")
+
+        start = index * self.part_size
+        return start, min(start + self.part_size, self.total) - 1
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        for start in range(0, self.total, self.part_size):
+            yield start, min(start + self.part_size, self.total) - 1
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, RangePlan):
+            return (self.total, self.part_size) == (other.total, other.part_size)
+
+        return list(self) == other
+
+    def __repr__(self) -> str:
+        return f"RangePlan(total={self.total}, part_size={self.part_size})"
+
+
+def plan_ranges(total: int, part_size: int) -> RangePlan:
+    return RangePlan(total, part_size)
+
+
+def validate_multipart_plan(plan: RangePlan) -> None:
+    """Rejects plans which S3 would refuse when completing the multipart upload, before any byte is moved."""
+    if len(plan) > MAX_PARTS:
+        raise ValueError(f"{len(plan)} parts exceeds the maximum of {MAX_PARTS} parts")
+
+    if plan.part_size > MAX_PART_SIZE and plan.total > MAX_PART_SIZE:
+        raise ValueError(f"part size {plan.part_size} exceeds the maximum part size {MAX_PART_SIZE}")
+
+    if plan.part_size < MIN_PART_SIZE and len(plan) > 1:
+        raise ValueError(f"part size {plan.part_size} is below the minimum part size {MIN_PART_SIZE}")
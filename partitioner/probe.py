@@ -0,0 +1,141 @@
+import re
+from datetime import timezone
+from email.utils import format_datetime
+from http import HTTPStatus
+from os import getenv
+from threading import Lock
+from time import monotonic
+from typing import Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from loguru import logger
+from requests import Response
+
+from shared.connection import get_http_session, get_s3_client
+
+DEFAULT_PROBE_TTL = 300
+S3_SCHEME = "s3://"
+# virtual-hosted (bucket.s3.region.amazonaws.com) and path-style (s3.region.amazonaws.com/bucket) endpoints
+S3_HOST = re.compile(r"^(?:(?P<bucket>.+)\.)?s3(?:[.-][a-z0-9-]+)*\.amazonaws\.com(?:\.cn)?$")
+
+_lock = Lock()
+_probes: dict[str, Tuple[float, dict]] = {}
+
+
+def get_if_range(etag: Optional[str], last_modified: Optional[str]) -> Optional[str]:
+    """Validator for ``If-Range``, which only takes a strong ETag, or else the Last-Modified date."""
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+
+    return last_modified
+
+
+def get_source(total: int, resp: Response) -> dict:
+    etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    return {
+        "TotalSize": total,
+        "ETag": etag,
+        "LastModified": last_modified,
+        "IfRange": get_if_range(etag, last_modified),
+    }
+
+
+def head_source(url: str) -> Optional[dict]:
+    """Reads the file from a HEAD response, or returns None when it does not show that ranges are served."""
+    resp = get_http_session().head(url, allow_redirects=True)
+    size = resp.headers.get("Content-Length")
+    if resp.status_code != HTTPStatus.OK or resp.headers.get("Accept-Ranges") != "bytes" or size is None:
+        return None
+
+    return get_source(int(size), resp)
+
+
+def range_source(url: str) -> dict:
+    """Reads the file from the response to a one byte ranged GET, for origins which reject HEAD or leave out
+    ``Accept-Ranges`` but still serve ranges."""
+    with get_http_session().get(url, headers={"Range": "bytes=0-0"}, stream=True) as resp:
+        content_range = resp.headers.get("Content-Range", "")
+        if resp.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE and content_range == "bytes */0":
+            return get_source(0, resp)
+
+        if resp.status_code != HTTPStatus.PARTIAL_CONTENT:
+            raise ValueError("accept-range is not supported")
+
+        total = content_range.rsplit("/", 1)[-1]
+        if not total.isdigit():
+            raise ValueError("content-length is not found in response header")
+
+        return get_source(int(total), resp)
+
+
+def parse_s3_url(url: str) -> Optional[dict]:
+    """The ``Bucket`` and ``Key`` of an ``s3://`` url or of an S3 object url, presigned or not, else None."""
+    if url.startswith(S3_SCHEME):
+        bucket, _, key = url[len(S3_SCHEME) :].partition("/")
+        if not bucket or not key:
+            raise ValueError(f"{url} is not an s3://bucket/key url")
+
+        return {"Bucket": bucket, "Key": key}
+
+    parts = urlsplit(url)
+    match = S3_HOST.match(parts.hostname or "")
+    if match is None:
+        return None
+
+    path = unquote(parts.path).lstrip("/")
+    if match["bucket"]:
+        bucket, key = match["bucket"], path
+    else:
+        bucket, _, key = path.partition("/")
+
+    return {"Bucket": bucket, "Key": key} if bucket and key else None
+
+
+def s3_source(url: str) -> Optional[dict]:
+    """Reads an S3 object with ``HeadObject``, so it can be copied by S3 itself, adding its location as
+    ``CopySource``. An S3 object url which the partitioner cannot read is downloaded like any other url instead."""
+    from botocore.exceptions import ClientError
+
+    location = parse_s3_url(url)
+    if location is None:
+        return None
+
+    try:
+        head = get_s3_client().head_object(**location)
+    except ClientError as e:
+        if url.startswith(S3_SCHEME):
+            raise ValueError(f"failed to read {url}: {e}")
+
+        logger.info(f"{url} cannot be copied, downloading it instead: {e}")
+        return None
+
+    etag, last_modified = head.get("ETag"), format_datetime(head["LastModified"].astimezone(timezone.utc), usegmt=True)
+    return {
+        "TotalSize": head["ContentLength"],
+        "ETag": etag,
+        "LastModified": last_modified,
+        "IfRange": get_if_range(etag, last_modified),
+        "CopySource": location,
+    }
+
+
+def probe(url: str) -> dict:
+    """Returns the size and validators of the file at ``url``, cached for ``PROBE_TTL_SECONDS``."""
+    now = monotonic()
+    cached = _probes.get(url)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    source = s3_source(url) or head_source(url)
+    if source is None:
+        logger.info(f"HEAD {url} does not show range support, probing with a ranged GET")
+        source = range_source(url)
+
+    with _lock:
+        _probes[url] = (now + float(getenv("PROBE_TTL_SECONDS", DEFAULT_PROBE_TTL)), source)
+
+    return source
+
+
+def reset() -> None:
+    _probes.clear()
@@ -0,0 +1,87 @@
+import json
+from hashlib import sha256
+from typing import Optional
+
+from shared.connection import get_s3_client
+from shared.constants import CHECKSUM_FIELDS
+
+# under the manifests, which expire about when S3 aborts the incomplete upload they describe
+RESUME_PREFIX = "manifests/resume"
+
+
+def get_resume_key(key: str, upload_id: str) -> str:
+    return f"{RESUME_PREFIX}/{sha256(f'{key}/{upload_id}'.encode()).hexdigest()}.json"
+
+
+def read_resume_entry(bucket: str, key: str, upload_id: str) -> Optional[dict]:
+    from botocore.exceptions import ClientError
+
+    try:
+        resp = get_s3_client().get_object(Bucket=bucket, Key=get_resume_key(key, upload_id))
+    except ClientError:
+        return None
+
+    return json.loads(resp["Body"].read())
+
+
+def create_upload(bucket: str, key: str, entry: dict, **create_args) -> str:
+    """Creates a multipart upload of ``key`` and records ``entry`` for it, which a later run has to match to
+    resume it. ListMultipartUploads returns neither the metadata of an upload nor its source."""
+    upload_id = get_s3_client().create_multipart_upload(Bucket=bucket, Key=key, **create_args)["UploadId"]
+    get_s3_client().put_object(
+        Bucket=bucket,
+        Key=get_resume_key(key, upload_id),
+        Body=json.dumps(entry, separators=(",", ":")).encode(),
+        ContentType="application/json",
+    )
+
+    return upload_id
+
+
+def find_upload_id(bucket: str, key: str, entry: dict) -> Optional[str]:
+    """Returns the most recently initiated multipart upload still in progress for ``key`` which was created for
+    the same source version and plan as ``entry``, if any.
+
+    Any other upload of ``key`` is left alone, as a concurrent run may still be using it, and is aborted by the
+    bucket's ``abort_incomplete_multipart_upload_after`` rule once it is no longer. A source without a validator
+    is never resumed.
+    """
+    if entry["IfRange"] is None:
+        return None
+
+    pages = get_s3_client().get_paginator("list_multipart_uploads").paginate(Bucket=bucket, Prefix=key)
+    uploads = [
+        upload
+        for page in pages
+        for upload in page.get("Uploads", [])
+        if upload["Key"] == key and upload.get("ChecksumAlgorithm") == entry["ChecksumAlgorithm"]
+    ]
+
+    for upload in sorted(uploads, key=lambda upload: upload["Initiated"], reverse=True):
+        if read_resume_entry(bucket, key, upload["UploadId"]) == entry:
+            return upload["UploadId"]
+
+    return None
+
+
+def list_uploaded_parts(bucket: str, key: str, upload_id: str) -> dict[int, dict]:
+    pages = get_s3_client().get_paginator("list_parts").paginate(Bucket=bucket, Key=key, UploadId=upload_id)
+    return {part["PartNumber"]: part for page in pages for part in page.get("Parts", [])}
+
+
+def merge_uploaded_parts(tasks: list[dict], uploaded: dict[int, dict], compression: Optional[str] = None) -> list[dict]:
+    """Marks every task whose part is already uploaded with the expected size by adding its ``ETag`` and checksum.
+    The size of a compressed part cannot be known in advance, so any uploaded one is kept.
+
+    Tasks which still need a transfer come first, so already uploaded ones are grouped into the same batches.
+    """
+    missing, completed = [], []
+    for task in tasks:
+        part = uploaded.get(task["index"])
+        if part is not None and (compression or part["Size"] == task["end"] - task["start"] + 1):
+            checksums = {field: part[field] for field in CHECKSUM_FIELDS if part.get(field) is not None}
+            completed.append({**task, "ETag": part["ETag"], **checksums})
+        else:
+            missing.append(task)
+
+    return missing + completed
@@ -0,0 +1,276 @@
+import json
+import logging
+
+import boto3
+import pytest
+import requests
+import requests_mock
+from _pytest.logging import LogCaptureFixture
+from loguru import logger
+from moto import mock_s3
+
+from partitioner import bulk, probe
+from partitioner.bulk import batch_tasks, complete_handler, get_urls, plan_handler
+from partitioner.index import Logger
+from shared.constants import MiB
+
+
+def read_json(s3_client, location: dict):
+    return json.loads(s3_client.get_object(Bucket=location["Bucket"], Key=location["Key"])["Body"].read())
+
+
+class TestBulk:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    @pytest.fixture
+    def caplog(self, caplog: LogCaptureFixture):
+        # the handlers initialise the logger once, removing any sink added before
+        Logger.init(None)
+        logger.add(
+            caplog.handler,
+            format="{message}",
+            level=0,
+            filter=lambda record: record["level"].no >= logging.INFO,
+            enqueue=False,
+        )
+        yield caplog
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize(
+        "mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "1", "BATCH_TARGET_MIB": "8"}], indirect=True
+    )
+    @pytest.mark.parametrize("complete", [True, False])
+    def test_plan_and_complete(self, caplog, mocked_env, complete, **kwargs):
+        m = kwargs["mock"]
+        urls = [f"https://download.test/{name}" for name in ("small.txt", "large.zip", "missing.zip", "empty.txt")]
+        m.head(urls[0], headers={"Accept-Ranges": "bytes", "Content-Length": "100"})
+        m.head(urls[1], headers={"Accept-Ranges": "bytes", "Content-Length": str(12 * MiB)})
+        m.head(urls[2], headers={"Content-Length": "100"})
+        m.get(urls[2], status_code=200)
+        m.head(urls[3], headers={"Accept-Ranges": "bytes", "Content-Length": "0"})
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+
+        event = {"URLs": urls, "Bucket": "bucket_name", "SingleTaskSize": 5 * MiB, "Concurrency": 2}
+        result = plan_handler(event, {})
+        files = read_json(s3_client, result["Files"])
+        batches = read_json(s3_client, result["Manifest"])
+
+        assert {k: v for k, v in result.items() if k not in ("Files", "Manifest")} == {
+            "Bucket": "bucket_name",
+            "FileCount": 4,
+            "TaskCount": 5,
+            "BatchCount": 3,
+        }
+        assert [file.get("Mode") for file in files] == ["single", "multipart", None, "single"]
+        assert files[2]["Error"] == "accept-range is not supported"
+
+        upload_id = files[1]["MultipartUploadId"]
+        file = {
+            "Bucket": "bucket_name",
+            "ChecksumAlgorithm": None,
+            "IfRange": None,
+            "Compression": None,
+            "CopySource": {},
+            "Hedge": {"Percentile": 95, "MinSeconds": 2.0},
+            "Metadata": {},
+        }
+        large = {
+            **file,
+            "URL": urls[1],
+            "Key": "large.zip",
+            "MultipartUploadId": upload_id,
+            "TotalSize": 12 * MiB,
+            "Hedge": {"Percentile": 95, "MinSeconds": 2.2},
+        }
+        assert [batch["Items"] for batch in batches] == [
+            [
+                {**file, "URL": urls[0], "Key": "small.txt", "TotalSize": 100, "index": 1, "start": 0, "end": 99},
+                {**large, "index": 1, "start": 0, "end": 5 * MiB - 1},
+            ],
+            [{**large, "index": 2, "start": 5 * MiB, "end": 10 * MiB - 1}],
+            [
+                {**large, "index": 3, "start": 10 * MiB, "end": 12 * MiB - 1},
+                {**file, "URL": urls[3], "Key": "empty.txt", "TotalSize": 0, "index": 1, "start": 0, "end": -1},
+            ],
+        ]
+        assert "bulk upload plan: 4 files, 5 tasks in 3 batches" in caplog.text
+
+        s3_client.put_object(Bucket="bucket_name", Key="small.txt", Body=b"0" * 100)
+        for item in batches[1]["Items"] + batches[2]["Items"][:1] + (batches[0]["Items"][1:] if complete else []):
+            s3_client.upload_part(
+                Bucket="bucket_name",
+                Key="large.zip",
+                UploadId=upload_id,
+                PartNumber=item["index"],
+                Body=b"0" * (item["end"] - item["start"] + 1),
+            )
+
+        assert complete_handler({"Files": result["Files"]}, {}) == {
+            "Completed": 2 if complete else 1,
+            "Failed": [
+                *([] if complete else [{"URL": urls[1], "Error": "1 of 3 parts are not uploaded"}]),
+                {"URL": urls[2], "Error": "accept-range is not supported"},
+                {"URL": urls[3], "Error": "An error occurred (404) when calling the HeadObject operation: Not Found"},
+            ],
+        }
+        assert s3_client.list_multipart_uploads(Bucket="bucket_name").get("Uploads", []) == []
+        if complete:
+            assert s3_client.head_object(Bucket="bucket_name", Key="large.zip")["ContentLength"] == 12 * MiB
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize(
+        "mocked_env",
+        [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "1", "COMPRESSED_PART_MIB": "8"}],
+        indirect=True,
+    )
+    def test_plan_and_complete_with_compression(self, caplog, mocked_env, **kwargs):
+        urls = ["https://download.test/small.txt", "https://download.test/large.zip"]
+        kwargs["mock"].head(urls[0], headers={"Accept-Ranges": "bytes", "Content-Length": "100"})
+        kwargs["mock"].head(urls[1], headers={"Accept-Ranges": "bytes", "Content-Length": str(12 * MiB)})
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+
+        result = plan_handler({"URLs": urls, "Bucket": "bucket_name", "Compression": "gzip"}, {})
+        small, large = read_json(s3_client, result["Files"])
+        tasks = [item for batch in read_json(s3_client, result["Manifest"]) for item in batch["Items"]]
+
+        assert (small["Metadata"], small["TotalSize"]) == (
+            {"compression": "gzip", "compression-frame-size": "100", "uncompressed-size": "100"},
+            100,
+        )
+        assert large["Metadata"] == {
+            "compression": "gzip",
+            "compression-frame-size": str(8 * MiB),
+            "uncompressed-size": str(12 * MiB),
+        }
+        assert all(task["Compression"] == "gzip" for task in tasks)
+        upload_id = large["MultipartUploadId"]
+        assert s3_client.list_multipart_uploads(Bucket="bucket_name")["Uploads"][0]["UploadId"] == upload_id
+
+        # the compressed parts are smaller than their ranges, but the first is padded to the minimum part size
+        s3_client.put_object(Bucket="bucket_name", Key="small.txt", Body=b"0" * 10, Metadata=small["Metadata"])
+        for part_num, size in ((1, 5 * MiB), (2, 10)):
+            s3_client.upload_part(
+                Bucket="bucket_name", Key="large.zip", UploadId=upload_id, PartNumber=part_num, Body=b"0" * size
+            )
+
+        assert complete_handler({"Files": result["Files"]}, {}) == {"Completed": 2, "Failed": []}
+        head = s3_client.head_object(Bucket="bucket_name", Key="large.zip")
+        assert (head["Metadata"], head["ContentEncoding"]) == (large["Metadata"], "gzip")
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "1"}], indirect=True)
+    def test_plan_with_unreachable_origin(self, mocked_env, monkeypatch, **kwargs):
+        urls = ["https://download.test/large.zip", "https://unreachable.test/other.zip"]
+        kwargs["mock"].head(urls[0], headers={"Accept-Ranges": "bytes", "Content-Length": str(12 * MiB)})
+        kwargs["mock"].head(urls[1], exc=requests.exceptions.ConnectionError("connection refused"))
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        event = {"URLs": urls, "Bucket": "bucket_name", "SingleTaskSize": 5 * MiB}
+
+        files = read_json(s3_client, plan_handler(event, {})["Files"])
+
+        assert [file.get("Mode") for file in files] == ["multipart", None]
+        assert files[1]["Error"] == "connection refused"
+
+        # a plan which fails as a whole leaves no upload behind
+        def fail(*args):
+            raise RuntimeError("failed")
+
+        monkeypatch.setattr(bulk, "write_manifest", fail)
+        s3_client.abort_multipart_upload(Bucket="bucket_name", Key="large.zip", UploadId=files[0]["MultipartUploadId"])
+        with pytest.raises(RuntimeError):
+            plan_handler(event, {})
+
+        assert s3_client.list_multipart_uploads(Bucket="bucket_name").get("Uploads", []) == []
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "1"}], indirect=True)
+    def test_plan_and_complete_unchanged(self, mocked_env, **kwargs):
+        urls = ["https://download.test/small.txt", "https://download.test/large.zip"]
+        kwargs["mock"].head(urls[0], headers={"Accept-Ranges": "bytes", "Content-Length": "100", "ETag": '"s"'})
+        kwargs["mock"].head(urls[1], headers={"Accept-Ranges": "bytes", "Content-Length": str(12 * MiB), "ETag": '"l"'})
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        event = {"URLs": urls, "Bucket": "bucket_name", "SingleTaskSize": 5 * MiB}
+
+        first = read_json(s3_client, plan_handler(event, {})["Files"])
+        # only the small file was uploaded from the same source since
+        s3_client.put_object(Bucket="bucket_name", Key="small.txt", Body=b"0" * 100, Metadata=first[0]["Metadata"])
+        probe.reset()
+        result = plan_handler(event, {})
+        files = read_json(s3_client, result["Files"])
+
+        assert [file["Mode"] for file in files] == ["unchanged", "multipart"]
+        assert (result["FileCount"], result["TaskCount"]) == (2, 3)
+        # an unchanged file is already in place, so it counts as uploaded
+        assert complete_handler({"Files": result["Files"]}, {}) == {
+            "Completed": 1,
+            "Failed": [{"URL": urls[1], "Error": "3 of 3 parts are not uploaded"}],
+        }
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "1"}], indirect=True)
+    def test_complete_single_of_other_version(self, mocked_env, **kwargs):
+        url = "https://download.test/small.txt"
+        kwargs["mock"].head(url, headers={"Accept-Ranges": "bytes", "Content-Length": "100", "ETag": '"v2"'})
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        s3_client.put_object(
+            Bucket="bucket_name", Key="small.txt", Body=b"0" * 100, Metadata={"source-validator": '"v1"'}
+        )
+        result = plan_handler({"URLs": [url], "Bucket": "bucket_name"}, {})
+
+        # the upload of this version failed, leaving the object of the last one in place
+        assert complete_handler({"Files": result["Files"]}, {}) == {
+            "Completed": 0,
+            "Failed": [{"URL": url, "Error": 'uploaded version "v1", expected "v2"'}],
+        }
+        metadata = read_json(s3_client, result["Files"])[0]["Metadata"]
+        s3_client.put_object(Bucket="bucket_name", Key="small.txt", Body=b"0" * 100, Metadata=metadata)
+        assert complete_handler({"Files": result["Files"]}, {}) == {"Completed": 1, "Failed": []}
+
+    @pytest.mark.parametrize(
+        "event,expected",
+        [
+            ({"URLs": ["https://a.test/a.zip", {"URL": "https://b.test/b.zip"}]}, None),
+            ({}, "either URLs or Manifest is required"),
+            ({"URLs": []}, "no url to upload"),
+            (
+                {"URLs": ["https://a.test/a.zip", "https://b.test/a.zip"]},
+                "https://b.test/a.zip and https://a.test/a.zip would both be uploaded to a.zip",
+            ),
+        ],
+    )
+    def test_get_urls(self, event, expected) -> None:
+        if expected is not None:
+            with pytest.raises(ValueError, match=expected):
+                get_urls(event)
+
+            return
+
+        assert get_urls(event) == ["https://a.test/a.zip", "https://b.test/b.zip"]
+
+    @pytest.mark.parametrize(
+        "sizes,concurrency,target,expected",
+        [
+            ([10, 10, 10, 10], 1, 25, [[10, 10], [10, 10]]),
+            ([10, 10, 10, 10], 4, 100, [[10], [10], [10], [10]]),
+            ([30, 5, 5, 5, 30], 1, 20, [[30], [5, 5, 5], [30]]),
+            ([0, 0], 10, 20, [[0, 0]]),
+        ],
+    )
+    def test_batch_tasks(self, sizes, concurrency, target, expected) -> None:
+        tasks = [{"start": 0, "end": size - 1} for size in sizes]
+        batches = batch_tasks(tasks, concurrency, target)
+
+        assert [[task["end"] + 1 for task in batch["Items"]] for batch in batches] == expected
@@ -0,0 +1,42 @@
+import boto3
+import pytest
+from moto import mock_s3
+
+from partitioner.complete import IncompleteUploadError, handler
+from shared.constants import MiB
+
+
+class TestComplete:
+    @mock_s3
+    @pytest.mark.parametrize("uploaded", [(1, 2, 3), (1, 3)])
+    def test_handler(self, uploaded: tuple) -> None:
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        upload_id = s3_client.create_multipart_upload(Bucket="bucket_name", Key="file_name.zip")["UploadId"]
+        for part_num in uploaded:
+            size = 2 * MiB if part_num == 3 else 5 * MiB
+            s3_client.upload_part(
+                Bucket="bucket_name", Key="file_name.zip", UploadId=upload_id, PartNumber=part_num, Body=b"0" * size
+            )
+        event = {
+            "Bucket": "bucket_name",
+            "Key": "file_name.zip",
+            "MultipartUploadId": upload_id,
+            "TotalSize": 12 * MiB,
+            "PartSize": 5 * MiB,
+            "Compression": None,
+        }
+
+        if len(uploaded) < 3:
+            with pytest.raises(IncompleteUploadError, match="1 of 3 parts are not uploaded"):
+                handler(event, {})
+
+            # the state machine aborts the upload unless it is resumable
+            assert s3_client.list_multipart_uploads(Bucket="bucket_name")["Uploads"][0]["UploadId"] == upload_id
+        else:
+            result = handler(event, {})
+
+            assert result == {
+                "ETag": s3_client.head_object(Bucket="bucket_name", Key="file_name.zip")["ETag"],
+                "PartCount": 3,
+            }
@@ -0,0 +1,5 @@
+from partitioner import probe
+from shared.tests.fixtures import reset_fixture
+
+# autouse, clears the probes a warm container caches besides the shared clients and limiters
+reset = reset_fixture(probe.reset)
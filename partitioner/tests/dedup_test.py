@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from partitioner.dedup import get_source_metadata, is_unchanged
+
+URL = "https://download.test/file_name.zip"
+SOURCE = {"TotalSize": 100, "IfRange": '"v1"'}
+
+
+class TestDedup:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    @pytest.fixture(scope="function")
+    def s3_client(self):
+        with mock_s3():
+            s3_client = boto3.client("s3")
+            s3_client.create_bucket(Bucket="bucket_name")
+            yield s3_client
+
+    @pytest.mark.parametrize(
+        "source,source_id",
+        [
+            (SOURCE, URL),
+            (
+                {**SOURCE, "CopySource": {"Bucket": "source-bucket", "Key": "file_name.zip"}},
+                "s3://source-bucket/file_name.zip",
+            ),
+            ({**SOURCE, "IfRange": None}, None),
+        ],
+    )
+    def test_get_source_metadata(self, source: dict, source_id) -> None:
+        metadata = get_source_metadata(f"{URL}?X-Amz-Signature=abc" if "CopySource" in source else URL, source)
+
+        assert metadata == (
+            {"source-id": sha256(source_id.encode()).hexdigest(), "source-size": "100", "source-validator": '"v1"'}
+            if source_id
+            else {}
+        )
+
+    @pytest.mark.parametrize(
+        "mocked_env,metadata,hours,expected",
+        [
+            ({}, {}, 0, True),
+            ({}, {}, 200, False),
+            ({"DEDUP_TTL_HOURS": "0"}, {}, 0, False),
+            ({}, {"source-validator": '"v2"'}, 0, False),
+            ({}, {"source-size": "101"}, 0, False),
+            ({}, {"compression": "gzip"}, 0, False),
+        ],
+        indirect=["mocked_env"],
+    )
+    def test_is_unchanged(self, s3_client, mocked_env, metadata: dict, hours: int, expected: bool) -> None:
+        uploaded = get_source_metadata(URL, SOURCE)
+        s3_client.put_object(Bucket="bucket_name", Key="file_name.zip", Body=b"0" * 100, Metadata=uploaded)
+        now = datetime.now(timezone.utc) + timedelta(hours=hours)
+
+        assert is_unchanged("bucket_name", "file_name.zip", {**uploaded, **metadata}, now) is expected
+
+    def test_is_unchanged_without_object(self, s3_client) -> None:
+        metadata = get_source_metadata(URL, SOURCE)
+
+        assert is_unchanged("bucket_name", "file_name.zip", metadata) is False
+        assert is_unchanged("bucket_name", "file_name.zip", {}) is False
@@ -0,0 +1,13 @@
+import pytest
+
+from shared.tests.imports import HANDLER_PACKAGES, import_module
+
+
+class TestImport:
+    @pytest.mark.parametrize("module", ["partitioner.index", "partitioner.bulk", "partitioner.complete"])
+    def test_import_packages(self, module: str) -> None:
+        assert set(import_module(module)["packages"]) <= HANDLER_PACKAGES
+
+    @pytest.mark.parametrize("module", ["partitioner.index", "partitioner.bulk"])
+    def test_import_defers_botocore(self, module: str) -> None:
+        assert "botocore" not in import_module(module)["modules"]
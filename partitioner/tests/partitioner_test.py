@@ -1,11 +1,43 @@
+import json
 import logging
+from datetime import datetime
+from hashlib import sha256
+from io import BytesIO
+from math import ceil
 
+import boto3
 import pytest
 import requests_mock
 from _pytest.logging import LogCaptureFixture
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
 from loguru import logger
+from moto import mock_s3
 
-from partitioner.index import handler, split
+from partitioner import probe
+from partitioner.index import (
+    MAX_PART_SIZE,
+    MAX_PARTS,
+    MIN_PART_SIZE,
+    MiB,
+    get_batch_size,
+    get_compression,
+    get_hedge,
+    get_metadata,
+    handler,
+    plan_part_size,
+    resume_tasks,
+)
+from partitioner.planner import plan_ranges
+from partitioner.resume import get_resume_key
+from shared import connection, metrics
+from shared.metrics import MetricsCollector
+
+MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+def get_source_metadata(size: int, validator: str, url: str = "https://download.test/file_name.zip") -> dict:
+    return {"source-id": sha256(url.encode()).hexdigest(), "source-size": str(size), "source-validator": validator}
 
 
 class TestPartitioner:
@@ -14,6 +46,14 @@ class TestPartitioner:
         for k, v in request.param.items():
             monkeypatch.setenv(k, v)
 
+    @pytest.fixture(scope="function")
+    def collector(self):
+        metrics.reset()
+        collector = MetricsCollector()
+        metrics.set_sink(collector)
+        yield collector
+        metrics.reset()
+
     @pytest.fixture
     def caplog(self, caplog: LogCaptureFixture):
         logger.add(
@@ -25,33 +65,148 @@ class TestPartitioner:
         )
         yield caplog
 
+    @mock_s3
     @requests_mock.Mocker(kw="mock")
     @pytest.mark.parametrize(
         "mocked_env,event,resp_headers,expected,err_log",
         [
             (
-                {"LOGGER_LEVEL": "INFO"},
-                {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name", "SingleTaskSize": 10},
-                {"Accept-Ranges": "bytes", "Content-Length": "100"},
+                {"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"},
+                {
+                    "URL": "https://download.test/file_name.zip",
+                    "Bucket": "bucket_name",
+                    "SingleTaskSize": 10 * MiB,
+                    "ChecksumAlgorithm": "CRC32",
+                },
+                {"Accept-Ranges": "bytes", "Content-Length": str(35 * MiB), "ETag": '"35"'},
                 {
                     "URL": "https://download.test/file_name.zip",
                     "Bucket": "bucket_name",
                     "Key": "file_name.zip",
+                    "Mode": "multipart",
+                    "Resume": False,
+                    "ChecksumAlgorithm": "CRC32",
+                    "IfRange": '"35"',
+                    "Compression": None,
+                    "Metadata": get_source_metadata(35 * MiB, '"35"'),
+                    "Hedge": {"Percentile": 95, "MinSeconds": 2.4},
+                    "CopySource": {},
+                    "Task": {},
+                    "MultipartUpload": {},
+                    "Plan": {
+                        "TotalSize": 35 * MiB,
+                        "PartSize": 10 * MiB,
+                        "PartCount": 4,
+                        "Concurrency": 100,
+                        "Waves": 1,
+                        "BatchSize": 1,
+                        "EstimatedSeconds": 1.2,
+                    },
                     "Tasks": [
-                        {"index": 1, "start": 0, "end": 10},
-                        {"index": 2, "start": 11, "end": 21},
-                        {"index": 3, "start": 22, "end": 32},
-                        {"index": 4, "start": 33, "end": 43},
-                        {"index": 5, "start": 44, "end": 54},
-                        {"index": 6, "start": 55, "end": 65},
-                        {"index": 7, "start": 66, "end": 76},
-                        {"index": 8, "start": 77, "end": 87},
-                        {"index": 9, "start": 88, "end": 98},
-                        {"index": 10, "start": 99, "end": 100},
+                        {"index": 1, "start": 0, "end": 10 * MiB - 1},
+                        {"index": 2, "start": 10 * MiB, "end": 20 * MiB - 1},
+                        {"index": 3, "start": 20 * MiB, "end": 30 * MiB - 1},
+                        {"index": 4, "start": 30 * MiB, "end": 35 * MiB - 1},
                     ],
                 },
                 "",
             ),
+            (
+                {"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"},
+                {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name", "SingleTaskSize": "auto"},
+                {"Accept-Ranges": "bytes", "Content-Length": "100"},
+                {
+                    "URL": "https://download.test/file_name.zip",
+                    "Bucket": "bucket_name",
+                    "Key": "file_name.zip",
+                    "Mode": "multipart",
+                    "Resume": False,
+                    "ChecksumAlgorithm": None,
+                    "IfRange": None,
+                    "Compression": None,
+                    "Metadata": {},
+                    "Hedge": {"Percentile": 95, "MinSeconds": 2.0},
+                    "CopySource": {},
+                    "Task": {},
+                    "MultipartUpload": {},
+                    "Plan": {
+                        "TotalSize": 100,
+                        "PartSize": 100,
+                        "PartCount": 1,
+                        "Concurrency": 100,
+                        "Waves": 1,
+                        "BatchSize": 1,
+                        "EstimatedSeconds": 1.0,
+                    },
+                    "Tasks": [{"index": 1, "start": 0, "end": 99}],
+                },
+                "upload plan for https://download.test/file_name.zip",
+            ),
+            (
+                {"LOGGER_LEVEL": "INFO"},
+                {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name", "SingleTaskSize": 10},
+                {
+                    "Accept-Ranges": "bytes",
+                    "Content-Length": str(64 * MiB),
+                    "ETag": 'W/"64"',
+                    "Last-Modified": MODIFIED,
+                },
+                {
+                    "URL": "https://download.test/file_name.zip",
+                    "Bucket": "bucket_name",
+                    "Key": "file_name.zip",
+                    "Mode": "single",
+                    "Resume": False,
+                    "ChecksumAlgorithm": None,
+                    "IfRange": MODIFIED,
+                    "Compression": None,
+                    "Metadata": get_source_metadata(64 * MiB, MODIFIED),
+                    "Hedge": {"Percentile": 95, "MinSeconds": 4.6},
+                    "CopySource": {},
+                    "Task": {"index": 1, "start": 0, "end": 64 * MiB - 1},
+                    "MultipartUpload": {},
+                    "Plan": {
+                        "TotalSize": 64 * MiB,
+                        "PartSize": 64 * MiB,
+                        "PartCount": 1,
+                        "Concurrency": 1,
+                        "Waves": 1,
+                        "BatchSize": 1,
+                        "EstimatedSeconds": 2.3,
+                    },
+                },
+                "single upload of https://download.test/file_name.zip",
+            ),
+            (
+                {"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"},
+                {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name"},
+                {"Accept-Ranges": "bytes", "Content-Length": "0"},
+                {
+                    "URL": "https://download.test/file_name.zip",
+                    "Bucket": "bucket_name",
+                    "Key": "file_name.zip",
+                    "Mode": "single",
+                    "Resume": False,
+                    "ChecksumAlgorithm": None,
+                    "IfRange": None,
+                    "Compression": None,
+                    "Metadata": {},
+                    "Hedge": {"Percentile": 95, "MinSeconds": 2.0},
+                    "CopySource": {},
+                    "Task": {"index": 1, "start": 0, "end": -1},
+                    "MultipartUpload": {},
+                    "Plan": {
+                        "TotalSize": 0,
+                        "PartSize": 1,
+                        "PartCount": 0,
+                        "Concurrency": 1,
+                        "Waves": 0,
+                        "BatchSize": 1,
+                        "EstimatedSeconds": 0.0,
+                    },
+                },
+                "single upload of https://download.test/file_name.zip",
+            ),
             (
                 {"LOGGER_LEVEL": "INFO"},
                 {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name", "SingleTaskSize": 10},
@@ -59,22 +214,357 @@ class TestPartitioner:
                 {"Error": "accept-range is not supported"},
                 "accept-range is not supported",
             ),
+            (
+                {"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"},
+                {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name", "SingleTaskSize": 10},
+                {"Accept-Ranges": "bytes", "Content-Length": "100"},
+                {"Error": "part size 10 is below the minimum part size 5242880"},
+                "part size 10 is below the minimum part size 5242880",
+            ),
+            (
+                {"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0", "COMPRESSED_PART_MIB": "16"},
+                {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name", "Compression": "gzip"},
+                {"Accept-Ranges": "bytes", "Content-Length": str(40 * MiB)},
+                {
+                    "URL": "https://download.test/file_name.zip",
+                    "Bucket": "bucket_name",
+                    "Key": "file_name.zip",
+                    "Mode": "multipart",
+                    "Resume": False,
+                    "ChecksumAlgorithm": None,
+                    "IfRange": None,
+                    "Compression": "gzip",
+                    "Metadata": {
+                        "compression": "gzip",
+                        "compression-frame-size": str(16 * MiB),
+                        "uncompressed-size": str(40 * MiB),
+                    },
+                    "Hedge": {"Percentile": 95, "MinSeconds": 2.6},
+                    "CopySource": {},
+                    "Task": {},
+                    "MultipartUpload": {},
+                    "Plan": {
+                        "TotalSize": 40 * MiB,
+                        "PartSize": 16 * MiB,
+                        "PartCount": 3,
+                        "Concurrency": 100,
+                        "Waves": 1,
+                        "BatchSize": 1,
+                        "EstimatedSeconds": 1.3,
+                    },
+                    "Tasks": [
+                        {"index": 1, "start": 0, "end": 16 * MiB - 1},
+                        {"index": 2, "start": 16 * MiB, "end": 32 * MiB - 1},
+                        {"index": 3, "start": 32 * MiB, "end": 40 * MiB - 1},
+                    ],
+                },
+                "upload plan for https://download.test/file_name.zip",
+            ),
+            (
+                {"LOGGER_LEVEL": "INFO"},
+                {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name", "Compression": "zstd"},
+                {"Accept-Ranges": "bytes", "Content-Length": "100"},
+                {"Error": "compression zstd is not one of gzip"},
+                "compression zstd is not one of gzip",
+            ),
+            (
+                {"LOGGER_LEVEL": "INFO"},
+                {"URL": "https://download.test/file_name.zip", "Bucket": "bucket_name", "ChecksumAlgorithm": "MD5"},
+                {"Accept-Ranges": "bytes", "Content-Length": "100"},
+                {"Error": "checksum algorithm MD5 is not one of CRC32, SHA1, SHA256"},
+                "checksum algorithm MD5 is not one of CRC32, SHA1, SHA256",
+            ),
         ],
         indirect=["mocked_env"],
     )
-    def test_handler(self, caplog, mocked_env, event, resp_headers, expected, err_log, **kwargs):
+    def test_handler(self, caplog, mocked_env, collector, event, resp_headers, expected, err_log, **kwargs):
         kwargs["mock"].head(event.get("URL"), headers=resp_headers)
-        assert handler(event, {}) == expected
+        kwargs["mock"].get(event.get("URL"), status_code=200)
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=event.get("Bucket"))
+
+        expected = dict(expected)
+        expected_tasks = expected.pop("Tasks", None)
+        result = handler(event, {})
+        manifest = result.pop("Manifest", None)
+
+        assert result == expected
+        assert (manifest == {}) is (result.get("Mode") == "single")
         assert err_log in caplog.text
 
+        [record] = collector.records
+        assert record["Function"] == "partitioner"
+        # an invalid input fails before the source is probed
+        assert ("ProbeSeconds" in record) is not result.get("Error", "").startswith(("checksum", "compression"))
+        assert "PlanSeconds" in record or result.get("Mode") != "multipart"
+
+        if expected_tasks is not None:
+            assert manifest["Bucket"] == event.get("Bucket")
+            assert manifest["Key"].startswith("manifests/")
+            body = s3_client.get_object(Bucket=manifest["Bucket"], Key=manifest["Key"])["Body"].read()
+            assert json.loads(body) == expected_tasks
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"}], indirect=True)
+    def test_handler_with_resume(self, caplog, mocked_env, **kwargs):
+        event = {
+            "URL": "https://download.test/file_name.zip",
+            "Bucket": "bucket_name",
+            "SingleTaskSize": 5 * MiB,
+            "Resume": True,
+        }
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(12 * MiB), "ETag": '"v1"'}
+        kwargs["mock"].head(event.get("URL"), headers=headers)
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=event.get("Bucket"))
+        s3_client.create_multipart_upload(Bucket=event.get("Bucket"), Key="file_name.zip.bak")
+        # an upload without a resume entry may hold parts of any version of the source
+        unknown_id = s3_client.create_multipart_upload(Bucket=event.get("Bucket"), Key="file_name.zip")["UploadId"]
+
+        result = handler(event, {})
+        upload_id = result["MultipartUpload"]["UploadId"]
+        assert upload_id != unknown_id
+
+        etag = s3_client.upload_part(
+            Bucket=event.get("Bucket"), Key="file_name.zip", UploadId=upload_id, PartNumber=1, Body=b"0" * 5 * MiB
+        )["ETag"]
+        s3_client.upload_part(
+            Bucket=event.get("Bucket"), Key="file_name.zip", UploadId=upload_id, PartNumber=3, Body=b"0"
+        )
+
+        result = handler(event, {})
+        manifest = result.get("Manifest")
+        tasks = json.loads(s3_client.get_object(Bucket=manifest["Bucket"], Key=manifest["Key"])["Body"].read())
+
+        assert result["Resume"] is True
+        assert result["MultipartUpload"] == {"UploadId": upload_id}
+        assert tasks == [
+            {"index": 2, "start": 5 * MiB, "end": 10 * MiB - 1},
+            {"index": 3, "start": 10 * MiB, "end": 12 * MiB - 1},
+            {"index": 1, "start": 0, "end": 5 * MiB - 1, "ETag": etag},
+        ]
+        assert f"resuming upload {upload_id} of file_name.zip, 1 parts uploaded" in caplog.text
+        # uploads which another run may still use are left to the lifecycle rule
+        uploads = s3_client.list_multipart_uploads(Bucket=event.get("Bucket"))["Uploads"]
+        assert sorted(upload["UploadId"] for upload in uploads if upload["Key"] == "file_name.zip") == sorted(
+            [unknown_id, upload_id]
+        )
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"}], indirect=True)
+    def test_handler_with_resume_of_compressed_upload(self, mocked_env, **kwargs):
+        event = {
+            "URL": "https://download.test/file_name.zip",
+            "Bucket": "bucket_name",
+            "SingleTaskSize": 5 * MiB,
+            "Compression": "gzip",
+            "Resume": True,
+        }
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(12 * MiB), "ETag": '"v1"'}
+        kwargs["mock"].head(event.get("URL"), headers=headers)
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=event.get("Bucket"))
+        upload_id = handler(event, {})["MultipartUpload"]["UploadId"]
+        # a compressed part is shorter than its range
+        etag = s3_client.upload_part(
+            Bucket=event.get("Bucket"), Key="file_name.zip", UploadId=upload_id, PartNumber=1, Body=b"0" * MiB
+        )["ETag"]
+
+        result = handler(event, {})
+        manifest = result.get("Manifest")
+        tasks = json.loads(s3_client.get_object(Bucket=manifest["Bucket"], Key=manifest["Key"])["Body"].read())
+
+        assert result["MultipartUpload"] == {"UploadId": upload_id}
+        assert [task["index"] for task in tasks if "ETag" not in task] == list(range(2, len(tasks) + 1))
+        assert tasks[-1] == {**tasks[-1], "index": 1, "ETag": etag}
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"}], indirect=True)
+    @pytest.mark.parametrize(
+        "changed",
+        [{"ETag": '"v2"'}, {"Content-Length": str(13 * MiB)}, {"ETag": 'W/"v1"'}],
+    )
+    def test_handler_with_resume_of_changed_source(self, mocked_env, changed: dict, **kwargs):
+        event = {
+            "URL": "https://download.test/file_name.zip",
+            "Bucket": "bucket_name",
+            "SingleTaskSize": 5 * MiB,
+            "Resume": True,
+        }
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(12 * MiB), "ETag": '"v1"'}
+        kwargs["mock"].head(event.get("URL"), headers=headers)
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=event.get("Bucket"))
+        upload_id = handler(event, {})["MultipartUpload"]["UploadId"]
+        s3_client.upload_part(
+            Bucket=event.get("Bucket"), Key="file_name.zip", UploadId=upload_id, PartNumber=1, Body=b"0" * 5 * MiB
+        )
+
+        kwargs["mock"].head(event.get("URL"), headers={**headers, **changed})
+        probe.reset()
+        result = handler(event, {})
+        manifest = result.get("Manifest")
+        tasks = json.loads(s3_client.get_object(Bucket=manifest["Bucket"], Key=manifest["Key"])["Body"].read())
+
+        # the parts of the old version are never combined with the new one, and every part is uploaded again
+        assert result["MultipartUpload"]["UploadId"] != upload_id
+        assert not any("ETag" in task for task in tasks)
+        uploads = s3_client.list_multipart_uploads(Bucket=event.get("Bucket"))["Uploads"]
+        assert sorted(upload["UploadId"] for upload in uploads) == sorted(
+            [upload_id, result["MultipartUpload"]["UploadId"]]
+        )
+
+    @mock_s3
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"}], indirect=True)
+    def test_handler_with_s3_source(self, mocked_env):
+        event = {"URL": "s3://source-bucket/dir/file_name.zip", "Bucket": "bucket_name", "SingleTaskSize": 5 * MiB}
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        s3_client.create_bucket(Bucket="source-bucket")
+        etag = s3_client.put_object(Bucket="source-bucket", Key="dir/file_name.zip", Body=b"0" * 12 * MiB)["ETag"]
+
+        result = handler(event, {})
+
+        assert (result["Key"], result["Mode"], result["IfRange"]) == ("file_name.zip", "multipart", etag)
+        assert result["CopySource"] == {"Bucket": "source-bucket", "Key": "dir/file_name.zip"}
+        assert result["Plan"]["PartCount"] == 3
+        assert handler({**event, "Compression": "gzip"}, {}) == {
+            "Error": (
+                "compression gzip is not supported for s3://source-bucket/dir/file_name.zip, which can only be copied"
+            )
+        }
+
+    @mock_s3
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO", "SINGLE_UPLOAD_MAX_MIB": "0"}], indirect=True)
+    def test_handler_with_unchanged_source(self, mocked_env):
+        event = {"URL": "s3://source-bucket/dir/file_name.zip", "Bucket": "bucket_name", "SingleTaskSize": 5 * MiB}
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        s3_client.create_bucket(Bucket="source-bucket")
+        etag = s3_client.put_object(Bucket="source-bucket", Key="dir/file_name.zip", Body=b"0" * 12 * MiB)["ETag"]
+        metadata = get_source_metadata(12 * MiB, etag, url="s3://source-bucket/dir/file_name.zip")
+        s3_client.put_object(Bucket="bucket_name", Key="file_name.zip", Body=b"0", Metadata=metadata)
+
+        result = handler(event, {})
+
+        assert (result["Mode"], result["Task"], result["Manifest"]) == ("unchanged", {}, {})
+        assert "Uploads" not in s3_client.list_multipart_uploads(Bucket="bucket_name")
+        # a source which changed since is uploaded again
+        s3_client.put_object(Bucket="source-bucket", Key="dir/file_name.zip", Body=b"1" * 12 * MiB)
+        probe.reset()
+        assert handler(event, {})["Mode"] == "multipart"
+
+    def test_resume_tasks_with_checksum(self) -> None:
+        s3_client = boto3.client("s3")
+        connection.set_s3_client(s3_client)
+        uploads = [
+            {
+                "Key": "file_name.zip",
+                "UploadId": "crc32-upload",
+                "Initiated": datetime(2023, 1, 1),
+                "ChecksumAlgorithm": "CRC32",
+            },
+            {
+                "Key": "file_name.zip",
+                "UploadId": "sha1-upload",
+                "Initiated": datetime(2023, 1, 2),
+                "ChecksumAlgorithm": "SHA1",
+            },
+            {"Key": "file_name.zip", "UploadId": "plain-upload", "Initiated": datetime(2023, 1, 3)},
+        ]
+        parts = [
+            {"PartNumber": 1, "ETag": '"etag-1"', "Size": 5 * MiB, "ChecksumCRC32": "crc32-1"},
+            {"PartNumber": 2, "ETag": '"etag-2"', "Size": 1, "ChecksumCRC32": "crc32-2"},
+        ]
+        tasks = [{"index": 1, "start": 0, "end": 5 * MiB - 1}, {"index": 2, "start": 5 * MiB, "end": 6 * MiB - 1}]
+        entry = {
+            "IfRange": '"v1"',
+            "TotalSize": 6 * MiB,
+            "PartSize": 5 * MiB,
+            "Compression": None,
+            "ChecksumAlgorithm": "CRC32",
+        }
+
+        with Stubber(s3_client) as stubber:
+            stubber.add_response(
+                "list_multipart_uploads", {"Uploads": uploads}, {"Bucket": "bucket", "Prefix": "file_name.zip"}
+            )
+            stubber.add_response(
+                "get_object",
+                {"Body": StreamingBody(BytesIO(json.dumps(entry).encode()), len(json.dumps(entry)))},
+                {"Bucket": "bucket", "Key": get_resume_key("file_name.zip", "crc32-upload")},
+            )
+            stubber.add_response(
+                "list_parts", {"Parts": parts}, {"Bucket": "bucket", "Key": "file_name.zip", "UploadId": "crc32-upload"}
+            )
+
+            assert resume_tasks("bucket", "file_name.zip", tasks, entry) == (
+                {"UploadId": "crc32-upload"},
+                [tasks[1], {**tasks[0], "ETag": '"etag-1"', "ChecksumCRC32": "crc32-1"}],
+            )
+
+    @pytest.mark.parametrize(
+        "total,concurrency,expected",
+        [
+            (0, 100, 1),
+            (100, 100, 100),
+            (20 * MiB, 100, MIN_PART_SIZE),
+            (100 * 1024 * MiB, 100, 1024 * MiB),
+            (100 * 1024 * MiB, 10, 5 * 1024 * MiB),
+            (10 * 1024 * 1024 * MiB, 100, 4994 * MiB),
+            (MAX_PART_SIZE * MAX_PARTS, 100, MAX_PART_SIZE),
+        ],
+    )
+    def test_plan_part_size(self, total: int, concurrency: int, expected: int) -> None:
+        size = plan_part_size(total, concurrency, 1.0, 50 * MiB)
+
+        assert size == expected
+        assert MIN_PART_SIZE <= size <= MAX_PART_SIZE or size == max(total, 1)
+        assert ceil(total / size) <= MAX_PARTS
+
     @pytest.mark.parametrize(
-        "total,size,expected",
+        "total,concurrency,err_msg",
         [
-            (0, 3, []),
-            (2, 3, [(0, 2)]),
-            (3, 2, [(0, 2), (3, 3)]),
-            (11, 3, [(0, 3), (4, 7), (8, 11)]),
+            (MAX_PART_SIZE * MAX_PARTS + 1, 100, "exceeds the maximum multipart upload size"),
+            (100, 0, "concurrency 0 must be at least 1"),
         ],
     )
-    def test_split(self, total: int, size: int, expected: list[(int, int)]) -> None:
-        assert expected == split(total, size)
+    def test_plan_part_size_failed(self, total: int, concurrency: int, err_msg: str) -> None:
+        with pytest.raises(ValueError, match=err_msg):
+            plan_part_size(total, concurrency, 1.0, 50 * MiB)
+
+    @pytest.mark.parametrize(
+        "total,size,concurrency,expected",
+        [
+            (35 * MiB, 10 * MiB, 100, 1),
+            (10000 * 5 * MiB, 5 * MiB, 100, 51),
+            (1000 * 5 * MiB, 5 * MiB, 100, 10),
+            (1000 * 5 * MiB, 5 * MiB, 10, 51),
+            (100 * 1024 * MiB, 1024 * MiB, 10, 1),
+        ],
+    )
+    def test_get_batch_size(self, total: int, size: int, concurrency: int, expected: int) -> None:
+        assert get_batch_size(plan_ranges(total, size), concurrency, 256 * MiB) == expected
+
+    @pytest.mark.parametrize(
+        "event,expected",
+        [({}, None), ({"Compression": "identity"}, None), ({"Compression": "gzip"}, "gzip")],
+    )
+    def test_get_compression(self, event: dict, expected) -> None:
+        assert get_compression(event) == expected
+        assert bool(get_metadata(expected, 10, 20)) is (expected is not None)
+
+    @pytest.mark.parametrize(
+        "mocked_env,expected",
+        [
+            ({}, {"Percentile": 95, "MinSeconds": 4.0}),
+            ({"HEDGE_PERCENTILE": "99", "HEDGE_FACTOR": "3"}, {"Percentile": 99, "MinSeconds": 6.0}),
+            ({"HEDGE_PERCENTILE": "0"}, {}),
+        ],
+        indirect=["mocked_env"],
+    )
+    def test_get_hedge(self, mocked_env, expected: dict) -> None:
+        assert get_hedge(50 * MiB, 1.0, 50 * MiB) == expected
@@ -0,0 +1,97 @@
+from random import Random
+from timeit import timeit
+
+import pytest
+
+from partitioner.planner import RangePlan, plan_ranges, validate_multipart_plan
+from shared.constants import MAX_PART_SIZE, MAX_PARTS, MIN_PART_SIZE
+
+TB = 1000**4
+
+
+def random_plans(count: int, seed: int = 20230321) -> list[(int, int)]:
+    rand = Random(seed)
+    plans = []
+    for _ in range(count):
+        total = rand.choice([rand.randint(0, 1000), rand.randint(0, 100 * TB)])
+        min_size = max(1, -(-total // MAX_PARTS))
+        plans.append((total, rand.randint(min_size, max(min_size, total))))
+
+    return plans
+
+
+class TestPlanner:
+    @pytest.mark.parametrize(
+        "total,size,expected",
+        [
+            (0, 3, []),
+            (2, 3, [(0, 1)]),
+            (3, 2, [(0, 1), (2, 2)]),
+            (11, 3, [(0, 2), (3, 5), (6, 8), (9, 10)]),
+            (12, 3, [(0, 2), (3, 5), (6, 8), (9, 11)]),
+            (1, 1, [(0, 0)]),
+        ],
+    )
+    def test_plan_ranges(self, total: int, size: int, expected: list[(int, int)]) -> None:
+        assert plan_ranges(total, size) == expected
+        assert len(plan_ranges(total, size)) == len(expected)
+        assert plan_ranges(total, size)[:] == expected
+
+    @pytest.mark.parametrize("total,size", random_plans(200))
+    def test_plan_ranges_covers_file_exactly(self, total: int, size: int) -> None:
+        ranges = plan_ranges(total, size)
+        expected_start = 0
+
+        for index, (start, end) in enumerate(ranges):
+            assert start == expected_start
+            assert end - start + 1 == (size if index < len(ranges) - 1 else total - start)
+            assert 0 < end - start + 1 <= size
+            assert ranges[index] == (start, end)
+            expected_start = end + 1
+
+        assert expected_start == total
+        assert len(ranges) == -(-total // size)
+
+    def test_plan_ranges_indexing(self) -> None:
+        ranges = plan_ranges(100 * TB, MAX_PART_SIZE)
+
+        assert ranges[0] == (0, MAX_PART_SIZE - 1)
+        assert ranges[-1] == ranges[len(ranges) - 1] == ((len(ranges) - 1) * MAX_PART_SIZE, 100 * TB - 1)
+        assert ranges[1:3] == [(MAX_PART_SIZE, 2 * MAX_PART_SIZE - 1), (2 * MAX_PART_SIZE, 3 * MAX_PART_SIZE - 1)]
+
+        with pytest.raises(IndexError):
+            ranges[len(ranges)]
+
+    def test_plan_ranges_is_constant_time(self) -> None:
+        seconds = timeit(lambda: plan_ranges(MAX_PART_SIZE * MAX_PARTS, MAX_PART_SIZE)[-1], number=1000)
+        assert seconds < 0.1
+
+    @pytest.mark.parametrize(
+        "total,size,err_msg",
+        [
+            (-1, 10, "total size -1 must not be negative"),
+            (10, 0, "part size 0 must be at least 1"),
+        ],
+    )
+    def test_plan_ranges_failed(self, total: int, size: int, err_msg: str) -> None:
+        with pytest.raises(ValueError, match=err_msg):
+            RangePlan(total, size)
+
+    @pytest.mark.parametrize(
+        "total,size,err_msg",
+        [
+            (MIN_PART_SIZE * (MAX_PARTS + 1), MIN_PART_SIZE, "10001 parts exceeds the maximum of 10000 parts"),
+            (MAX_PART_SIZE + 1, MAX_PART_SIZE + 1, "exceeds the maximum part size"),
+            (MIN_PART_SIZE, MIN_PART_SIZE - 1, "is below the minimum part size"),
+            (MIN_PART_SIZE, MIN_PART_SIZE, None),
+            (100, 100 * MIN_PART_SIZE, None),
+            (0, MIN_PART_SIZE, None),
+        ],
+    )
+    def test_validate_multipart_plan(self, total: int, size: int, err_msg: str) -> None:
+        if err_msg is None:
+            validate_multipart_plan(plan_ranges(total, size))
+            return
+
+        with pytest.raises(ValueError, match=err_msg):
+            validate_multipart_plan(plan_ranges(total, size))
@@ -0,0 +1,141 @@
+import boto3
+import pytest
+import requests_mock
+from moto import mock_s3
+
+from partitioner import probe
+
+URL = "https://download.test/file_name.zip"
+MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+class TestProbe:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize(
+        "head,get,expected",
+        [
+            (
+                {"headers": {"Accept-Ranges": "bytes", "Content-Length": "100", "ETag": '"a"'}},
+                None,
+                {"TotalSize": 100, "ETag": '"a"', "LastModified": None, "IfRange": '"a"'},
+            ),
+            (
+                {
+                    "headers": {
+                        "Accept-Ranges": "bytes",
+                        "Content-Length": "100",
+                        "ETag": 'W/"a"',
+                        "Last-Modified": MODIFIED,
+                    }
+                },
+                None,
+                {"TotalSize": 100, "ETag": 'W/"a"', "LastModified": MODIFIED, "IfRange": MODIFIED},
+            ),
+            (
+                {"status_code": 405},
+                {"status_code": 206, "headers": {"Content-Range": "bytes 0-0/100", "ETag": '"a"'}},
+                {"TotalSize": 100, "ETag": '"a"', "LastModified": None, "IfRange": '"a"'},
+            ),
+            (
+                {"headers": {"Content-Length": "100", "Last-Modified": MODIFIED}},
+                {"status_code": 206, "headers": {"Content-Range": "bytes 0-0/100", "Last-Modified": MODIFIED}},
+                {"TotalSize": 100, "ETag": None, "LastModified": MODIFIED, "IfRange": MODIFIED},
+            ),
+            (
+                {"status_code": 403},
+                {"status_code": 416, "headers": {"Content-Range": "bytes */0"}},
+                {"TotalSize": 0, "ETag": None, "LastModified": None, "IfRange": None},
+            ),
+        ],
+    )
+    def test_probe(self, head, get, expected, **kwargs) -> None:
+        m = kwargs["mock"]
+        m.head(URL, **head)
+        if get is not None:
+            m.get(URL, **get)
+
+        assert probe.probe(URL) == expected
+        assert m.call_count == (1 if get is None else 2)
+        if get is not None:
+            assert m.request_history[-1].headers["Range"] == "bytes=0-0"
+
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize(
+        "get,err_msg",
+        [
+            ({"status_code": 200}, "accept-range is not supported"),
+            ({"status_code": 206, "headers": {"Content-Range": "bytes 0-0/*"}}, "content-length is not found"),
+        ],
+    )
+    def test_probe_failed(self, get, err_msg, **kwargs) -> None:
+        kwargs["mock"].head(URL, headers={"Content-Length": "100"})
+        kwargs["mock"].get(URL, **get)
+
+        with pytest.raises(ValueError, match=err_msg):
+            probe.probe(URL)
+
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("mocked_env,calls", [({}, 1), ({"PROBE_TTL_SECONDS": "0"}, 2)], indirect=["mocked_env"])
+    def test_probe_cached(self, mocked_env, calls, **kwargs) -> None:
+        kwargs["mock"].head(URL, headers={"Accept-Ranges": "bytes", "Content-Length": "100"})
+
+        assert probe.probe(URL) == probe.probe(URL)
+        assert kwargs["mock"].call_count == calls
+
+    @pytest.mark.parametrize(
+        "url,expected",
+        [
+            ("s3://bucket_name/dir/file_name.zip", {"Bucket": "bucket_name", "Key": "dir/file_name.zip"}),
+            ("https://bucket-name.s3.amazonaws.com/file%20name.zip", {"Bucket": "bucket-name", "Key": "file name.zip"}),
+            (
+                "https://bucket.name.s3.us-west-2.amazonaws.com/file_name.zip?X-Amz-Signature=abc",
+                {"Bucket": "bucket.name", "Key": "file_name.zip"},
+            ),
+            (
+                "https://s3.us-west-2.amazonaws.com/bucket-name/file_name.zip",
+                {"Bucket": "bucket-name", "Key": "file_name.zip"},
+            ),
+            (
+                "https://bucket-name.s3-us-west-2.amazonaws.com/file_name.zip",
+                {"Bucket": "bucket-name", "Key": "file_name.zip"},
+            ),
+            ("https://s3.amazonaws.com/bucket-name", None),
+            ("https://awscli.amazonaws.com/file_name.zip", None),
+            (URL, None),
+        ],
+    )
+    def test_parse_s3_url(self, url: str, expected) -> None:
+        assert probe.parse_s3_url(url) == expected
+
+    def test_parse_s3_url_without_key(self) -> None:
+        with pytest.raises(ValueError, match="s3://bucket_name is not an s3://bucket/key url"):
+            probe.parse_s3_url("s3://bucket_name")
+
+    @mock_s3
+    def test_probe_s3_source(self) -> None:
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket-name")
+        etag = s3_client.put_object(Bucket="bucket-name", Key="file_name.zip", Body=b"0" * 100)["ETag"]
+        source = probe.probe("s3://bucket-name/file_name.zip")
+
+        assert source["CopySource"] == {"Bucket": "bucket-name", "Key": "file_name.zip"}
+        assert (source["TotalSize"], source["ETag"], source["IfRange"]) == (100, etag, etag)
+        assert source["LastModified"].endswith(" GMT")
+
+        with pytest.raises(ValueError, match="failed to read s3://bucket-name/missing.zip"):
+            probe.probe("s3://bucket-name/missing.zip")
+
+    @mock_s3
+    @requests_mock.Mocker(kw="mock", real_http=True)
+    def test_probe_s3_url_without_access(self, **kwargs) -> None:
+        # an object the partitioner cannot read, such as a presigned url to another account, is downloaded
+        url = "https://bucket-name.s3.amazonaws.com/file_name.zip?X-Amz-Signature=abc"
+        boto3.client("s3").create_bucket(Bucket="bucket-name")
+        kwargs["mock"].head(url, headers={"Accept-Ranges": "bytes", "Content-Length": "100", "ETag": '"a"'})
+
+        assert probe.probe(url) == {"TotalSize": 100, "ETag": '"a"', "LastModified": None, "IfRange": '"a"'}
@@ -0,0 +1,122 @@
+from os import getenv
+from threading import Lock
+from typing import Optional, Tuple
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from shared.throttle import DEFAULT_MAX_RETRY_AFTER, THROTTLED_STATUSES, JitteredRetry
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_HTTP_RETRIES = 3
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+# botocore's own default, CompleteMultipartUpload of a large object can take minutes longer
+DEFAULT_S3_READ_TIMEOUT = 60
+
+# created on first use and kept while the container is warm
+_lock = Lock()
+_s3_clients: dict[bool, object] = {}
+_http_session: Optional[Session] = None
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """Gives every request a (connect, read) timeout, unless it has one of its own."""
+
+    def __init__(self, timeout: Tuple[float, float], **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.timeout = timeout
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+
+def get_http_timeout() -> Tuple[float, float]:
+    # requests waits forever by default, so a stalled origin would hold a thread until the Lambda times out
+    return (
+        float(getenv("HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+        float(getenv("HTTP_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+    )
+
+
+def new_s3_client(streaming: bool = False):
+    # boto3 takes longer to import than the rest of a handler
+    from boto3 import client
+    from botocore.config import Config
+    from botocore.utils import conditionally_calculate_md5
+
+    pool_size = int(getenv("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+    read_timeout = float(getenv("S3_READ_TIMEOUT", DEFAULT_S3_READ_TIMEOUT))
+    if not streaming:
+        return client("s3", config=Config(max_pool_connections=pool_size, read_timeout=read_timeout))
+
+    # a streamed body can only be read once, so botocore must neither pre-read it for an MD5 or signature nor retry
+    s3 = client(
+        "s3",
+        config=Config(
+            s3={"payload_signing_enabled": False},
+            retries={"max_attempts": 0},
+            max_pool_connections=pool_size,
+            read_timeout=read_timeout,
+        ),
+    )
+    for operation in ("UploadPart", "PutObject"):
+        s3.meta.events.unregister(f"before-call.s3.{operation}", conditionally_calculate_md5)
+    return s3
+
+
+def new_http_session() -> Session:
+    retry = JitteredRetry(
+        total=int(getenv("HTTP_RETRIES", DEFAULT_HTTP_RETRIES)),
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=(502, 504, *THROTTLED_STATUSES),
+        allowed_methods=("HEAD", "GET"),
+        raise_on_status=False,
+        max_retry_after=float(getenv("HTTP_MAX_RETRY_AFTER", DEFAULT_MAX_RETRY_AFTER)),
+    )
+    adapter = TimeoutHTTPAdapter(
+        get_http_timeout(), pool_maxsize=int(getenv("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)), max_retries=retry
+    )
+
+    session = Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_s3_client(streaming: bool = False):
+    s3 = _s3_clients.get(streaming)
+    if s3 is not None:
+        return s3
+
+    with _lock:
+        if streaming not in _s3_clients:
+            _s3_clients[streaming] = new_s3_client(streaming)
+
+        return _s3_clients[streaming]
+
+
+def get_http_session() -> Session:
+    global _http_session
+
+    if _http_session is None:
+        with _lock:
+            if _http_session is None:
+                _http_session = new_http_session()
+
+    return _http_session
+
+
+def set_s3_client(s3, streaming: bool = False) -> None:
+    _s3_clients[streaming] = s3
+
+
+def set_http_session(session: Optional[Session]) -> None:
+    global _http_session
+    _http_session = session
+
+
+def reset() -> None:
+    _s3_clients.clear()
+    set_http_session(None)
@@ -0,0 +1,10 @@
+MiB = 1024 * 1024
+# S3 multipart upload limits
+MIN_PART_SIZE = 5 * MiB
+MAX_PART_SIZE = 5 * 1024 * MiB
+MAX_PARTS = 10000
+# the checksums S3 returns for a part or an object
+CHECKSUM_FIELDS = ("ChecksumCRC32", "ChecksumCRC32C", "ChecksumSHA1", "ChecksumSHA256")
+COMPRESSIONS = ("gzip",)
+# the state machine default, as a state cannot pass on a value which may be missing
+NO_COMPRESSION = "identity"
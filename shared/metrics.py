@@ -0,0 +1,155 @@
+import json
+from contextlib import contextmanager
+from os import getenv
+from threading import Lock
+from time import perf_counter, time
+from typing import Callable, Iterator, Optional, Union
+
+DEFAULT_NAMESPACE = "FileUploader"
+MAX_VALUES = 100
+
+Sink = Callable[[dict], None]
+
+
+class Unit:
+    COUNT = "Count"
+    BYTES = "Bytes"
+    SECONDS = "Seconds"
+    MILLISECONDS = "Milliseconds"
+    MEGABYTES_PER_SECOND = "Megabytes/Second"
+
+
+class Metrics:
+    """Metrics of one invocation, written as a single CloudWatch embedded metric format (EMF) record.
+
+    ``add`` sums a value over the invocation, ``observe`` keeps every value (up to ``MAX_VALUES``) for CloudWatch
+    to aggregate, and ``maximum`` keeps the largest. Every method may be called from any thread.
+    """
+
+    def __init__(self, function: str, cold_start: bool) -> None:
+        self.function = function
+        self.units: dict[str, str] = {}
+        self.values: dict[str, Union[float, list[float]]] = {}
+        self.properties: dict[str, object] = {}
+        self._lock = Lock()
+        self.add("ColdStart", int(cold_start))
+
+    def add(self, name: str, value: float, unit: str = Unit.COUNT) -> None:
+        with self._lock:
+            self.units[name] = unit
+            self.values[name] = self.values.get(name, 0) + value
+
+    def observe(self, name: str, value: float, unit: str = Unit.COUNT) -> None:
+        with self._lock:
+            self.units[name] = unit
+            values = self.values.setdefault(name, [])
+            if len(values) < MAX_VALUES:
+                values.append(value)
+
+    def maximum(self, name: str, value: float, unit: str = Unit.COUNT) -> None:
+        with self._lock:
+            self.units[name] = unit
+            self.values[name] = max(self.values.get(name, value), value)
+
+    def get(self, name: str, default: float = 0) -> float:
+        return self.values.get(name, default)
+
+    def set_property(self, name: str, value) -> None:
+        self.properties[name] = value
+
+    def to_emf(self) -> dict:
+        with self._lock:
+            return {
+                "_aws": {
+                    "Timestamp": int(time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": getenv("METRICS_NAMESPACE", DEFAULT_NAMESPACE),
+                            "Dimensions": [["Function"]],
+                            "Metrics": [{"Name": name, "Unit": unit} for name, unit in self.units.items()],
+                        }
+                    ],
+                },
+                "Function": self.function,
+                **self.properties,
+                **{name: list(value) if isinstance(value, list) else value for name, value in self.values.items()},
+            }
+
+
+class MetricsCollector:
+    """Sink which keeps the records in memory, for tests and benchmarks to aggregate."""
+
+    def __init__(self) -> None:
+        self.records: list[dict] = []
+
+    def __call__(self, record: dict) -> None:
+        self.records.append(record)
+
+    def total(self, name: str) -> float:
+        return sum(sum(v) if isinstance(v, list) else v for v in (r[name] for r in self.records if name in r))
+
+    def values(self, name: str) -> list[float]:
+        return [x for r in self.records if name in r for x in (r[name] if isinstance(r[name], list) else [r[name]])]
+
+
+def write_stdout(record: dict) -> None:
+    # CloudWatch Logs extracts the metrics of any log line which is an EMF record
+    print(json.dumps(record, separators=(",", ":"), default=str), flush=True)
+
+
+_cold_start = True
+_current: Optional[Metrics] = None
+_sink: Sink = write_stdout
+
+
+@contextmanager
+def invocation(function: str) -> Iterator[Metrics]:
+    """Collects the metrics of one invocation of a Lambda handler and writes them once it returns or fails."""
+    global _cold_start, _current
+    metrics = _current = Metrics(function, _cold_start)
+    _cold_start = False
+    began = perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.add("InvocationSeconds", perf_counter() - began, Unit.SECONDS)
+        _current = None
+        _sink(metrics.to_emf())
+
+
+def add(name: str, value: float, unit: str = Unit.COUNT) -> None:
+    """Adds to the metric of the invocation in progress, if any, so library code can record without one."""
+    if _current is not None:
+        _current.add(name, value, unit)
+
+
+def observe(name: str, value: float, unit: str = Unit.COUNT) -> None:
+    if _current is not None:
+        _current.observe(name, value, unit)
+
+
+def maximum(name: str, value: float, unit: str = Unit.COUNT) -> None:
+    if _current is not None:
+        _current.maximum(name, value, unit)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Adds the seconds spent in the block to ``name``."""
+    began = perf_counter()
+    try:
+        yield
+    finally:
+        add(name, perf_counter() - began, Unit.SECONDS)
+
+
+def set_sink(sink: Optional[Sink]) -> None:
+    """Sends the records to ``sink`` instead of stdout, or back to stdout with None."""
+    global _sink
+    _sink = write_stdout if sink is None else sink
+
+
+def reset() -> None:
+    global _cold_start, _current
+    _cold_start, _current = True, None
+    set_sink(None)
@@ -0,0 +1,225 @@
+import json
+from contextlib import contextmanager
+from os import getenv, makedirs, walk
+from os.path import dirname, join, relpath
+from threading import Event, Lock, Thread
+from time import time
+from typing import Iterator, Optional, Union
+from uuid import uuid4
+
+from shared.connection import get_s3_client
+
+DEFAULT_FLUSH_PARTS = 64
+DEFAULT_FLUSH_SECONDS = 10.0
+DEFAULT_WINDOW_SECONDS = 60.0
+MB = 1000 * 1000
+
+
+class S3Store:
+    """Progress records as objects under ``prefix`` in ``bucket``."""
+
+    def __init__(self, bucket: str, prefix: str) -> None:
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def put(self, key: str, body: bytes) -> None:
+        get_s3_client().put_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}", Body=body)
+
+    def list(self, prefix: str = "") -> list[str]:
+        pages = (
+            get_s3_client()
+            .get_paginator("list_objects_v2")
+            .paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/{prefix}")
+        )
+        return [obj["Key"][len(self.prefix) + 1 :] for page in pages for obj in page.get("Contents", [])]
+
+    def get(self, key: str) -> bytes:
+        return get_s3_client().get_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}")["Body"].read()
+
+
+class LocalStore:
+    """Stand-in for the S3 store which keeps the records as files under ``directory``, for local runs and tests."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def put(self, key: str, body: bytes) -> None:
+        path = join(self.directory, key)
+        makedirs(dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
+
+    def list(self, prefix: str = "") -> list[str]:
+        keys = [
+            relpath(join(root, name), self.directory)
+            for root, _, names in walk(self.directory)
+            for name in names
+            if not name.startswith(".")
+        ]
+        return sorted(key for key in keys if key.startswith(prefix))
+
+    def get(self, key: str) -> bytes:
+        with open(join(self.directory, key), "rb") as f:
+            return f.read()
+
+
+Store = Union[S3Store, LocalStore]
+
+
+def get_store(location: Optional[str] = None) -> Optional[Store]:
+    """The store at ``location``, or else ``PROGRESS_STORE``, either ``s3://bucket/prefix`` or a local directory.
+
+    Progress is not recorded without one.
+    """
+    location = location or getenv("PROGRESS_STORE")
+    if not location:
+        return None
+
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://") :].partition("/")
+        return S3Store(bucket, prefix or "progress")
+
+    return LocalStore(location)
+
+
+class ProgressRecorder:
+    """Buffers the parts completed by an invocation and writes them in batches, one record per upload, every
+    ``flush_parts`` parts or ``flush_seconds`` seconds and once the invocation ends. The writes run on a background
+    thread once ``start`` is called, so a part only pays for a list append."""
+
+    def __init__(
+        self, store: Store, flush_parts: int = DEFAULT_FLUSH_PARTS, flush_seconds: float = DEFAULT_FLUSH_SECONDS
+    ) -> None:
+        self.store = store
+        self.flush_parts = flush_parts
+        self.flush_seconds = flush_seconds
+        self._uploads: dict[str, dict] = {}
+        self._parts: list[tuple[str, dict]] = []
+        self._lock = Lock()
+        self._due = Event()
+        self._closed = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        self._thread = Thread(target=self._run, name="progress-flush", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            self._due.wait(self.flush_seconds)
+            self._due.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """Stops the background thread, and writes what is left."""
+        self._closed.set()
+        self._due.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        self.flush()
+
+    def record(self, upload: dict, part_number: int, size: int, seconds: float) -> None:
+        part = {"PartNumber": part_number, "Bytes": size, "Seconds": round(seconds, 3), "Finished": time()}
+        with self._lock:
+            self._uploads.setdefault(upload["Upload"], upload)
+            self._parts.append((upload["Upload"], part))
+            due = len(self._parts) >= self.flush_parts
+
+        if due:
+            self._due.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            parts, self._parts = self._parts, []
+
+        by_upload: dict[str, list[dict]] = {}
+        for upload_id, part in parts:
+            by_upload.setdefault(upload_id, []).append(part)
+
+        for upload_id, upload_parts in by_upload.items():
+            record = {**self._uploads[upload_id], "Parts": upload_parts}
+            try:
+                # records are never updated, so concurrent invocations only ever add objects
+                self.store.put(f"{upload_id}/{int(time() * 1000)}-{uuid4().hex}.json", json.dumps(record).encode())
+            except Exception as e:
+                # progress is only reported, a failed write must not fail the upload
+                from loguru import logger
+
+                logger.warning(f"failed to record {len(upload_parts)} parts of upload {upload_id}: {e}")
+
+
+_current: Optional[ProgressRecorder] = None
+
+
+@contextmanager
+def recording() -> Iterator[Optional[ProgressRecorder]]:
+    """Records the progress of one invocation to ``PROGRESS_STORE``, if set, and writes what is left once it ends."""
+    global _current
+    store = get_store()
+    if store is not None:
+        _current = ProgressRecorder(
+            store,
+            int(getenv("PROGRESS_FLUSH_PARTS", DEFAULT_FLUSH_PARTS)),
+            float(getenv("PROGRESS_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS)),
+        )
+        _current.start()
+
+    recorder = _current
+    try:
+        yield recorder
+    finally:
+        _current = None
+        if recorder is not None:
+            recorder.close()
+
+
+def record(upload: dict, part_number: int, size: int, seconds: float) -> None:
+    """Records a completed part of ``upload``, a dict with its ``Upload`` id, ``Key`` and ``TotalSize``."""
+    if _current is not None:
+        _current.record(upload, part_number, size, seconds)
+
+
+def read_records(store: Store, upload_id: str) -> list[dict]:
+    return [json.loads(store.get(key)) for key in store.list(f"{upload_id}/")]
+
+
+def list_uploads(store: Store) -> list[str]:
+    return sorted({key.split("/", 1)[0] for key in store.list()})
+
+
+def get_progress(
+    store: Store, upload_id: str, now: Optional[float] = None, window: float = DEFAULT_WINDOW_SECONDS
+) -> dict:
+    """Percent complete, the aggregate MB/s of the parts finished in the last ``window`` seconds and the projected
+    completion at that rate. A part uploaded more than once, by a retry or a hedge, is counted once, and a part
+    uploaded by an earlier run of a resumed upload, recorded as taking no time, only counts towards the percent."""
+    now = time() if now is None else now
+    records = read_records(store, upload_id)
+    if not records:
+        raise ValueError(f"no progress recorded for {upload_id}")
+
+    parts = {part["PartNumber"]: part for record in records for part in record["Parts"]}
+    total = records[0].get("TotalSize")
+    transferred = sum(part["Bytes"] for part in parts.values())
+    timed = [part for part in parts.values() if part["Seconds"] > 0]
+    started = min((part["Finished"] - part["Seconds"] for part in timed), default=now)
+    recent = sum(part["Bytes"] for part in timed if part["Finished"] >= now - window)
+    rate = recent / max(min(window, now - started), 1e-3)
+
+    percent, eta = None, None
+    if total is not None:
+        remaining = max(total - transferred, 0)
+        percent = round(100 * transferred / total, 1) if total else 100.0
+        eta = 0 if not remaining else round(remaining / rate) if rate else None
+
+    return {
+        "Upload": upload_id,
+        "Key": records[0].get("Key"),
+        "TotalSize": total,
+        "BytesTransferred": transferred,
+        "PartsCompleted": len(parts),
+        "PercentComplete": percent,
+        "MBps": round(rate / MB, 1),
+        "ETASeconds": eta,
+    }
@@ -0,0 +1,4 @@
+from shared.tests.fixtures import reset_fixture
+
+# autouse, clears the clients and limiters a warm container keeps around every test here
+reset = reset_fixture()
@@ -0,0 +1,74 @@
+from unittest.mock import sentinel
+
+import pytest
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectTimeout
+
+from shared import connection
+from shared.throttle import JitteredRetry
+
+
+class TestConnection:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    def test_get_s3_client(self, monkeypatch) -> None:
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+        monkeypatch.setenv("S3_READ_TIMEOUT", "840")
+        s3 = connection.get_s3_client()
+        streaming_s3 = connection.get_s3_client(streaming=True)
+
+        assert s3 is connection.get_s3_client()
+        assert streaming_s3 is connection.get_s3_client(streaming=True)
+        assert s3 is not streaming_s3
+        assert streaming_s3.meta.config.retries["total_max_attempts"] == 1
+        assert streaming_s3.meta.config.s3 == {"payload_signing_enabled": False}
+        assert s3.meta.config.read_timeout == streaming_s3.meta.config.read_timeout == 840
+
+    @pytest.mark.parametrize(
+        "mocked_env,pool_size,retries,timeout",
+        [
+            ({}, connection.DEFAULT_POOL_SIZE, connection.DEFAULT_HTTP_RETRIES, (5, 30)),
+            ({"HTTP_POOL_SIZE": "4", "HTTP_RETRIES": "1", "HTTP_READ_TIMEOUT": "2.5"}, 4, 1, (5, 2.5)),
+        ],
+        indirect=["mocked_env"],
+    )
+    def test_get_http_session(self, mocked_env, pool_size: int, retries: int, timeout: tuple) -> None:
+        session = connection.get_http_session()
+        adapter = session.get_adapter("https://download.test/file_name.txt")
+
+        assert session is connection.get_http_session()
+        assert adapter.timeout == timeout
+        assert adapter._pool_maxsize == pool_size
+        assert adapter.max_retries.total == retries
+        assert adapter.max_retries.read == 0
+        assert isinstance(adapter.max_retries, JitteredRetry)
+        assert set(adapter.max_retries.status_forcelist) == {429, 502, 503, 504}
+
+    @pytest.mark.parametrize("timeout,expected", [(None, (5, 30)), (1, 1)])
+    def test_request_timeout(self, monkeypatch, timeout, expected) -> None:
+        def send(self, request, **kwargs):
+            raise ConnectTimeout(kwargs["timeout"])
+
+        monkeypatch.setattr(HTTPAdapter, "send", send)
+        with pytest.raises(ConnectTimeout) as e:
+            connection.get_http_session().get("https://download.test/file_name.txt", timeout=timeout)
+
+        assert e.value.args == (expected,)
+
+    def test_set_connections(self) -> None:
+        session = Session()
+        connection.set_s3_client(sentinel.s3)
+        connection.set_s3_client(sentinel.streaming_s3, streaming=True)
+        connection.set_http_session(session)
+
+        assert connection.get_s3_client() is sentinel.s3
+        assert connection.get_s3_client(streaming=True) is sentinel.streaming_s3
+        assert connection.get_http_session() is session
+
+        connection.reset()
+
+        assert connection.get_http_session() is not session
@@ -0,0 +1,46 @@
+from http import HTTPStatus
+from typing import Callable
+
+import pytest
+
+from shared import connection, throttle
+
+
+def serve_range(content: bytes, failures: int = 0, status_code: int = HTTPStatus.INTERNAL_SERVER_ERROR):
+    """requests_mock callback serving ranges of ``content``, but answering the first ``failures`` requests with
+    ``status_code``."""
+    served = []
+
+    def callback(request, context):
+        served.append(request.headers["Range"])
+        if len(served) <= failures:
+            context.status_code = status_code
+            return content if status_code == HTTPStatus.OK else b""
+
+        start, end = (int(v) for v in request.headers["Range"][len("bytes=") :].split("-"))
+        if start >= len(content):
+            context.status_code = HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+            return b""
+
+        end = min(end, len(content) - 1)
+        context.status_code = HTTPStatus.PARTIAL_CONTENT
+        context.headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+        return content[start : end + 1]
+
+    return callback
+
+
+def reset_fixture(*resets: Callable[[], None]):
+    """Autouse fixture clearing the clients and limiters a warm container keeps around every test, and whatever the
+    component's own ``resets`` clear, which the shared modules know nothing about."""
+    resets = (connection.reset, throttle.reset, *resets)
+
+    @pytest.fixture(scope="function", autouse=True)
+    def reset():
+        for reset_module in resets:
+            reset_module()
+        yield
+        for reset_module in resets:
+            reset_module()
+
+    return reset
@@ -0,0 +1,24 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+# what the handlers need at import, and what requests brings along, anything else is imported where it is used
+HANDLER_PACKAGES = {"certifi", "chardet", "charset_normalizer", "idna", "loguru", "requests", "urllib3"}
+
+
+def import_module(module: str) -> dict:
+    """Imports the module in a fresh interpreter, as a cold Lambda container does, returning the installed
+    packages it loads. Unlike the time it takes, they do not depend on how busy the machine is."""
+    code = (
+        "import json, site, sys\n"
+        "before = set(sys.modules)\n"
+        f"import {module}\n"
+        "paths = {name: getattr(sys.modules[name], '__file__', None) or '' for name in set(sys.modules) - before}\n"
+        "installed = (*site.getsitepackages(), site.getusersitepackages())\n"
+        "packages = {name.split('.')[0] for name, path in paths.items() if path.startswith(installed)}\n"
+        "print(json.dumps({'modules': sorted(paths), 'packages': sorted(packages)}))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
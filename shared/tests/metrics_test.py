@@ -0,0 +1,82 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from shared import metrics
+from shared.metrics import Metrics, MetricsCollector, Unit
+
+
+class TestMetrics:
+    @pytest.fixture(scope="function", autouse=True)
+    def collector(self):
+        metrics.reset()
+        collector = MetricsCollector()
+        metrics.set_sink(collector)
+        yield collector
+        metrics.reset()
+
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    def test_metrics(self) -> None:
+        m = Metrics("uploader", cold_start=False)
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda i: m.add("BytesTransferred", i, Unit.BYTES), range(100)))
+
+        m.observe("TimeToFirstByte", 12.5, Unit.MILLISECONDS)
+        m.observe("TimeToFirstByte", 7.5, Unit.MILLISECONDS)
+        m.maximum("TmpBytesUsed", 10, Unit.BYTES)
+        m.maximum("TmpBytesUsed", 5, Unit.BYTES)
+        m.set_property("UploadMode", "stream")
+
+        assert m.get("BytesTransferred") == 4950
+        assert m.get("Missing") == 0
+
+    @pytest.mark.parametrize("mocked_env", [{"METRICS_NAMESPACE": "Test"}], indirect=True)
+    def test_invocation(self, mocked_env, collector) -> None:
+        metrics.add("PartCount", 1)
+
+        for _ in range(2):
+            with metrics.invocation("uploader") as m:
+                m.set_property("UploadMode", "stream")
+                metrics.add("PartCount", 2)
+                metrics.observe("TimeToFirstByte", 12.5, Unit.MILLISECONDS)
+                with metrics.timed("PartSeconds"):
+                    pass
+
+        with pytest.raises(ValueError):
+            with metrics.invocation("uploader"):
+                raise ValueError("failed")
+
+        first = collector.records[0]
+        assert first["_aws"]["CloudWatchMetrics"] == [
+            {
+                "Namespace": "Test",
+                "Dimensions": [["Function"]],
+                "Metrics": [
+                    {"Name": "ColdStart", "Unit": "Count"},
+                    {"Name": "PartCount", "Unit": "Count"},
+                    {"Name": "TimeToFirstByte", "Unit": "Milliseconds"},
+                    {"Name": "PartSeconds", "Unit": "Seconds"},
+                    {"Name": "InvocationSeconds", "Unit": "Seconds"},
+                ],
+            }
+        ]
+        assert (first["Function"], first["UploadMode"], first["PartCount"]) == ("uploader", "stream", 2)
+        assert collector.values("ColdStart") == [1, 0, 0]
+        assert collector.total("PartCount") == 4
+        assert collector.values("TimeToFirstByte") == [12.5, 12.5]
+        assert len(collector.values("InvocationSeconds")) == 3
+
+    def test_write_stdout(self, capsys) -> None:
+        metrics.set_sink(None)
+        with metrics.invocation("partitioner"):
+            metrics.add("ProbeSeconds", 0.5, Unit.SECONDS)
+
+        record = json.loads(capsys.readouterr().out)
+        assert record["Function"] == "partitioner"
+        assert record["ProbeSeconds"] == 0.5
+        assert isinstance(record["_aws"]["Timestamp"], int)
@@ -0,0 +1,126 @@
+import json
+from time import monotonic, sleep
+
+import boto3
+import pytest
+from loguru import logger
+from moto import mock_s3
+
+from shared import progress
+from shared.progress import LocalStore, ProgressRecorder, S3Store, get_progress, get_store, list_uploads
+
+UPLOAD = {"Upload": "upload-id", "Bucket": "bucket_name", "Key": "file.bin", "TotalSize": 400}
+
+
+class TestProgress:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    @pytest.mark.parametrize(
+        "location,expected",
+        [
+            (None, None),
+            ("s3://bucket_name", ("bucket_name", "progress")),
+            ("s3://bucket_name/uploads/progress/", ("bucket_name", "uploads/progress")),
+        ],
+    )
+    def test_get_store(self, location, expected) -> None:
+        store = get_store(location)
+
+        assert (store and (store.bucket, store.prefix)) == expected
+        assert isinstance(get_store("/tmp/progress"), LocalStore)
+
+    @mock_s3
+    def test_s3_store(self, monkeypatch) -> None:
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+        boto3.client("s3").create_bucket(Bucket="bucket_name")
+        store = S3Store("bucket_name", "progress/")
+        store.put("a/1.json", b"1")
+        store.put("b/2.json", b"2")
+
+        assert store.list() == ["a/1.json", "b/2.json"]
+        assert store.list("b/") == ["b/2.json"]
+        assert store.get("a/1.json") == b"1"
+
+    def test_recorder_writes_in_batches(self, tmp_path) -> None:
+        store = LocalStore(str(tmp_path))
+        recorder = ProgressRecorder(store, flush_parts=3, flush_seconds=60)
+        recorder.start()
+        for part_number in range(1, 4):
+            recorder.record(UPLOAD, part_number, 100, 1.0)
+
+        # the background thread writes the batch, not the part which filled it
+        deadline = monotonic() + 5
+        while not store.list() and monotonic() < deadline:
+            sleep(0.01)
+
+        assert len(store.list()) == 1
+
+        recorder.record({**UPLOAD, "Upload": "other-id"}, 1, 100, 1.0)
+        recorder.close()
+        recorder.flush()
+
+        assert len(store.list()) == 2
+        assert list_uploads(store) == ["other-id", "upload-id"]
+
+    def test_recorder_with_failing_store(self, tmp_path) -> None:
+        messages: list[str] = []
+        sink = logger.add(messages.append, format="{message}")
+        store = LocalStore(str(tmp_path))
+        recorder = ProgressRecorder(store, flush_parts=1, flush_seconds=60)
+
+        def fail(key: str, body: bytes) -> None:
+            raise OSError("store unavailable")
+
+        store.put = fail
+        recorder.start()
+        recorder.record(UPLOAD, 1, 100, 1.0)
+        recorder.close()
+        logger.remove(sink)
+
+        assert store.list() == []
+        assert messages == ["failed to record 1 parts of upload upload-id: store unavailable\n"]
+
+    @pytest.mark.parametrize("mocked_env", [{"PROGRESS_FLUSH_PARTS": "100"}], indirect=True)
+    def test_recording(self, mocked_env, monkeypatch, tmp_path) -> None:
+        progress.record(UPLOAD, 1, 100, 1.0)
+        with progress.recording() as recorder:
+            assert recorder is None
+
+        monkeypatch.setenv("PROGRESS_STORE", str(tmp_path))
+        with progress.recording() as recorder:
+            progress.record(UPLOAD, 1, 100, 1.0)
+            progress.record(UPLOAD, 2, 100, 1.0)
+            assert LocalStore(str(tmp_path)).list() == []
+
+        assert get_progress(LocalStore(str(tmp_path)), "upload-id")["PartsCompleted"] == 2
+
+    def test_get_progress(self, tmp_path) -> None:
+        store = LocalStore(str(tmp_path))
+        now = 1000.0
+        parts = [
+            # the first part was uploaded by an earlier run of the upload, the second twice, by a hedge
+            {"PartNumber": 1, "Bytes": 100, "Seconds": 0, "Finished": now - 500},
+            {"PartNumber": 2, "Bytes": 100, "Seconds": 10.0, "Finished": now - 30},
+            {"PartNumber": 2, "Bytes": 100, "Seconds": 12.0, "Finished": now - 28},
+            {"PartNumber": 3, "Bytes": 100, "Seconds": 10.0, "Finished": now},
+        ]
+        store.put("upload-id/1.json", json.dumps({**UPLOAD, "Parts": parts[:2]}).encode())
+        store.put("upload-id/2.json", json.dumps({**UPLOAD, "Parts": parts[2:]}).encode())
+
+        assert get_progress(store, "upload-id", now=now) == {
+            "Upload": "upload-id",
+            "Key": "file.bin",
+            "TotalSize": 400,
+            "BytesTransferred": 300,
+            "PartsCompleted": 3,
+            "PercentComplete": 75.0,
+            "MBps": 0.0,
+            "ETASeconds": 20,
+        }
+        assert get_progress(store, "upload-id", now=now + 120)["ETASeconds"] is None
+
+        with pytest.raises(ValueError, match="no progress recorded for missing-id"):
+            get_progress(store, "missing-id")
@@ -0,0 +1,107 @@
+from threading import Event, Thread
+
+import pytest
+from requests import ConnectionError
+from urllib3.response import HTTPResponse
+
+from shared import throttle
+from shared.throttle import AdaptiveLimiter, JitteredRetry, ThrottledError
+
+
+class TestThrottle:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    def test_limit_increases_by_one_per_round(self) -> None:
+        limiter = AdaptiveLimiter(10)
+        limiter.limit = 4.0
+
+        for _ in range(4):
+            with limiter.slot(timed=False):
+                pass
+
+        assert limiter.limit == pytest.approx(4.9, abs=0.1)
+        assert limiter.in_flight == 0
+
+        for _ in range(100):
+            with limiter.slot(timed=False):
+                pass
+
+        assert limiter.limit == 10
+
+    @pytest.mark.parametrize("error", [ThrottledError("throttled"), ConnectionError("refused")])
+    def test_limit_halves_once_per_congestion(self, error) -> None:
+        limiter = AdaptiveLimiter(16, min_limit=3)
+        in_flight = [limiter.acquire(timed=False) for _ in range(4)]
+
+        with pytest.raises(type(error)):
+            with limiter.slot():
+                raise error
+
+        for slot in in_flight:
+            slot.congested = True
+            limiter.release(slot)
+
+        assert limiter.limit == 8
+
+        for _ in range(3):
+            with pytest.raises(type(error)):
+                with limiter.slot():
+                    raise error
+
+        assert limiter.limit == 3
+        assert limiter.in_flight == 0
+
+    def test_limit_halves_on_slow_requests(self) -> None:
+        limiter = AdaptiveLimiter(16, latency_factor=3.0)
+        limiter.release(limiter.acquire())
+        limiter.baseline = 1.0
+
+        fast, slow = limiter.acquire(), limiter.acquire()
+        fast.began -= 2.5
+        slow.began -= 3.5
+        limiter.release(fast)
+        assert limiter.limit == 16
+
+        limiter.release(slow)
+        assert limiter.limit == 8
+        assert limiter.baseline == 1.0
+
+    def test_acquire_waits_for_a_free_slot(self) -> None:
+        limiter = AdaptiveLimiter(1)
+        slot = limiter.acquire()
+        acquired = Event()
+        waiter = Thread(target=lambda: (limiter.acquire(), acquired.set()))
+        waiter.start()
+
+        assert not acquired.wait(0.1)
+
+        limiter.release(slot)
+        waiter.join(1)
+
+        assert acquired.is_set()
+        assert limiter.in_flight == 1
+
+    @pytest.mark.parametrize("mocked_env", [{"ORIGIN_CONCURRENCY": "8"}], indirect=True)
+    def test_get_limiter(self, mocked_env) -> None:
+        limiter = throttle.get_limiter("https://download.test/a.zip")
+
+        assert limiter is throttle.get_limiter("https://download.test/b.zip?c=d")
+        assert limiter is not throttle.get_limiter("https://mirror.test/a.zip")
+        assert limiter.limit == 8
+
+    def test_jittered_retry(self) -> None:
+        retry = JitteredRetry(total=5, backoff_factor=1, status_forcelist=(429,), max_retry_after=10)
+        response = HTTPResponse(status=429, headers={"Retry-After": "120"})
+
+        for _ in range(3):
+            retry = retry.increment(method="GET", url="/a.zip", response=response)
+
+        assert isinstance(retry, JitteredRetry)
+        assert retry.max_retry_after == 10
+        assert retry.get_retry_after(response) == 10
+        assert retry.get_retry_after(HTTPResponse(status=429, headers={"Retry-After": "2"})) == 2
+        assert all(0 <= retry.get_backoff_time() <= 4 for _ in range(100))
+        assert len({retry.get_backoff_time() for _ in range(100)}) > 1
@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+from os import getenv
+from random import uniform
+from threading import Condition, Lock
+from time import monotonic
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+
+from requests import RequestException
+from urllib3.util.retry import Retry
+
+THROTTLED_STATUSES = (429, 503)
+DEFAULT_MAX_RETRY_AFTER = 30
+# the ranged requests an uploader container makes at once, its DOWNLOAD_CONCURRENCY times its BATCH_CONCURRENCY, so
+# the first halving already binds
+DEFAULT_ORIGIN_CONCURRENCY = 16
+DEFAULT_LATENCY_FACTOR = 3.0
+
+_lock = Lock()
+_limiters: dict[str, "AdaptiveLimiter"] = {}
+
+
+class ThrottledError(ValueError):
+    """Raised when an origin is still throttling a request after its retries, Step Functions backs off on it."""
+
+
+class JitteredRetry(Retry):
+    """Retries with full jitter, so requests throttled together do not retry together, and honours Retry-After
+    up to ``max_retry_after`` seconds."""
+
+    def __init__(self, *args, max_retry_after: float = DEFAULT_MAX_RETRY_AFTER, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kwargs) -> "JitteredRetry":
+        return super().new(max_retry_after=self.max_retry_after, **kwargs)
+
+    def get_backoff_time(self) -> float:
+        return uniform(0, super().get_backoff_time())
+
+    def get_retry_after(self, response) -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, self.max_retry_after)
+
+
+class Slot:
+    def __init__(self, began: float, timed: bool):
+        self.began = began
+        self.timed = timed
+        self.congested = False
+
+
+class AdaptiveLimiter:
+    """AIMD limit on the concurrent requests to one origin: +1/limit per request completed in time, halved once
+    per round of requests throttled, refused or slower than ``latency_factor`` times the fastest."""
+
+    def __init__(self, max_limit: int, min_limit: int = 1, latency_factor: float = DEFAULT_LATENCY_FACTOR):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_factor = latency_factor
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self._decreased_at = float("-inf")
+        self._cond = Condition()
+
+    def acquire(self, timed: bool = True) -> Slot:
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            return Slot(monotonic(), timed)
+
+    def release(self, slot: Slot) -> None:
+        now = monotonic()
+        latency = now - slot.began if slot.timed and not slot.congested else None
+
+        with self._cond:
+            self.in_flight -= 1
+            congested = slot.congested or (
+                latency is not None and self.baseline is not None and latency > self.latency_factor * self.baseline
+            )
+            if latency is not None:
+                self.baseline = latency if self.baseline is None else min(self.baseline, latency)
+
+            if not congested:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif slot.began >= self._decreased_at:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self._decreased_at = now
+
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timed: bool = True) -> Iterator[Slot]:
+        """Holds one of the origin's request slots, ``timed`` slots also feed their latency to the limit."""
+        slot = self.acquire(timed)
+        try:
+            yield slot
+        except (ThrottledError, RequestException):
+            slot.congested = True
+            raise
+        finally:
+            self.release(slot)
+
+
+def get_origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_limiter(url: str) -> AdaptiveLimiter:
+    origin = get_origin(url)
+    limiter = _limiters.get(origin)
+    if limiter is not None:
+        return limiter
+
+    with _lock:
+        if origin not in _limiters:
+            _limiters[origin] = AdaptiveLimiter(
+                int(getenv("ORIGIN_CONCURRENCY", DEFAULT_ORIGIN_CONCURRENCY)),
+                latency_factor=float(getenv("ORIGIN_LATENCY_FACTOR", DEFAULT_LATENCY_FACTOR)),
+            )
+
+        return _limiters[origin]
+
+
+def reset() -> None:
+    _limiters.clear()
@@ -0,0 +1,149 @@
+from aws_cdk import Duration, Stack
+from aws_cdk import aws_lambda as lambda_
+from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_stepfunctions as sfn
+from aws_cdk import aws_stepfunctions_tasks as tasks
+from constructs import Construct
+
+from stacks.distributed_map import allow_distributed_map, upload_processor
+
+
+class BulkUploader(Construct):
+    """Uploads many urls in one execution, with the parts of every file run by one Distributed Map."""
+
+    max_concurrency = 100
+    manifest_prefix = "manifests/"
+    result_prefix = "results/"
+    input_defaults = {"SingleTaskSize": "auto", "ChecksumAlgorithm": "CRC32"}
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        bucket: s3.Bucket,
+        uploader: lambda_.Function,
+        partitioner_asset: str,
+        copy_sources: list[s3.IBucket],
+    ) -> None:
+        super().__init__(scope, construct_id)
+        partition = Stack.of(self).partition
+
+        planner = lambda_.Function(
+            self,
+            "Planner",
+            code=lambda_.Code.from_asset(partitioner_asset),
+            handler="partitioner.bulk.plan_handler",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            memory_size=512,
+            timeout=Duration.minutes(5),
+        )
+
+        completer = lambda_.Function(
+            self,
+            "Completer",
+            code=lambda_.Code.from_asset(partitioner_asset),
+            handler="partitioner.bulk.complete_handler",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            memory_size=512,
+            # S3 can take several minutes to complete a large object, a timeout would abort finished uploads
+            timeout=Duration.minutes(15),
+            environment={"S3_READ_TIMEOUT": "840"},
+        )
+
+        bucket.grant_read_write(planner)
+        bucket.grant_read_write(completer)
+        for source in copy_sources:
+            source.grant_read(planner)
+
+        upload_success = sfn.Succeed(self, "Bulk Upload Success")
+        upload_failure = sfn.Fail(self, "Bulk Upload Failure")
+
+        set_defaults = sfn.Pass(
+            self,
+            "Set Bulk Input Defaults",
+            result=sfn.Result.from_object(
+                {**self.input_defaults, "Bucket": bucket.bucket_name, "Concurrency": self.max_concurrency}
+            ),
+            result_path="$.Defaults",
+        )
+
+        apply_defaults = sfn.Pass(
+            self,
+            "Apply Bulk Input Defaults",
+            parameters={"Input.$": "States.JsonMerge($.Defaults, $$.Execution.Input, false)"},
+            output_path="$.Input",
+        )
+
+        plan_upload = tasks.LambdaInvoke(
+            self,
+            "Plan Bulk Upload",
+            lambda_function=planner,
+            payload_response_only=True,
+        )
+
+        plan_upload.add_catch(upload_failure, errors=[sfn.Errors.ALL])
+
+        complete_upload = tasks.LambdaInvoke(
+            self,
+            "Complete Bulk Upload",
+            lambda_function=completer,
+            payload=sfn.TaskInput.from_object({"Files.$": "$.Files"}),
+            payload_response_only=True,
+            result_path="$.Result",
+        )
+
+        complete_upload.add_catch(upload_failure, errors=[sfn.Errors.ALL])
+        complete_upload.next(
+            sfn.Choice(self, "Verify Bulk Upload")
+            .when(sfn.Condition.is_present("$.Result.Failed[0]"), upload_failure)
+            .otherwise(upload_success)
+        )
+
+        # one map runs the parts of all files, so MaxConcurrency is the budget for the whole bulk upload
+        dispatch_tasks = sfn.CustomState(
+            self,
+            "Dispatch Bulk Upload Tasks",
+            state_json={
+                "Type": "Map",
+                "MaxConcurrency": self.max_concurrency,
+                # a failed batch fails only the files in it, which the completer finds and reports
+                "ToleratedFailurePercentage": 100,
+                "ItemReader": {
+                    "Resource": f"arn:{partition}:states:::s3:getObject",
+                    "ReaderConfig": {"InputType": "JSON"},
+                    "Parameters": {"Bucket.$": "$.Manifest.Bucket", "Key.$": "$.Manifest.Key"},
+                },
+                "ResultWriter": {
+                    "Resource": f"arn:{partition}:states:::s3:putObject",
+                    "Parameters": {"Bucket": bucket.bucket_name, "Prefix": self.result_prefix},
+                },
+                "ResultPath": "$.UploadResults",
+                "Catch": [
+                    {
+                        "ErrorEquals": ["States.ALL"],
+                        "Next": complete_upload.state_id,
+                        "ResultPath": "$.Errors.DispatchBulkUploadTasks",
+                    }
+                ],
+                "ItemProcessor": upload_processor(partition, uploader),
+            },
+        )
+
+        dispatch_tasks.next(complete_upload)
+
+        self.state_machine = sfn.StateMachine(
+            self,
+            "StateMachine",
+            definition=set_defaults.next(apply_defaults)
+            .next(plan_upload)
+            .next(
+                sfn.Choice(self, "Verify Bulk Plan")
+                .when(sfn.Condition.is_present("$.Error"), upload_failure)
+                .otherwise(dispatch_tasks)
+            ),
+        )
+
+        allow_distributed_map(self, self.state_machine)
+        uploader.grant_invoke(self.state_machine)
+        bucket.grant_read(self.state_machine, f"{self.manifest_prefix}*")
+        bucket.grant_write(self.state_machine, f"{self.result_prefix}*")
@@ -0,0 +1,76 @@
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lambda_
+from aws_cdk import aws_stepfunctions as sfn
+from constructs import Construct
+
+# the Retry of every uploader invocation, of a batch of parts or of a single object
+UPLOAD_RETRY = [
+    {
+        "ErrorEquals": [
+            "Lambda.ServiceException",
+            "Lambda.AWSLambdaException",
+            "Lambda.SdkClientException",
+            "Lambda.TooManyRequestsException",
+        ],
+        "IntervalSeconds": 2,
+        "MaxAttempts": 3,
+        "BackoffRate": 2,
+    },
+    # the origin is still throttling after the uploader's own retries, so back off for longer, with full jitter so
+    # the invocations it throttled together do not come back together
+    {
+        "ErrorEquals": ["ThrottledError"],
+        "IntervalSeconds": 5,
+        "MaxAttempts": 6,
+        "BackoffRate": 2,
+        "MaxDelaySeconds": 120,
+        "JitterStrategy": "FULL",
+    },
+    # the file changed after it was planned, so no retry can succeed
+    {"ErrorEquals": ["SourceChangedError"], "MaxAttempts": 0},
+    {"ErrorEquals": [sfn.Errors.ALL], "MaxAttempts": 3},
+]
+
+
+def upload_processor(partition: str, uploader: lambda_.IFunction) -> dict:
+    """The Distributed Map item processor which hands every batch of upload tasks to the uploader."""
+    return {
+        "ProcessorConfig": {"Mode": "DISTRIBUTED", "ExecutionType": "STANDARD"},
+        "StartAt": "Upload File Part",
+        "States": {
+            "Upload File Part": {
+                "Type": "Task",
+                "Resource": f"arn:{partition}:states:::lambda:invoke",
+                "OutputPath": "$.Payload",
+                "Parameters": {
+                    "Payload.$": "$",
+                    "FunctionName": uploader.function_arn,
+                },
+                "Retry": UPLOAD_RETRY,
+                "End": True,
+            }
+        },
+    }
+
+
+def allow_distributed_map(scope: Construct, state_machine: sfn.StateMachine) -> None:
+    """Allows the state machine to run the child executions of its Distributed Map."""
+    state_machine.role.attach_inline_policy(
+        policy=iam.Policy(
+            scope,
+            "DistributedMap",
+            policy_name="AllowedDistributedMap",
+            statements=[
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["states:StartExecution"],
+                    resources=[state_machine.state_machine_arn],
+                ),
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["states:DescribeExecution", "states:StopExecution"],
+                    resources=[f"{state_machine.state_machine_arn}/*"],
+                ),
+            ],
+        )
+    )
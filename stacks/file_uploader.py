@@ -1,17 +1,31 @@
 from aws_cdk import Duration, Size, Stack
-from aws_cdk import aws_iam as iam
 from aws_cdk import aws_lambda as lambda_
 from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_stepfunctions as sfn
 from aws_cdk import aws_stepfunctions_tasks as tasks
 from constructs import Construct
 
+from stacks.bulk_uploader import BulkUploader
+from stacks.distributed_map import UPLOAD_RETRY, allow_distributed_map, upload_processor
+
 
 class FileUploader(Stack):
     partitioner_asset = "./partitioner/dist/partitioner.zip"
     uploader_asset = "./uploader/dist/uploader.zip"
 
     max_num_tasks = 10000
+    max_concurrency = 100
+    manifest_prefix = "manifests/"
+    # expired before the bucket-wide Glacier transition, which would leave the records unreadable to bin/progress
+    progress_prefix = "progress/"
+    # buckets besides the upload bucket whose objects are copied by S3 instead of downloaded
+    copy_source_buckets: tuple[str, ...] = ()
+    input_defaults = {
+        "SingleTaskSize": "auto",
+        "Resume": False,
+        "ChecksumAlgorithm": "CRC32",
+        "Compression": "identity",
+    }
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -26,7 +40,10 @@ class FileUploader(Stack):
                     transitions=[
                         s3.Transition(storage_class=s3.StorageClass.GLACIER, transition_after=Duration.days(7))
                     ],
-                )
+                ),
+                s3.LifecycleRule(prefix=self.manifest_prefix, expiration=Duration.days(1)),
+                s3.LifecycleRule(prefix=self.progress_prefix, expiration=Duration.days(1)),
+                s3.LifecycleRule(prefix=BulkUploader.result_prefix, expiration=Duration.days(1)),
             ],
         )
 
@@ -34,41 +51,98 @@ class FileUploader(Stack):
             self,
             "Partitioner",
             code=lambda_.Code.from_asset(self.partitioner_asset),
-            handler="index.handler",
+            handler="partitioner.index.handler",
             runtime=lambda_.Runtime.PYTHON_3_9,
             memory_size=512,
             timeout=Duration.seconds(30),
         )
 
+        completer = lambda_.Function(
+            self,
+            "Completer",
+            code=lambda_.Code.from_asset(self.partitioner_asset),
+            handler="partitioner.complete.handler",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            memory_size=512,
+            # S3 can take several minutes to complete a large object, a timeout would abort a finished upload
+            timeout=Duration.minutes(15),
+            environment={"S3_READ_TIMEOUT": "840"},
+        )
+
         uploader = lambda_.Function(
             self,
             "Uploader",
             code=lambda_.Code.from_asset(self.uploader_asset),
-            handler="index.handler",
+            handler="uploader.index.handler",
             runtime=lambda_.Runtime.PYTHON_3_9,
             memory_size=512,
             ephemeral_storage_size=Size.gibibytes(5),
             timeout=Duration.minutes(10),
+            environment={
+                "DOWNLOAD_CONCURRENCY": "4",
+                "BATCH_CONCURRENCY": "4",
+                "HTTP_POOL_SIZE": "16",
+                "PROGRESS_STORE": f"s3://{bucket.bucket_name}/{self.progress_prefix.rstrip('/')}",
+            },
         )
 
+        # besides the manifests, the partitioner creates, and aborts, the multipart uploads of resumable files
+        bucket.grant_put(partitioner)
         bucket.grant_write(uploader)
+        bucket.grant_read_write(completer)
+        copy_sources = [bucket] + [
+            s3.Bucket.from_bucket_name(self, f"CopySource{idx}", name)
+            for idx, name in enumerate(self.copy_source_buckets)
+        ]
+        for source in copy_sources:
+            source.grant_read(partitioner)
+            source.grant_read(uploader)
 
         upload_success = sfn.Succeed(self, "Upload Success")
         upload_failure = sfn.Fail(self, "Upload Failure")
 
+        set_defaults = sfn.Pass(
+            self, "Set Input Defaults", result=sfn.Result.from_object(self.input_defaults), result_path="$.Defaults"
+        )
+
+        apply_defaults = sfn.Pass(
+            self,
+            "Apply Input Defaults",
+            parameters={"Input.$": "States.JsonMerge($.Defaults, $$.Execution.Input, false)"},
+            output_path="$.Input",
+        )
+
         partition_tasks = tasks.LambdaInvoke(
             self,
             "Partition Upload Tasks",
             lambda_function=partitioner,
             payload=sfn.TaskInput.from_object(
-                {"URL.$": "$.URL", "SingleTaskSize.$": "$.SingleTaskSize", "Bucket": bucket.bucket_name}
+                {
+                    "URL.$": "$.URL",
+                    "SingleTaskSize.$": "$.SingleTaskSize",
+                    "Resume.$": "$.Resume",
+                    "ChecksumAlgorithm.$": "$.ChecksumAlgorithm",
+                    "Compression.$": "$.Compression",
+                    "Bucket": bucket.bucket_name,
+                    "Concurrency": self.max_concurrency,
+                }
             ),
             result_selector={
                 "URL.$": "$.Payload.URL",
                 "Bucket.$": "$.Payload.Bucket",
                 "Key.$": "$.Payload.Key",
-                "Tasks.$": "$.Payload.Tasks",
-                "TasksLength.$": "States.ArrayLength($.Payload.Tasks)",
+                "Plan.$": "$.Payload.Plan",
+                "Resume.$": "$.Payload.Resume",
+                "ChecksumAlgorithm.$": "$.Payload.ChecksumAlgorithm",
+                "IfRange.$": "$.Payload.IfRange",
+                "Compression.$": "$.Payload.Compression",
+                "Metadata.$": "$.Payload.Metadata",
+                "Hedge.$": "$.Payload.Hedge",
+                "CopySource.$": "$.Payload.CopySource",
+                "Mode.$": "$.Payload.Mode",
+                "Task.$": "$.Payload.Task",
+                "MultipartUpload.$": "$.Payload.MultipartUpload",
+                "Manifest.$": "$.Payload.Manifest",
             },
         )
 
@@ -80,7 +154,14 @@ class FileUploader(Stack):
             state_json={
                 "Type": "Task",
                 "Resource": f"arn:{self.partition}:states:::aws-sdk:s3:createMultipartUpload",
-                "Parameters": {"Bucket.$": "$.Bucket", "Key.$": "$.Key"},
+                "Parameters": {
+                    "Bucket.$": "$.Bucket",
+                    "Key.$": "$.Key",
+                    "ChecksumAlgorithm.$": "$.ChecksumAlgorithm",
+                    # the name of a compression is also its content coding, null when there is none
+                    "ContentEncoding.$": "$.Compression",
+                    "Metadata.$": "$.Metadata",
+                },
                 "ResultPath": "$.MultipartUpload",
                 "ResultSelector": {"UploadId.$": "$.UploadId"},
             },
@@ -103,118 +184,144 @@ class FileUploader(Stack):
 
         abort_multipart_upload.next(upload_failure)
 
+        # a resumable upload keeps its uploaded parts, so running it again only transfers the missing ones
+        keep_uploaded_parts = (
+            sfn.Choice(self, "Keep Uploaded Parts")
+            .when(sfn.Condition.boolean_equals("$.Resume", True), upload_failure)
+            .otherwise(abort_multipart_upload)
+        )
+
         dispatch_tasks = sfn.CustomState(
             self,
             "Dispatch Upload Tasks",
             state_json={
                 "Type": "Map",
-                "MaxConcurrency": 100,
-                "ItemsPath": "$.Tasks",
-                "ItemSelector": {
-                    "URL.$": "$.URL",
-                    "Bucket.$": "$.Bucket",
-                    "Key.$": "$.Key",
-                    "Task.$": "$$.Map.Item.Value",
-                    "MultipartUploadId.$": "$.MultipartUpload.UploadId",
+                "MaxConcurrency": self.max_concurrency,
+                "ItemReader": {
+                    "Resource": f"arn:{self.partition}:states:::s3:getObject",
+                    "ReaderConfig": {"InputType": "JSON"},
+                    "Parameters": {"Bucket.$": "$.Manifest.Bucket", "Key.$": "$.Manifest.Key"},
+                },
+                "ItemBatcher": {
+                    "MaxItemsPerBatchPath": "$.Plan.BatchSize",
+                    "BatchInput": {
+                        "URL.$": "$.URL",
+                        "Bucket.$": "$.Bucket",
+                        "Key.$": "$.Key",
+                        "MultipartUploadId.$": "$.MultipartUpload.UploadId",
+                        "ChecksumAlgorithm.$": "$.ChecksumAlgorithm",
+                        "IfRange.$": "$.IfRange",
+                        "Compression.$": "$.Compression",
+                        "TotalSize.$": "$.Plan.TotalSize",
+                        "Hedge.$": "$.Hedge",
+                        "CopySource.$": "$.CopySource",
+                    },
                 },
-                "ResultPath": "$.UploadedParts",
+                # the parts of a large file would outgrow the state, so they go to S3, and the upload is completed
+                # from ListParts
+                "ResultWriter": {
+                    "Resource": f"arn:{self.partition}:states:::s3:putObject",
+                    "Parameters": {"Bucket": bucket.bucket_name, "Prefix": BulkUploader.result_prefix},
+                },
+                "ResultPath": "$.UploadResults",
                 "Catch": [
                     {
                         "ErrorEquals": ["States.ALL"],
-                        "Next": abort_multipart_upload.state_id,
+                        "Next": keep_uploaded_parts.state_id,
                         "ResultPath": "$.Errors.DispatchUploadTasks",
                     }
                 ],
-                "ItemProcessor": {
-                    "ProcessorConfig": {"Mode": "DISTRIBUTED", "ExecutionType": "STANDARD"},
-                    "StartAt": "Upload File Part",
-                    "States": {
-                        "Upload File Part": {
-                            "Type": "Task",
-                            "Resource": f"arn:{self.partition}:states:::lambda:invoke",
-                            "OutputPath": "$.Payload",
-                            "Parameters": {
-                                "Payload.$": "$",
-                                "FunctionName": uploader.function_arn,
-                            },
-                            "Retry": [
-                                {
-                                    "ErrorEquals": [
-                                        "Lambda.ServiceException",
-                                        "Lambda.AWSLambdaException",
-                                        "Lambda.SdkClientException",
-                                        "Lambda.TooManyRequestsException",
-                                    ],
-                                    "IntervalSeconds": 2,
-                                    "MaxAttempts": 3,
-                                    "BackoffRate": 2,
-                                },
-                                {"ErrorEquals": [sfn.Errors.ALL], "MaxAttempts": 3},
-                            ],
-                            "End": True,
-                        }
-                    },
-                },
+                "ItemProcessor": upload_processor(self.partition, uploader),
             },
         )
 
-        complete_multipart_upload = sfn.CustomState(
+        complete_multipart_upload = tasks.LambdaInvoke(
             self,
             "Complete Multipart Upload",
+            lambda_function=completer,
+            payload=sfn.TaskInput.from_object(
+                {
+                    "Bucket.$": "$.Bucket",
+                    "Key.$": "$.Key",
+                    "MultipartUploadId.$": "$.MultipartUpload.UploadId",
+                    "TotalSize.$": "$.Plan.TotalSize",
+                    "PartSize.$": "$.Plan.PartSize",
+                    "Compression.$": "$.Compression",
+                }
+            ),
+            payload_response_only=True,
+            result_path="$.CompletedUpload",
+        )
+
+        complete_multipart_upload.add_catch(
+            keep_uploaded_parts, errors=[sfn.Errors.ALL], result_path="$.Errors.CompleteMultipartUpload"
+        )
+
+        # files under the partitioner's SINGLE_UPLOAD_MAX_MIB skip the multipart upload and the Map altogether, the
+        # state is written out as the Retry takes a JitterStrategy, like the Map's
+        upload_object = sfn.CustomState(
+            self,
+            "Upload Single Object",
             state_json={
                 "Type": "Task",
-                "Resource": f"arn:{self.partition}:states:::aws-sdk:s3:completeMultipartUpload",
+                "Resource": uploader.function_arn,
                 "Parameters": {
+                    "URL.$": "$.URL",
                     "Bucket.$": "$.Bucket",
                     "Key.$": "$.Key",
-                    "UploadId.$": "$.MultipartUpload.UploadId",
-                    "MultipartUpload": {"Parts.$": "$.UploadedParts"},
+                    "ChecksumAlgorithm.$": "$.ChecksumAlgorithm",
+                    "IfRange.$": "$.IfRange",
+                    "Compression.$": "$.Compression",
+                    "Metadata.$": "$.Metadata",
+                    "Hedge.$": "$.Hedge",
+                    "CopySource.$": "$.CopySource",
+                    "Task.$": "$.Task",
                 },
+                "ResultPath": "$.UploadedObject",
+                "Retry": UPLOAD_RETRY,
                 "Catch": [
                     {
-                        "ErrorEquals": ["S3.S3Exception"],
-                        "Next": abort_multipart_upload.state_id,
-                        "ResultPath": "$.Errors.CompleteMultipartUpload",
+                        "ErrorEquals": ["States.ALL"],
+                        "Next": upload_failure.state_id,
+                        "ResultPath": "$.Errors.UploadSingleObject",
                     }
                 ],
             },
         )
+        upload_object.next(upload_success)
+
+        initiate_multipart_upload.next(dispatch_tasks)
+        dispatch_tasks.next(complete_multipart_upload).next(upload_success)
 
         state_machine = sfn.StateMachine(
             self,
             "StateMachine",
-            definition=partition_tasks.next(
-                sfn.Choice(self, "Verify The Number Of Tasks")
-                .when(
-                    sfn.Condition.or_(
-                        sfn.Condition.number_greater_than("$.TasksLength", 0),
-                        sfn.Condition.number_less_than_equals("$.TasksLength", self.max_num_tasks),
-                    ),
-                    initiate_multipart_upload.next(dispatch_tasks).next(complete_multipart_upload).next(upload_success),
+            definition=set_defaults.next(apply_defaults)
+            .next(partition_tasks)
+            .next(
+                sfn.Choice(self, "Choose Upload Mode")
+                # the file is already uploaded, and has not changed since
+                .when(sfn.Condition.string_equals("$.Mode", "unchanged"), upload_success)
+                .when(sfn.Condition.string_equals("$.Mode", "single"), upload_object)
+                .otherwise(
+                    sfn.Choice(self, "Verify The Number Of Tasks")
+                    .when(
+                        sfn.Condition.and_(
+                            sfn.Condition.number_greater_than("$.Plan.PartCount", 0),
+                            sfn.Condition.number_less_than_equals("$.Plan.PartCount", self.max_num_tasks),
+                        ),
+                        sfn.Choice(self, "Resume Existing Upload")
+                        .when(sfn.Condition.is_present("$.MultipartUpload.UploadId"), dispatch_tasks)
+                        .otherwise(initiate_multipart_upload),
+                    )
+                    .otherwise(upload_failure)
                 )
-                .otherwise(upload_failure)
             ),
         )
 
-        state_machine.role.attach_inline_policy(
-            policy=iam.Policy(
-                self,
-                "DistributedMap",
-                policy_name="AllowedDistributedMap",
-                statements=[
-                    iam.PolicyStatement(
-                        effect=iam.Effect.ALLOW,
-                        actions=["states:StartExecution"],
-                        resources=[state_machine.state_machine_arn],
-                    ),
-                    iam.PolicyStatement(
-                        effect=iam.Effect.ALLOW,
-                        actions=["states:DescribeExecution", "states:StopExecution"],
-                        resources=[f"{state_machine.state_machine_arn}/*"],
-                    ),
-                ],
-            )
-        )
-
+        allow_distributed_map(self, state_machine)
         uploader.grant_invoke(state_machine)
+        bucket.grant_read(state_machine, f"{self.manifest_prefix}*")
         bucket.grant_write(state_machine)
+
+        BulkUploader(self, "BulkUploader", bucket, uploader, self.partitioner_asset, copy_sources)
@@ -0,0 +1,81 @@
+from os import getenv
+from threading import Condition, Lock
+from typing import BinaryIO, Optional
+
+from shared.constants import MiB
+
+DEFAULT_MEMORY_SIZE = 512
+DEFAULT_MEMORY_FRACTION = 0.5
+
+_lock = Lock()
+_pools: dict[int, "BufferPool"] = {}
+
+
+class BufferPool:
+    """At most ``count`` reusable buffers of ``size`` bytes, allocated on first use.
+
+    Only block in ``acquire`` while holding no other buffer, so no two callers wait on each other.
+    """
+
+    def __init__(self, size: int, count: int) -> None:
+        self.size = size
+        self.count = count
+        self.allocated = 0
+        self._free: list[bytearray] = []
+        self._cond = Condition()
+
+    @property
+    def available(self) -> int:
+        return len(self._free) + self.count - self.allocated
+
+    def acquire(self, block: bool = True) -> Optional[bytearray]:
+        with self._cond:
+            if not block and not self.available:
+                return None
+
+            self._cond.wait_for(lambda: self.available)
+            if self._free:
+                return self._free.pop()
+
+            self.allocated += 1
+            return bytearray(self.size)
+
+    def release(self, buffer: bytearray) -> None:
+        with self._cond:
+            self._free.append(buffer)
+            self._cond.notify()
+
+
+def get_memory_budget() -> int:
+    """Bytes of part buffers, ``BUFFER_POOL_MIB`` or else a share of the memory configured for the Lambda."""
+    budget = getenv("BUFFER_POOL_MIB")
+    if budget is not None:
+        return int(budget) * MiB
+
+    memory_size = int(getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", DEFAULT_MEMORY_SIZE))
+    return int(memory_size * MiB * float(getenv("BUFFER_POOL_FRACTION", DEFAULT_MEMORY_FRACTION)))
+
+
+def get_buffer_pool(size: int) -> BufferPool:
+    pool = _pools.get(size)
+    if pool is not None:
+        return pool
+
+    with _lock:
+        if size not in _pools:
+            _pools[size] = BufferPool(size, max(1, get_memory_budget() // size))
+
+        return _pools[size]
+
+
+def readinto(raw: BinaryIO, view: memoryview) -> int:
+    """Reads from a urllib3 response straight into ``view``, as urllib3 1.x reads into a copy first."""
+    fp = getattr(raw, "_fp", None)
+    if fp is None or getattr(raw, "decode_content", False):
+        return raw.readinto(view)
+
+    return fp.readinto(view) or 0
+
+
+def reset() -> None:
+    _pools.clear()
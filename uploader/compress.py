@@ -0,0 +1,77 @@
+import zlib
+from os import getenv
+from tempfile import SpooledTemporaryFile, TemporaryFile
+from typing import BinaryIO
+
+from shared import metrics
+from shared.constants import COMPRESSIONS, MiB
+from shared.metrics import Unit
+
+from .staging import get_staging_dir
+
+DEFAULT_LEVEL = 1
+# the spool is not part of the buffer pool's budget, so past this a compressed part goes to the staging directory
+DEFAULT_SPOOL_SIZE = 1
+# header with FCOMMENT, NUL ending the comment, an empty final stored block, then CRC32 and ISIZE of no data
+PAD_MEMBER_SIZE = 10 + 1 + 2 + 8
+
+
+def validate_compression(compression: str) -> None:
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"compression {compression} is not one of {', '.join(COMPRESSIONS)}")
+
+
+def pad_member(size: int) -> bytes:
+    """An empty gzip member of exactly ``size`` bytes, the padding is its comment.
+
+    A gzip file may hold any number of members, and decoders concatenate their data, so appending this to a
+    compressed part lengthens it without changing what the object decompresses to.
+    """
+    if size < PAD_MEMBER_SIZE:
+        raise ValueError(f"a gzip member takes at least {PAD_MEMBER_SIZE} bytes, not {size}")
+
+    return b"\x1f\x8b\x08\x10\0\0\0\0\0\xff" + b" " * (size - PAD_MEMBER_SIZE) + b"\0\x03\0" + b"\0" * 8
+
+
+def compress(src: BinaryIO, dst: BinaryIO, level: int, chunk_size: int = MiB) -> int:
+    """Writes ``src`` to ``dst`` as one gzip member, returning the compressed size."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    size = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+
+        size += dst.write(compressor.compress(chunk))
+
+    return size + dst.write(compressor.flush())
+
+
+def compress_part(src: BinaryIO, compression: str, on_disk: bool, min_size: int = 0) -> BinaryIO:
+    """Compresses a part into a temporary file, rewound for upload.
+
+    A part may decompress on its own, as it is a whole gzip member. Every part of a multipart upload but the last
+    must be at least 5 MiB, so a part which compresses below ``min_size`` is padded with an empty member.
+    Disk mode compresses to ``STAGING_DIR``, stream mode keeps up to ``COMPRESSION_SPOOL_MIB`` of it in memory
+    before it spills there too.
+    """
+    validate_compression(compression)
+    level = int(getenv("COMPRESSION_LEVEL", DEFAULT_LEVEL))
+    spool_size = int(getenv("COMPRESSION_SPOOL_MIB", DEFAULT_SPOOL_SIZE)) * MiB
+    directory = get_staging_dir()
+    dst = TemporaryFile(dir=directory) if on_disk else SpooledTemporaryFile(spool_size, dir=directory)
+
+    try:
+        with metrics.timed("CompressSeconds"):
+            size = compress(src, dst, level)
+
+        if size < min_size:
+            size += dst.write(pad_member(max(min_size - size, PAD_MEMBER_SIZE)))
+            metrics.add("PaddedParts", 1)
+    except BaseException:
+        dst.close()
+        raise
+
+    metrics.add("CompressedBytes", size, Unit.BYTES)
+    dst.seek(0)
+    return dst
@@ -0,0 +1,146 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from math import ceil
+from os import getenv
+from threading import Event, Lock
+from time import perf_counter
+from typing import Callable, Iterator, Optional, TypeVar
+
+from shared import metrics
+
+HISTORY_SIZE = 256
+MIN_SAMPLES = 5
+DEFAULT_STOP_SECONDS = 5.0
+
+T = TypeVar("T")
+
+_lock = Lock()
+_part_times: Optional["PartTimes"] = None
+
+
+class PartTimes:
+    """Seconds taken by the most recent parts completed in this container."""
+
+    def __init__(self, size: int = HISTORY_SIZE) -> None:
+        self._times: deque[float] = deque(maxlen=size)
+        self._lock = Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._times.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """The nearest-rank percentile, or None until enough parts have completed for it to mean anything."""
+        with self._lock:
+            times = sorted(self._times)
+
+        if len(times) < MIN_SAMPLES:
+            return None
+
+        return times[max(ceil(percentile / 100 * len(times)), 1) - 1]
+
+
+class Cancellation(Event):
+    """Event which, once set, runs the callbacks registered with ``on_cancel``, such as shutting the socket a
+    cancelled attempt is blocked on."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._callbacks: list[Callable[[], None]] = []
+        self._callbacks_lock = Lock()
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Iterator[None]:
+        """Runs ``callback`` if the event is set before the block exits, or at once if it already is."""
+        with self._callbacks_lock:
+            if self.is_set():
+                callback()
+            else:
+                self._callbacks.append(callback)
+
+        try:
+            yield
+        finally:
+            # the callback must not run once what it closes may be in use again
+            with self._callbacks_lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+    def set(self) -> None:
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback()
+
+
+def get_part_times() -> PartTimes:
+    global _part_times
+    with _lock:
+        if _part_times is None:
+            _part_times = PartTimes()
+
+        return _part_times
+
+
+def get_hedge_delay(hedge: Optional[dict]) -> Optional[float]:
+    """Seconds after which a part still running gets a second attempt, or None when hedging is off."""
+    if not hedge:
+        return None
+
+    observed = get_part_times().percentile(hedge["Percentile"])
+    return max(hedge.get("MinSeconds", 0), observed or 0)
+
+
+def run_hedged(attempt: Callable[[Cancellation], T], delay: Optional[float]) -> T:
+    """Runs ``attempt``, and a second one alongside it once the first has taken ``delay`` seconds.
+
+    The result of whichever succeeds first is returned, and the other is asked to stop by setting the event it
+    was given. Both upload the same bytes to the same part, so one finishing after the other changes nothing.
+    The other attempt is given up to ``HEDGE_STOP_SECONDS`` to stop before this returns.
+    """
+    began = perf_counter()
+    if delay is None:
+        result = attempt(Cancellation())
+        get_part_times().add(perf_counter() - began)
+        return result
+
+    events = [Cancellation(), Cancellation()]
+    executor = ThreadPoolExecutor(2)
+    futures = []
+    try:
+        futures.append(executor.submit(attempt, events[0]))
+        if not wait(futures, timeout=delay).done:
+            metrics.add("HedgedParts", 1)
+            futures.append(executor.submit(attempt, events[1]))
+
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+
+                if future is not futures[0]:
+                    metrics.add("HedgeWins", 1)
+                get_part_times().add(perf_counter() - began)
+                return future.result()
+
+        raise error
+    finally:
+        for event in events:
+            event.set()
+
+        # the losing attempt stops at its next read, or as soon as its socket is shut. On Lambda one still running
+        # once the handler returns carries on into the next invocation, with its slot, buffers and metrics
+        if wait(futures, timeout=float(getenv("HEDGE_STOP_SECONDS", DEFAULT_STOP_SECONDS))).not_done:
+            metrics.add("HedgeStragglers", 1)
+
+        executor.shutdown(wait=False)
+
+
+def reset() -> None:
+    global _part_times
+    _part_times = None
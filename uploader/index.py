@@ -1,15 +1,41 @@
 import logging
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from http import HTTPStatus
-from os import getenv
-from os.path import basename, join
-from shutil import copyfileobj
+from io import BytesIO, RawIOBase
+from math import ceil
+from os import getenv, pwrite
+from shutil import disk_usage
+from socket import SHUT_RDWR
 from sys import stdout
-from tempfile import gettempdir
-from typing import Optional, Union
+from time import perf_counter
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple, TypeVar, Union
 
-from boto3 import resource
 from loguru import logger
-from requests import get
+from requests import Response, Session, get
+
+from shared import metrics, progress
+from shared.connection import get_http_session, get_http_timeout, get_s3_client
+from shared.constants import CHECKSUM_FIELDS, MIN_PART_SIZE
+from shared.metrics import Unit
+from shared.throttle import THROTTLED_STATUSES, ThrottledError, get_limiter
+
+from .buffers import get_buffer_pool, readinto
+from .compress import compress_part
+from .hedge import Cancellation, get_hedge_delay, run_hedged
+from .staging import get_staging_dir, staged_file
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+
+T = TypeVar("T")
+
+
+class TransferMode:
+    STREAM = "stream"
+    DISK = "disk"
 
 
 class Logger:
@@ -26,45 +52,719 @@ class Logger:
         Logger.is_initialized = True
 
 
-def download_file(url: str, start: int, end: int) -> str:
+class SourceChangedError(ValueError):
+    """Raised when the file at the url no longer matches the validator it was planned with."""
+
+
+class RangeStream(RawIOBase):
+    """Read-only view of a ranged response body which never reads past the expected length."""
+
+    def __init__(self, raw: BinaryIO, length: int) -> None:
+        super().__init__()
+        self.length = length
+        self._raw = raw
+        self._remaining = length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._remaining <= 0:
+            return 0
+
+        with memoryview(b) as view:
+            n = readinto(self._raw, view[: self._remaining])
+
+        if n == 0:
+            raise ValueError(f"download incomplete, received {self.length - self._remaining} of {self.length} bytes")
+
+        self._remaining -= n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+
+        # botocore sends a trailing checksum body in chunks of what every read returns, so reads are filled
+        pieces = []
+        while size > 0 and self._remaining > 0:
+            data = self._raw.read(min(size, self._remaining))
+            if not data:
+                raise ValueError(
+                    f"download incomplete, received {self.length - self._remaining} of {self.length} bytes"
+                )
+
+            pieces.append(data)
+            self._remaining -= len(data)
+            size -= len(data)
+
+        return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+
+class PartBody(RawIOBase):
+    """Part stream whose ``len`` is the part size, which is all botocore needs to send it unseekable.
+
+    Reads go straight to the range stream, so a part holds no buffer besides the pooled ones of a parallel stream.
+    The time botocore spends blocked on the origin while reading the part is kept in ``wait_seconds``. Once
+    ``cancelled`` is set, reading fails, which aborts the request sending the part.
+    """
+
+    wait_seconds = 0.0
+    cancelled: Optional[Cancellation] = None
+
+    def __init__(self, raw: Union[RangeStream, "ParallelRangeStream"]) -> None:
+        super().__init__()
+        self.raw = raw
+
+    def __len__(self) -> int:
+        return self.raw.length
+
+    def readable(self) -> bool:
+        return True
+
+    def _timed(self, read: Callable[[], T]) -> T:
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise CancelledError("the part was sent by another attempt")
+
+        began = perf_counter()
+        try:
+            return read()
+        finally:
+            self.wait_seconds += perf_counter() - began
+
+    def read(self, size: int = -1) -> bytes:
+        return self._timed(partial(self.raw.read, size))
+
+    def readinto(self, b) -> int:
+        return self._timed(partial(self.raw.readinto, b))
+
+    def close(self) -> None:
+        if not self.closed:
+            self.raw.close()
+
+        super().close()
+
+
+class ParallelRangeStream(RawIOBase):
+    """Fetches a range as consecutive sub-ranges on a thread pool and serves them back in order.
+
+    Every sub-range of ``chunk_size`` bytes is read into a buffer of the shared pool, so at most ``concurrency``
+    of them, and never more than the pool allows, are held in memory at any time.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        start: int,
+        end: int,
+        chunk_size: int,
+        concurrency: int,
+        session: Optional[Session] = None,
+        if_range: Optional[str] = None,
+        cancelled: Optional[Cancellation] = None,
+    ) -> None:
+        super().__init__()
+        self._url = url
+        self._session = session
+        self._if_range = if_range
+        self._cancelled = cancelled
+        self._start = start
+        self._concurrency = concurrency
+        self._pool = get_buffer_pool(chunk_size)
+        self._ranges = iter(split_range(start, end, chunk_size))
+        self._executor = ThreadPoolExecutor(concurrency)
+        self._pending: deque[Tuple[bytearray, Future]] = deque()
+        self._buffer: Optional[bytearray] = None
+        self._chunk = memoryview(b"")
+
+        try:
+            self._prefetch()
+            total = self._pending[0][1].result()[1]
+        except Exception:
+            self.close()
+            raise
+
+        self.length = (end if total is None else min(end, total - 1)) - start + 1
+
+    def _prefetch(self) -> None:
+        # only wait for a buffer while holding none, so streams sharing the pool never wait on each other
+        while len(self._pending) < self._concurrency:
+            buffer = self._pool.acquire(block=not self._pending and self._buffer is None)
+            next_range = None if buffer is None else next(self._ranges, None)
+            if next_range is None:
+                if buffer is not None:
+                    self._pool.release(buffer)
+                return
+
+            s, e = next_range
+            future = self._executor.submit(
+                fetch_range_into,
+                memoryview(buffer),
+                self._url,
+                s,
+                e,
+                s != self._start,
+                self._session,
+                self._if_range,
+                self._cancelled,
+            )
+            self._pending.append((buffer, future))
+
+    def _release_buffer(self) -> None:
+        self._chunk = memoryview(b"")
+        if self._buffer is not None:
+            self._pool.release(self._buffer)
+            self._buffer = None
+
+    def _next_chunk(self) -> bool:
+        """Moves on to the next sub-range once the current one is served, returning False once all of them are."""
+        while not self._chunk:
+            self._release_buffer()
+            self._prefetch()
+            if not self._pending:
+                return False
+
+            buffer, future = self._pending.popleft()
+            self._buffer = buffer
+            self._chunk = memoryview(buffer)[: future.result()[0]]
+            self._prefetch()
+
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._next_chunk():
+            return 0
+
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+
+        # served from the pooled buffers, the bytes are only copied again where a read spans two of them
+        pieces = []
+        while size > 0 and self._next_chunk():
+            pieces.append(bytes(self._chunk[:size]))
+            self._chunk = self._chunk[len(pieces[-1]) :]
+            size -= len(pieces[-1])
+
+        return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._release_buffer()
+        # a sub-range still being fetched writes into its buffer, which is only reusable once it is done
+        for buffer, future in self._pending:
+            future.add_done_callback(lambda _, buffer=buffer: self._pool.release(buffer))
+
+        self._pending.clear()
+        super().close()
+
+
+def validate_range(start: int, end: int) -> None:
     if start > end:
         raise ValueError(f"range start value {start} is not less then end value {end}")
 
-    file_name = join(gettempdir(), basename(url))
 
-    with get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True) as r:
-        if r.status_code != HTTPStatus.PARTIAL_CONTENT:
-            raise ValueError(f"download failed, received status code {r.status_code}")
+def split_range(start: int, end: int, size: int) -> list[(int, int)]:
+    return [(s, min(s + size - 1, end)) for s in range(start, end + 1, size)]
+
+
+def parse_content_range(content_range: str) -> Tuple[int, int, Optional[int]]:
+    byte_range, total = content_range.replace("bytes ", "", 1).split("/")
+    first, last = byte_range.split("-")
+    return int(first), int(last), None if total == "*" else int(total)
+
+
+def get_expected_length(headers, start: int, end: int) -> int:
+    """Length of a partial response body, after checking that it is the range which was requested."""
+    content_range = headers.get("Content-Range")
+    if content_range is not None:
+        first, last, total = parse_content_range(content_range)
+        if first != start or last != (end if total is None else min(end, total - 1)):
+            raise ValueError(f"received range {content_range} does not match requested range {start}-{end}")
+
+        return last - first + 1
+
+    size = headers.get("Content-Length")
+    if size is not None and int(size) > end - start + 1:
+        raise ValueError(f"received {size} bytes for requested range {start}-{end}")
+
+    return int(size) if size is not None else end - start + 1
+
+
+def get_total_size(headers) -> Optional[int]:
+    content_range = headers.get("Content-Range")
+    return None if content_range is None else parse_content_range(content_range)[2]
+
+
+def is_unsatisfiable(status_code: int, allow_unsatisfiable: bool) -> bool:
+    # a trailing sub-range may start past the end of file, which simply contributes no bytes
+    if allow_unsatisfiable and status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+        return True
+
+    if status_code in THROTTLED_STATUSES:
+        raise ThrottledError(f"download failed, received status code {status_code}")
+
+    if status_code != HTTPStatus.PARTIAL_CONTENT:
+        raise ValueError(f"download failed, received status code {status_code}")
+
+    return False
+
+
+def record_response(r: Response) -> None:
+    metrics.observe("TimeToFirstByte", r.elapsed.total_seconds() * 1000, Unit.MILLISECONDS)
+    retries = getattr(r.raw, "retries", None)
+    if retries is not None and retries.history:
+        metrics.add("Retries", len(retries.history))
+
+    if r.status_code in THROTTLED_STATUSES:
+        metrics.add("Throttled", 1)
+
+
+def get_range(
+    url: str, start: int, end: int, session: Optional[Session] = None, if_range: Optional[str] = None, **kwargs
+) -> Response:
+    headers = {"Range": f"bytes={start}-{end}"}
+    if if_range is not None:
+        headers["If-Range"] = if_range
+
+    kwargs.setdefault("timeout", get_http_timeout())
+    return (get if session is None else session.get)(url, headers=headers, **kwargs)
+
+
+def shutdown(r: Response) -> None:
+    """Shuts the socket of a streamed response, so a read blocked on a stalled origin fails at once."""
+    sock = getattr(getattr(r.raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
 
-        with open(file_name, "wb") as f:
-            copyfileobj(r.raw, f)
 
-    return file_name
+@contextmanager
+def request_range(
+    url: str,
+    start: int,
+    end: int,
+    session: Optional[Session] = None,
+    stream: bool = False,
+    if_range: Optional[str] = None,
+    timed: Optional[bool] = None,
+    cancelled: Optional[Cancellation] = None,
+) -> Iterator[Response]:
+    """Ranged GET which holds one of its origin's request slots until the response is consumed.
 
+    With ``if_range`` the origin sends the whole file instead of the range once the file has changed, so parts
+    of two versions of a file never end up in one upload. Setting ``cancelled`` shuts its socket.
+    """
+    slot = get_limiter(url).slot(timed=not stream if timed is None else timed)
+    with slot, get_range(url, start, end, session, if_range, stream=stream) as r, (
+        cancelled or Cancellation()
+    ).on_cancel(partial(shutdown, r)):
+        record_response(r)
+        if if_range is not None and r.status_code == HTTPStatus.OK:
+            raise SourceChangedError(f"{url} has changed since it was planned, it no longer matches {if_range}")
 
-def get_completed_part(etag: str, part_num: int) -> dict:
-    return {"ETag": etag, "PartNumber": part_num}
+        yield r
+
+
+def fetch_range_into(
+    view: memoryview,
+    url: str,
+    start: int,
+    end: int,
+    allow_unsatisfiable: bool = False,
+    session: Optional[Session] = None,
+    if_range: Optional[str] = None,
+    cancelled: Optional[Cancellation] = None,
+) -> Tuple[int, Optional[int]]:
+    """Reads the range into ``view``, returning the number of bytes and the total size of the file."""
+    # the body is read in full before the slot is released, so its latency still feeds the limit
+    with request_range(url, start, end, session, True, if_range, True, cancelled) as r:
+        if is_unsatisfiable(r.status_code, allow_unsatisfiable):
+            return 0, None
+
+        length = get_expected_length(r.headers, start, end)
+        body, received = RangeStream(r.raw, length), 0
+        while received < length:
+            received += body.readinto(view[received:length])
+
+        extra = len(r.raw.read())
+        if extra:
+            raise ValueError(f"download failed, received {length + extra} bytes, expected {length}")
+
+        return length, get_total_size(r.headers)
+
+
+def download_range_to(
+    fd: int,
+    offset: int,
+    url: str,
+    start: int,
+    end: int,
+    session: Optional[Session] = None,
+    if_range: Optional[str] = None,
+    cancelled: Optional[Cancellation] = None,
+) -> int:
+    """Writes the range into the file at its position relative to ``offset``, returning where its data ends."""
+    with request_range(url, start, end, session, stream=True, if_range=if_range, cancelled=cancelled) as r:
+        if is_unsatisfiable(r.status_code, start != offset):
+            return 0
+
+        body = RangeStream(r.raw, get_expected_length(r.headers, start, end))
+        # the file takes the bytes as fast as they arrive, so a small buffer is as fast as a part sized one
+        pool = get_buffer_pool(COPY_BUFFER_SIZE)
+        buffer = pool.acquire()
+        position = start - offset
+        try:
+            with memoryview(buffer) as view:
+                for n in iter(lambda: body.readinto(view), 0):
+                    # sub-ranges share the file descriptor, pwrite leaves its offset alone
+                    written = 0
+                    while written < n:
+                        written += pwrite(fd, view[written:n], position + written)
+
+                    position += n
+        finally:
+            pool.release(buffer)
+
+        return position
+
+
+@contextmanager
+def open_range(
+    url: str,
+    start: int,
+    end: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    concurrency: int = 1,
+    session: Optional[Session] = None,
+    if_range: Optional[str] = None,
+    cancelled: Optional[Cancellation] = None,
+) -> Iterator[PartBody]:
+    validate_range(start, end)
+
+    if concurrency > 1:
+        stream = ParallelRangeStream(url, start, end, chunk_size, concurrency, session, if_range, cancelled)
+        with PartBody(stream) as body:
+            yield body
+
+        return
+
+    with request_range(url, start, end, session, stream=True, if_range=if_range, cancelled=cancelled) as r:
+        is_unsatisfiable(r.status_code, False)
+
+        yield PartBody(RangeStream(r.raw, get_expected_length(r.headers, start, end)))
+
+
+@contextmanager
+def download_file(
+    url: str,
+    start: int,
+    end: int,
+    concurrency: int = 1,
+    session: Optional[Session] = None,
+    if_range: Optional[str] = None,
+    cancelled: Optional[Cancellation] = None,
+) -> Iterator[BinaryIO]:
+    """Stages the range in a file of its own, which is removed once the block exits."""
+    validate_range(start, end)
+
+    with staged_file(end - start + 1) as f:
+        ranges = split_range(start, end, ceil((end - start + 1) / concurrency))
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = [
+                executor.submit(download_range_to, f.fileno(), start, url, s, e, session, if_range, cancelled)
+                for s, e in ranges
+            ]
+            size = max(future.result() for future in futures)
+
+        # a range past the end of the file is shorter than the space allocated for it
+        f.truncate(size)
+        yield f
+
+
+def get_completed_part(etag: str, part_num: int, checksums: Optional[dict] = None) -> dict:
+    return {"ETag": etag, "PartNumber": part_num, **(checksums or {})}
+
+
+def get_checksums(part: dict) -> dict:
+    return {field: part[field] for field in CHECKSUM_FIELDS if part.get(field) is not None}
+
+
+def send_body(
+    send: Callable[..., dict],
+    body: BinaryIO,
+    size: Optional[int],
+    checksum: dict,
+    compression: Optional[str],
+    on_disk: bool,
+    min_size: int,
+) -> dict:
+    if compression is None:
+        return send(Body=body, **({} if size is None else {"ContentLength": size}), **checksum)
+
+    # botocore takes the length of the compressed body from seek and tell
+    with compress_part(body, compression, on_disk, min_size) as compressed:
+        return send(Body=compressed, **checksum)
+
+
+def send_range(
+    send: Callable[..., dict],
+    session: Session,
+    mode: str,
+    url: str,
+    start: int,
+    end: int,
+    algorithm: Optional[str],
+    if_range: Optional[str] = None,
+    compression: Optional[str] = None,
+    min_size: int = 0,
+    cancelled: Optional[Cancellation] = None,
+) -> dict:
+    """Downloads the range and hands it to ``send`` as the ``Body`` of an UploadPart or PutObject request.
+
+    With a ``compression``, the range is sent as a compressed member of at least ``min_size`` bytes instead.
+    Setting ``cancelled`` stops the transfer, as far as it can still be stopped.
+    """
+    # botocore computes the checksum while sending the body and S3 verifies it on receipt
+    checksum = {"ChecksumAlgorithm": algorithm} if algorithm else {}
+    concurrency = int(getenv("DOWNLOAD_CONCURRENCY", 1))
+    on_disk = mode == TransferMode.DISK
+
+    began = perf_counter()
+    if end < start:
+        # an empty file has no range to download
+        resp = send_body(send, BytesIO(b""), None, checksum, compression, on_disk, min_size)
+    elif on_disk:
+        with download_file(url, start, end, concurrency, session, if_range, cancelled) as f:
+            metrics.add("DownloadSeconds", perf_counter() - began, Unit.SECONDS)
+            if cancelled is not None and cancelled.is_set():
+                raise CancelledError("the part was sent by another attempt")
+
+            metrics.maximum("TmpBytesUsed", disk_usage(get_staging_dir()).used, Unit.BYTES)
+            resp = send_body(send, f, None, checksum, compression, on_disk, min_size)
+    else:
+        chunk_size = int(getenv("STREAM_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+        with open_range(url, start, end, chunk_size, concurrency, session, if_range, cancelled) as body:
+            first_byte = perf_counter() - began
+            body.cancelled = cancelled
+            # a body with a trailing checksum is sent chunked, its decoded length is taken from len(body)
+            size = None if algorithm else len(body)
+            resp = send_body(send, body, size, checksum, compression, on_disk, min_size)
+
+        metrics.add("DownloadSeconds", first_byte + body.wait_seconds, Unit.SECONDS)
+
+    metrics.add("PartSeconds", perf_counter() - began, Unit.SECONDS)
+    metrics.add("BytesTransferred", max(end - start + 1, 0), Unit.BYTES)
+    return resp
+
+
+@contextmanager
+def copying(file: dict) -> Iterator[None]:
+    """Times a copy, and raises its failed ``CopySourceIfMatch`` as ``SourceChangedError``, which is not retried."""
+    from botocore.exceptions import ClientError
+
+    try:
+        with metrics.timed("CopySeconds"):
+            yield
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "PreconditionFailed":
+            raise
+
+        source = file["CopySource"]
+        raise SourceChangedError(
+            f"s3://{source['Bucket']}/{source['Key']} has changed since it was planned, it no longer matches "
+            f"{file.get('IfRange')}"
+        ) from e
+
+
+def get_copy_args(file: dict) -> dict:
+    if_match = {"CopySourceIfMatch": file["IfRange"]} if file.get("IfRange") else {}
+    return {"CopySource": file["CopySource"], **if_match}
+
+
+def copy_part(file: dict, task: dict) -> dict:
+    """Has S3 copy the range of the task from ``CopySource``, so none of its bytes pass through the function."""
+    start, end = task.get("start"), task.get("end")
+    with copying(file):
+        resp = get_s3_client().upload_part_copy(
+            Bucket=file.get("Bucket"),
+            Key=file.get("Key"),
+            UploadId=file.get("MultipartUploadId"),
+            PartNumber=task.get("index"),
+            CopySourceRange=f"bytes={start}-{end}",
+            **get_copy_args(file),
+        )
+
+    metrics.add("CopiedBytes", end - start + 1, Unit.BYTES)
+    result = resp["CopyPartResult"]
+    return get_completed_part(result["ETag"], task.get("index"), get_checksums(result))
+
+
+def copy_object(file: dict, task: dict) -> dict:
+    args = {"ChecksumAlgorithm": file["ChecksumAlgorithm"]} if file.get("ChecksumAlgorithm") else {}
+    if file.get("Metadata"):
+        # the metadata of the source is copied along, unless it is replaced
+        args.update(Metadata=file["Metadata"], MetadataDirective="REPLACE")
+
+    with copying(file):
+        resp = get_s3_client().copy_object(
+            Bucket=file.get("Bucket"), Key=file.get("Key"), **get_copy_args(file), **args
+        )
+
+    metrics.add("CopiedBytes", task.get("end") - task.get("start") + 1, Unit.BYTES)
+    result = resp["CopyObjectResult"]
+    return {"ETag": result["ETag"], **get_checksums(result)}
+
+
+def get_min_part_size(batch_input: dict, task: dict) -> int:
+    """Every compressed part but the last is padded to the minimum part size, a part is taken as the last one
+    when it reaches the end of the file, or padded in case the ``TotalSize`` is unknown."""
+    total = batch_input.get("TotalSize")
+    return 0 if total is not None and task.get("end") >= total - 1 else MIN_PART_SIZE
+
+
+def upload_part(
+    s3, session: Session, mode: str, batch_input: dict, task: dict, cancelled: Optional[Cancellation] = None
+) -> dict:
+    task_num = task.get("index")
+    if task.get("ETag") is not None:
+        # already uploaded by an earlier run of a resumed upload
+        return get_completed_part(task.get("ETag"), task_num, get_checksums(task))
+
+    if batch_input.get("CopySource"):
+        return copy_part(batch_input, task)
+
+    part_args = {
+        "Bucket": batch_input.get("Bucket"),
+        "Key": batch_input.get("Key"),
+        "UploadId": batch_input.get("MultipartUploadId"),
+        "PartNumber": task_num,
+    }
+    resp = send_range(
+        partial(s3.upload_part, **part_args),
+        session,
+        mode,
+        batch_input.get("URL"),
+        task.get("start"),
+        task.get("end"),
+        batch_input.get("ChecksumAlgorithm"),
+        batch_input.get("IfRange"),
+        batch_input.get("Compression"),
+        get_min_part_size(batch_input, task),
+        cancelled,
+    )
+    logger.debug(resp)
+
+    return get_completed_part(resp.get("ETag"), task_num, get_checksums(resp))
+
+
+def upload_object(
+    s3, session: Session, mode: str, file: dict, task: dict, cancelled: Optional[Cancellation] = None
+) -> dict:
+    """Uploads a file small enough for a single PutObject, skipping the multipart upload altogether."""
+    if file.get("CopySource"):
+        return copy_object(file, task)
+
+    metadata = {"Metadata": file["Metadata"]} if file.get("Metadata") else {}
+    if file.get("Compression"):
+        metadata["ContentEncoding"] = file["Compression"]
+
+    resp = send_range(
+        partial(s3.put_object, Bucket=file.get("Bucket"), Key=file.get("Key"), **metadata),
+        session,
+        mode,
+        file.get("URL"),
+        task.get("start"),
+        task.get("end"),
+        file.get("ChecksumAlgorithm"),
+        file.get("IfRange"),
+        file.get("Compression"),
+        cancelled=cancelled,
+    )
+    logger.debug(resp)
+
+    return {"ETag": resp.get("ETag"), **get_checksums(resp)}
+
+
+def record_progress(file: dict, task: dict, seconds: float) -> None:
+    size = max(task.get("end") - task.get("start") + 1, 0)
+    upload = {
+        "Upload": file.get("MultipartUploadId") or file.get("Key"),
+        "Bucket": file.get("Bucket"),
+        "Key": file.get("Key"),
+        # a single upload is the whole file
+        "TotalSize": file.get("TotalSize", size if file.get("MultipartUploadId") is None else None),
+    }
+    progress.record(upload, task.get("index", 1), size, seconds)
+
+
+def upload_task(s3, session: Session, mode: str, batch_input: dict, task: dict) -> dict:
+    # a task of a bulk upload carries its own file, as one batch may hold tasks of several files
+    file = {**batch_input, **task}
+    upload = upload_object if file.get("MultipartUploadId") is None else upload_part
+    if task.get("ETag") is not None:
+        # already uploaded, there is no transfer to hedge
+        record_progress(file, task, 0)
+        return upload(s3, session, mode, file, task)
+
+    began = perf_counter()
+    if file.get("CopySource"):
+        # S3 copies the part itself, there is no origin to straggle
+        result = upload(s3, session, mode, file, task)
+    else:
+        # a part still running once it is slower than most gets a second attempt, and the first one to finish wins
+        result = run_hedged(partial(upload, s3, session, mode, file, task), get_hedge_delay(file.get("Hedge")))
+    record_progress(file, task, perf_counter() - began)
+    return result
+
+
+def upload_parts(batch_input: dict, tasks: list[dict]) -> list[dict]:
+    mode = getenv("UPLOAD_MODE", TransferMode.STREAM)
+    s3 = get_s3_client(streaming=mode != TransferMode.DISK)
+    session = get_http_session()
+
+    concurrency = int(getenv("BATCH_CONCURRENCY", 1))
+
+    metrics.add("PartCount", len(tasks))
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(lambda task: upload_task(s3, session, mode, batch_input, task), tasks))
+
+
+def record_throughput(m: metrics.Metrics) -> None:
+    """Splits the part time into waiting on the origin and sending to S3, the rates are per part stream."""
+    transferred = m.get("BytesTransferred") / 1e6
+    download, upload = m.get("DownloadSeconds"), m.get("PartSeconds") - m.get("DownloadSeconds")
+    if transferred and download > 0:
+        m.add("DownloadMBps", transferred / download, Unit.MEGABYTES_PER_SECOND)
+    if transferred and upload > 0:
+        m.add("UploadMBps", transferred / upload, Unit.MEGABYTES_PER_SECOND)
 
 
 def handler(event, context):
     Logger.init(getenv("LOGGER_LEVEL"))
     logger.debug(event)
-    task = event.get("Task")
-    task_num = task.get("index")
-
-    file = download_file(event.get("URL"), task.get("start"), task.get("end"))
-    with open(file, "rb") as f:
-        resp = (
-            resource("s3")
-            .MultipartUploadPart(
-                event.get("Bucket"),
-                event.get("Key"),
-                event.get("MultipartUploadId"),
-                task_num,
-            )
-            .upload(Body=f)
-        )
 
-        logger.debug(resp)
+    with metrics.invocation("uploader") as m:
+        m.set_property("UploadMode", getenv("UPLOAD_MODE", TransferMode.STREAM))
+        try:
+            # a Distributed Map ItemBatcher sends {"BatchInput": {...}, "Items": [...]}
+            with progress.recording():
+                if "Items" in event:
+                    return upload_parts(event.get("BatchInput", {}), event.get("Items"))
 
-    return get_completed_part(resp.get("ETag"), task_num)
+                return upload_parts(event, [event.get("Task")])[0]
+        finally:
+            record_throughput(m)
@@ -0,0 +1,49 @@
+import errno
+import os
+from contextlib import contextmanager
+from os import getenv
+from shutil import disk_usage
+from tempfile import TemporaryFile, gettempdir
+from typing import BinaryIO, Iterator
+
+# filesystems which cannot preallocate get a sparse file of the same length instead
+UNSUPPORTED_ERRNOS = (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS)
+
+
+def get_staging_dir() -> str:
+    return getenv("STAGING_DIR") or gettempdir()
+
+
+def check_free_space(directory: str, size: int) -> None:
+    free = disk_usage(directory).free
+    if size > free:
+        raise ValueError(f"not enough space to stage {size} bytes in {directory}, {free} bytes free")
+
+
+def preallocate(fd: int, size: int) -> None:
+    fallocate = getattr(os, "posix_fallocate", None)
+    if fallocate is None or size == 0:
+        os.ftruncate(fd, size)
+        return
+
+    try:
+        fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            # another part took the space between the check and the allocation
+            raise ValueError(f"not enough space to stage {size} bytes in {get_staging_dir()}") from e
+        if e.errno not in UNSUPPORTED_ERRNOS:
+            raise
+
+        os.ftruncate(fd, size)
+
+
+@contextmanager
+def staged_file(size: int) -> Iterator[BinaryIO]:
+    """An unnamed file of ``size`` bytes in ``STAGING_DIR``, freed on close and allocated up front, so a full
+    disk fails the part before anything is downloaded."""
+    directory = get_staging_dir()
+    check_free_space(directory, size)
+    with TemporaryFile(prefix="part-", dir=directory) as f:
+        preallocate(f.fileno(), size)
+        yield f
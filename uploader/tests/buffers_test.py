@@ -0,0 +1,72 @@
+from io import BytesIO
+from threading import Event, Thread
+
+import pytest
+from urllib3.response import HTTPResponse
+
+from shared.constants import MiB
+from uploader.buffers import BufferPool, get_buffer_pool, get_memory_budget, readinto
+
+
+class TestBuffers:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    def test_buffer_pool(self) -> None:
+        pool = BufferPool(4, 2)
+        first, second = pool.acquire(), pool.acquire(block=False)
+
+        assert len(first) == len(second) == 4
+        assert pool.acquire(block=False) is None
+
+        pool.release(first)
+        assert pool.acquire(block=False) is first
+        assert pool.allocated == 2
+
+    def test_acquire_waits_for_a_free_buffer(self) -> None:
+        pool = BufferPool(4, 1)
+        buffer = pool.acquire()
+        acquired = Event()
+        waiter = Thread(target=lambda: (pool.acquire(), acquired.set()))
+        waiter.start()
+
+        assert not acquired.wait(0.1)
+
+        pool.release(buffer)
+        waiter.join(1)
+
+        assert acquired.is_set()
+
+    @pytest.mark.parametrize(
+        "mocked_env,expected",
+        [
+            ({}, 256 * MiB),
+            ({"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "1024"}, 512 * MiB),
+            ({"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "1024", "BUFFER_POOL_FRACTION": "0.25"}, 256 * MiB),
+            ({"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "1024", "BUFFER_POOL_MIB": "64"}, 64 * MiB),
+        ],
+        indirect=["mocked_env"],
+    )
+    def test_get_memory_budget(self, mocked_env, expected: int) -> None:
+        assert get_memory_budget() == expected
+
+    @pytest.mark.parametrize("mocked_env", [{"BUFFER_POOL_MIB": "64"}], indirect=True)
+    def test_get_buffer_pool(self, mocked_env) -> None:
+        pool = get_buffer_pool(8 * MiB)
+
+        assert pool is get_buffer_pool(8 * MiB)
+        assert pool.count == 8
+        assert get_buffer_pool(128 * MiB).count == 1
+
+    @pytest.mark.parametrize("decode_content", [False, True])
+    def test_readinto(self, decode_content: bool) -> None:
+        raw = HTTPResponse(body=BytesIO(b"download_content"), preload_content=False, decode_content=decode_content)
+        view = memoryview(bytearray(8))
+
+        assert readinto(raw, view) == 8
+        assert view.tobytes() == b"download"
+        assert readinto(raw, view) == 8
+        assert view.tobytes() == b"_content"
+        assert readinto(raw, view) == 0
@@ -0,0 +1,42 @@
+import gzip
+from io import BytesIO
+
+import pytest
+
+from uploader.compress import PAD_MEMBER_SIZE, compress_part, pad_member
+
+
+class TestCompress:
+    @pytest.fixture(scope="function")
+    def mocked_env(self, request, monkeypatch):
+        for k, v in request.param.items():
+            monkeypatch.setenv(k, v)
+
+    @pytest.mark.parametrize("size", [PAD_MEMBER_SIZE, PAD_MEMBER_SIZE + 1, 4096])
+    def test_pad_member(self, size: int) -> None:
+        member = pad_member(size)
+
+        assert len(member) == size
+        assert gzip.decompress(gzip.compress(b"content") + member + gzip.compress(b"!")) == b"content!"
+
+    def test_pad_member_fails_below_its_header(self) -> None:
+        with pytest.raises(ValueError, match="a gzip member takes at least 21 bytes, not 20"):
+            pad_member(PAD_MEMBER_SIZE - 1)
+
+    @pytest.mark.parametrize("mocked_env", [{"COMPRESSION_LEVEL": "1"}, {"COMPRESSION_LEVEL": "9"}], indirect=True)
+    @pytest.mark.parametrize("on_disk", [False, True])
+    @pytest.mark.parametrize("min_size", [0, 30, 4096])
+    def test_compress_part(self, mocked_env, on_disk: bool, min_size: int) -> None:
+        content = b"compressible " * 100
+        with compress_part(BytesIO(content), "gzip", on_disk, min_size) as compressed:
+            body = compressed.read()
+
+        with compress_part(BytesIO(content), "gzip", on_disk) as compressed:
+            unpadded = len(compressed.read())
+
+        assert gzip.decompress(body) == content
+        assert len(body) == max(unpadded, min_size)
+
+    def test_compress_part_fails_on_unknown_compression(self) -> None:
+        with pytest.raises(ValueError, match="compression zstd is not one of gzip"):
+            compress_part(BytesIO(b""), "zstd", False)
@@ -0,0 +1,5 @@
+from shared.tests.fixtures import reset_fixture
+from uploader import buffers, hedge
+
+# autouse, clears the buffer pools and part times a warm container keeps besides the shared clients and limiters
+reset = reset_fixture(buffers.reset, hedge.reset)
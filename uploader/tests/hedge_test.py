@@ -0,0 +1,142 @@
+from threading import Event
+from time import perf_counter, sleep
+
+import pytest
+
+from shared import metrics
+from shared.metrics import MetricsCollector
+from uploader.hedge import Cancellation, PartTimes, get_hedge_delay, get_part_times, run_hedged
+
+
+class TestHedge:
+    @pytest.fixture(scope="function", autouse=True)
+    def collector(self):
+        metrics.reset()
+        collector = MetricsCollector()
+        metrics.set_sink(collector)
+        yield collector
+        metrics.reset()
+
+    def test_part_times(self) -> None:
+        times = PartTimes(size=10)
+        for seconds in range(4):
+            times.add(seconds)
+
+        assert times.percentile(50) is None
+
+        for seconds in range(4, 20):
+            times.add(seconds)
+
+        assert (times.percentile(0), times.percentile(50), times.percentile(90), times.percentile(100)) == (
+            10,
+            14,
+            18,
+            19,
+        )
+
+    @pytest.mark.parametrize(
+        "hedge_config,times,expected",
+        [
+            (None, [], None),
+            ({}, [1.0] * 5, None),
+            ({"Percentile": 95, "MinSeconds": 2.0}, [], 2.0),
+            ({"Percentile": 95, "MinSeconds": 2.0}, [1.0] * 4 + [5.0], 5.0),
+            ({"Percentile": 50, "MinSeconds": 2.0}, [1.0] * 4 + [5.0], 2.0),
+        ],
+    )
+    def test_get_hedge_delay(self, hedge_config, times: list[float], expected) -> None:
+        for seconds in times:
+            get_part_times().add(seconds)
+
+        assert get_hedge_delay(hedge_config) == expected
+
+    @pytest.mark.parametrize("delay", [None, 1.0])
+    def test_run_hedged_without_straggler(self, collector, delay) -> None:
+        with metrics.invocation("uploader"):
+            assert run_hedged(lambda cancelled: "first", delay) == "first"
+
+        assert collector.values("HedgedParts") == []
+
+    def test_run_hedged_returns_the_first_to_finish(self, collector) -> None:
+        attempts: list[Event] = []
+        stopped = []
+
+        def attempt(cancelled: Event) -> str:
+            attempts.append(cancelled)
+            if len(attempts) == 1:
+                # the straggler runs until it is cancelled
+                cancelled.wait(5)
+                stopped.append("straggler")
+                return "straggler"
+
+            return "hedge"
+
+        with metrics.invocation("uploader"):
+            assert run_hedged(attempt, 0.05) == "hedge"
+
+        # the straggler no longer runs once the part is done
+        assert stopped == ["straggler"]
+        assert all(cancelled.is_set() for cancelled in attempts)
+        assert (collector.total("HedgedParts"), collector.total("HedgeWins")) == (1, 1)
+        assert collector.values("HedgeStragglers") == []
+
+    def test_run_hedged_stops_waiting_for_a_straggler(self, collector, monkeypatch) -> None:
+        monkeypatch.setenv("HEDGE_STOP_SECONDS", "0.1")
+        release = Event()
+
+        def attempt(cancelled: Event) -> str:
+            if not release.is_set():
+                release.set()
+                # a straggler which does not notice its cancellation
+                sleep(1)
+
+            return "done"
+
+        began = perf_counter()
+        with metrics.invocation("uploader"):
+            assert run_hedged(attempt, 0.05) == "done"
+
+        assert perf_counter() - began < 0.8
+        assert collector.total("HedgeStragglers") == 1
+
+    def test_run_hedged_waits_for_the_other_attempt_on_failure(self) -> None:
+        calls = []
+
+        def attempt(cancelled: Event) -> str:
+            calls.append(cancelled)
+            if len(calls) == 1:
+                sleep(0.1)
+                raise ValueError("straggler failed")
+
+            sleep(0.2)
+            return "hedge"
+
+        assert run_hedged(attempt, 0.05) == "hedge"
+
+    def test_run_hedged_fails_when_every_attempt_fails(self) -> None:
+        def attempt(cancelled: Event) -> str:
+            sleep(0.1)
+            raise ValueError("failed")
+
+        with pytest.raises(ValueError, match="failed"):
+            run_hedged(attempt, 0.05)
+
+    @pytest.mark.parametrize("set_before", [False, True])
+    def test_cancellation_runs_callback(self, set_before: bool) -> None:
+        cancelled, calls = Cancellation(), []
+        if set_before:
+            cancelled.set()
+
+        with cancelled.on_cancel(lambda: calls.append("closed")):
+            cancelled.set()
+
+        assert calls == ["closed"]
+
+    def test_cancellation_skips_callback_after_block(self) -> None:
+        cancelled, calls = Cancellation(), []
+        with cancelled.on_cancel(lambda: calls.append("closed")):
+            pass
+
+        cancelled.set()
+
+        assert calls == []
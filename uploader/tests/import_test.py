@@ -0,0 +1,9 @@
+from shared.tests.imports import HANDLER_PACKAGES, import_module
+
+
+class TestImport:
+    def test_import_packages(self) -> None:
+        assert set(import_module("uploader.index")["packages"]) <= HANDLER_PACKAGES
+
+    def test_import_defers_boto3(self) -> None:
+        assert "boto3" not in import_module("uploader.index")["modules"]
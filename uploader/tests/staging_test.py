@@ -0,0 +1,59 @@
+import errno
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from uploader.staging import staged_file
+
+
+class TestStaging:
+    @pytest.fixture(scope="function")
+    def staging_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("STAGING_DIR", str(tmp_path))
+        yield tmp_path
+
+    @pytest.mark.parametrize("size", [0, 1, 4096])
+    def test_staged_file(self, staging_dir, size: int) -> None:
+        with staged_file(size) as f:
+            assert os.fstat(f.fileno()).st_size == size
+            assert list(staging_dir.iterdir()) == []
+
+        assert f.closed
+
+    def test_staged_files_are_distinct(self, staging_dir) -> None:
+        def stage(i: int) -> bytes:
+            with staged_file(8) as f:
+                os.pwrite(f.fileno(), bytes([i]) * 8, 0)
+                return f.read()
+
+        with ThreadPoolExecutor(8) as executor:
+            assert list(executor.map(stage, range(16))) == [bytes([i]) * 8 for i in range(16)]
+
+    def test_staged_file_is_removed_on_failure(self, staging_dir) -> None:
+        with pytest.raises(ValueError, match="failed"):
+            with staged_file(8) as f:
+                raise ValueError("failed")
+
+        assert f.closed
+
+    def test_staged_file_fails_without_space(self, staging_dir) -> None:
+        with pytest.raises(ValueError, match=f"not enough space to stage {2 ** 62} bytes in {staging_dir}"):
+            with staged_file(2**62):
+                pass
+
+    @pytest.mark.parametrize("error,expected", [(errno.EOPNOTSUPP, None), (errno.ENOSPC, "not enough space")])
+    def test_staged_file_without_fallocate(self, staging_dir, monkeypatch, error: int, expected) -> None:
+        def fallocate(fd: int, offset: int, size: int) -> None:
+            raise OSError(error, os.strerror(error))
+
+        monkeypatch.setattr(os, "posix_fallocate", fallocate, raising=False)
+        if expected is not None:
+            with pytest.raises(ValueError, match=expected):
+                with staged_file(8):
+                    pass
+
+            return
+
+        with staged_file(8) as f:
+            assert os.fstat(f.fileno()).st_size == 8
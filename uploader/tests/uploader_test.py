@@ -1,19 +1,27 @@
+import gzip
 import logging
 import os
 from http import HTTPStatus
-from os import remove
-from os.path import join
-from tempfile import gettempdir
+from io import BytesIO
+from time import sleep
 from unittest.mock import patch
 
 import boto3
 import pytest
 import requests_mock
 from _pytest.logging import LogCaptureFixture
+from botocore.awsrequest import AWSResponse
+from botocore.stub import Stubber
 from loguru import logger
 from moto import mock_s3
 
-from uploader.index import download_file, handler
+from shared import connection, metrics, throttle
+from shared.constants import MIN_PART_SIZE
+from shared.metrics import MetricsCollector
+from shared.progress import LocalStore, get_progress
+from shared.tests.fixtures import serve_range
+from uploader import buffers as buffer_pools
+from uploader.index import SourceChangedError, download_file, handler, open_range
 
 
 class TestUploader:
@@ -33,22 +41,40 @@ class TestUploader:
         )
         yield caplog
 
+    @pytest.fixture(scope="function")
+    def collector(self):
+        metrics.reset()
+        collector = MetricsCollector()
+        metrics.set_sink(collector)
+        yield collector
+        metrics.reset()
+
     @pytest.fixture(scope="function")
     def mocked_boto3_resource(self):
         with patch("boto3.resource", autospec=True) as m:
             yield m
 
     @mock_s3
-    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO"}], indirect=True)
-    def test_handler(self, requests_mock, caplog, mocked_env):
+    @pytest.mark.parametrize(
+        "mocked_env",
+        [
+            {"LOGGER_LEVEL": "INFO"},
+            {"LOGGER_LEVEL": "INFO", "UPLOAD_MODE": "stream", "STREAM_CHUNK_SIZE": "4"},
+            {"LOGGER_LEVEL": "INFO", "UPLOAD_MODE": "disk"},
+            {"LOGGER_LEVEL": "INFO", "STREAM_CHUNK_SIZE": "3", "DOWNLOAD_CONCURRENCY": "4"},
+            {"LOGGER_LEVEL": "INFO", "UPLOAD_MODE": "disk", "DOWNLOAD_CONCURRENCY": "4"},
+        ],
+        indirect=True,
+    )
+    def test_handler(self, requests_mock, caplog, mocked_env, collector):
         event = {
             "URL": "https://download.test/file_name.txt",
             "Bucket": "bucket_name",
             "Key": "file_name.txt",
-            "Task": {"index": 1, "start": 0, "end": 10},
+            "Task": {"index": 1, "start": 0, "end": 15},
         }
         download_file_content = "download_content"
-        requests_mock.get(event.get("URL"), text=download_file_content, status_code=HTTPStatus.PARTIAL_CONTENT)
+        requests_mock.get(event.get("URL"), content=serve_range(download_file_content.encode()))
 
         s3_resource = boto3.resource("s3", region_name=os.getenv("AWS_DEFAULT_REGION"))
         s3_client = boto3.client("s3")
@@ -68,6 +94,351 @@ class TestUploader:
         assert len(download_file_content) == uploaded_part["Size"]
         assert result == {"ETag": uploaded_part["ETag"], "PartNumber": 1}
 
+        [record] = collector.records
+        assert (record["Function"], record["UploadMode"]) == ("uploader", os.getenv("UPLOAD_MODE", "stream"))
+        assert (record["ColdStart"], record["PartCount"], record["BytesTransferred"]) == (1, 1, 16)
+        assert len(record["TimeToFirstByte"]) == len(requests_mock.request_history)
+        assert record["DownloadMBps"] > 0 and record["UploadMBps"] > 0
+        assert (record.get("TmpBytesUsed", 0) > 0) is (os.getenv("UPLOAD_MODE") == "disk")
+
+    @mock_s3
+    @pytest.mark.parametrize(
+        "mocked_env",
+        [
+            {"LOGGER_LEVEL": "INFO"},
+            {"LOGGER_LEVEL": "INFO", "UPLOAD_MODE": "disk"},
+            {"LOGGER_LEVEL": "INFO", "STREAM_CHUNK_SIZE": "3", "DOWNLOAD_CONCURRENCY": "4"},
+        ],
+        indirect=True,
+    )
+    @pytest.mark.parametrize(
+        "content,checksum_algorithm,checksum",
+        [(b"download_content", None, None), (b"", None, None), (b"0" * 100, "CRC32", "U6Rgdw==")],
+    )
+    def test_handler_with_single_upload(self, requests_mock, caplog, mocked_env, content, checksum_algorithm, checksum):
+        event = {
+            "URL": "https://download.test/file_name.txt",
+            "Bucket": "bucket_name",
+            "Key": "file_name.txt",
+            "ChecksumAlgorithm": checksum_algorithm,
+            "Task": {"index": 1, "start": 0, "end": len(content) - 1},
+        }
+        requests_mock.get(event.get("URL"), content=serve_range(content))
+
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=event.get("Bucket"))
+
+        result = handler(event, {})
+        uploaded = s3_client.get_object(Bucket=event.get("Bucket"), Key=event.get("Key"))
+        crc32 = result.pop("ChecksumCRC32", None)
+
+        assert uploaded["Body"].read() == content
+        assert result == {"ETag": uploaded["ETag"]}
+        # moto returns the checksum as bytes, where S3 returns a base64 string
+        assert (crc32.decode() if isinstance(crc32, bytes) else crc32) == checksum
+        assert requests_mock.called is bool(content)
+
+    @mock_s3
+    @pytest.mark.parametrize(
+        "mocked_env",
+        [
+            {"LOGGER_LEVEL": "INFO"},
+            {"LOGGER_LEVEL": "INFO", "BATCH_CONCURRENCY": "3", "DOWNLOAD_CONCURRENCY": "2", "STREAM_CHUNK_SIZE": "5"},
+            {"LOGGER_LEVEL": "INFO", "UPLOAD_MODE": "disk", "BATCH_CONCURRENCY": "3"},
+        ],
+        indirect=True,
+    )
+    def test_handler_with_batch(self, requests_mock, caplog, monkeypatch, tmp_path, mocked_env):
+        monkeypatch.setenv("PROGRESS_STORE", str(tmp_path))
+        batch_input = {
+            "URL": "https://download.test/file_name.txt",
+            "Bucket": "bucket_name",
+            "Key": "file_name.txt",
+            "IfRange": '"v1"',
+            "TotalSize": 130,
+        }
+        content = bytes(range(100))
+        requests_mock.get(batch_input.get("URL"), content=serve_range(content))
+
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=batch_input.get("Bucket"))
+        multipart_resp = s3_client.create_multipart_upload(Bucket=batch_input.get("Bucket"), Key=batch_input.get("Key"))
+        batch_input["MultipartUploadId"] = multipart_resp["UploadId"]
+
+        items = [{"index": i + 1, "start": i * 30, "end": min(i * 30 + 29, 99)} for i in range(4)]
+        result = handler({"BatchInput": batch_input, "Items": items}, {})
+        uploaded_part = {"index": 5, "start": 100, "end": 129, "ETag": '"uploaded-etag"'}
+        assert handler({"BatchInput": batch_input, "Items": [uploaded_part]}, {}) == [
+            {"ETag": '"uploaded-etag"', "PartNumber": 5}
+        ]
+
+        uploaded_parts = s3_client.list_parts(
+            Bucket=batch_input.get("Bucket"), Key=batch_input.get("Key"), UploadId=multipart_resp["UploadId"]
+        )["Parts"]
+
+        assert [part["Size"] for part in uploaded_parts] == [30, 30, 30, 10]
+        upload_progress = get_progress(LocalStore(str(tmp_path)), multipart_resp["UploadId"])
+        assert (upload_progress["PartsCompleted"], upload_progress["PercentComplete"]) == (5, 100.0)
+        assert all(request.headers["If-Range"] == '"v1"' for request in requests_mock.request_history)
+        assert result == [{"ETag": part["ETag"], "PartNumber": part["PartNumber"]} for part in uploaded_parts]
+
+    @mock_s3
+    @pytest.mark.parametrize(
+        "mocked_env",
+        [{"LOGGER_LEVEL": "INFO", "BATCH_CONCURRENCY": "3"}, {"LOGGER_LEVEL": "INFO", "UPLOAD_MODE": "disk"}],
+        indirect=True,
+    )
+    def test_handler_with_bulk_batch(self, requests_mock, caplog, mocked_env):
+        small, large = bytes(range(10)), bytes(range(100))
+        requests_mock.get("https://download.test/small.bin", content=serve_range(small))
+        requests_mock.get("https://download.test/large.bin", content=serve_range(large))
+
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        upload_id = s3_client.create_multipart_upload(Bucket="bucket_name", Key="large.bin")["UploadId"]
+        file = {"URL": "https://download.test/large.bin", "Bucket": "bucket_name", "Key": "large.bin"}
+
+        items = [
+            {
+                "URL": "https://download.test/small.bin",
+                "Bucket": "bucket_name",
+                "Key": "small.bin",
+                "start": 0,
+                "end": 9,
+            },
+            {**file, "MultipartUploadId": upload_id, "index": 1, "start": 0, "end": 59},
+            {**file, "MultipartUploadId": upload_id, "index": 2, "start": 60, "end": 99},
+        ]
+        result = handler({"Items": items}, {})
+
+        uploaded_parts = s3_client.list_parts(Bucket="bucket_name", Key="large.bin", UploadId=upload_id)["Parts"]
+        assert [part["Size"] for part in uploaded_parts] == [60, 40]
+        assert s3_client.get_object(Bucket="bucket_name", Key="small.bin")["Body"].read() == small
+        assert result[1:] == [{"ETag": part["ETag"], "PartNumber": part["PartNumber"]} for part in uploaded_parts]
+
+    @mock_s3
+    @pytest.mark.parametrize(
+        "mocked_env",
+        [
+            {"LOGGER_LEVEL": "INFO"},
+            {"LOGGER_LEVEL": "INFO", "UPLOAD_MODE": "disk", "COMPRESSION_LEVEL": "9"},
+            {
+                "LOGGER_LEVEL": "INFO",
+                "DOWNLOAD_CONCURRENCY": "2",
+                "STREAM_CHUNK_SIZE": "7",
+                "COMPRESSION_SPOOL_MIB": "0",
+            },
+        ],
+        indirect=True,
+    )
+    @pytest.mark.parametrize("checksum_algorithm", [None, "CRC32"])
+    def test_handler_with_compression(self, requests_mock, caplog, mocked_env, collector, checksum_algorithm):
+        content = b"compressible " * 10
+        metadata = {"compression": "gzip", "compression-frame-size": "60", "uncompressed-size": str(len(content))}
+        batch_input = {
+            "URL": "https://download.test/file_name.txt",
+            "Bucket": "bucket_name",
+            "Key": "file_name.txt",
+            "Compression": "gzip",
+            "TotalSize": len(content),
+        }
+        requests_mock.get(batch_input.get("URL"), content=serve_range(content))
+
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        upload_id = s3_client.create_multipart_upload(Bucket="bucket_name", Key="file_name.txt", Metadata=metadata)[
+            "UploadId"
+        ]
+        items = [{"index": 1, "start": 0, "end": 59}, {"index": 2, "start": 60, "end": len(content) - 1}]
+        parts = handler({"BatchInput": {**batch_input, "MultipartUploadId": upload_id}, "Items": items}, {})
+
+        uploaded_parts = s3_client.list_parts(Bucket="bucket_name", Key="file_name.txt", UploadId=upload_id)["Parts"]
+        # every part but the last is padded up to the minimum part size
+        assert uploaded_parts[0]["Size"] == 5 * 1024 * 1024
+
+        s3_client.complete_multipart_upload(
+            Bucket="bucket_name", Key="file_name.txt", UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+        uploaded = s3_client.get_object(Bucket="bucket_name", Key="file_name.txt")
+        assert gzip.decompress(uploaded["Body"].read()) == content
+        assert uploaded["Metadata"] == metadata
+
+        # moto keeps the chunk framing of a part sent with a trailing checksum, so only the single upload has one
+        single = {
+            **batch_input,
+            "Key": "single.txt",
+            "ChecksumAlgorithm": checksum_algorithm,
+            "Metadata": metadata,
+            "Task": {"start": 0, "end": 59},
+        }
+        handler(single, {})
+
+        uploaded = s3_client.get_object(Bucket="bucket_name", Key="single.txt")
+        assert gzip.decompress(uploaded["Body"].read()) == content[:60]
+        # moto also keeps the aws-chunked coding of a body sent with a trailing checksum, which S3 drops
+        assert (uploaded["Metadata"], uploaded["ContentEncoding"].split(",")[0]) == (metadata, "gzip")
+        assert collector.values("PaddedParts") == [1]
+        assert collector.values("CompressedBytes")[0] == 5 * 1024 * 1024 + uploaded_parts[1]["Size"]
+
+    @mock_s3
+    @pytest.mark.parametrize(
+        "mocked_env",
+        [{"LOGGER_LEVEL": "INFO"}, {"LOGGER_LEVEL": "INFO", "UPLOAD_MODE": "disk"}],
+        indirect=True,
+    )
+    def test_handler_with_hedge(self, requests_mock, caplog, mocked_env, collector):
+        content = bytes(range(100))
+        serve = serve_range(content)
+        stalled = []
+
+        class StalledBody(BytesIO):
+            def read(self, size=-1):
+                sleep(0.5)
+                return super().read(size)
+
+            def readinto(self, b):
+                sleep(0.5)
+                return super().readinto(b)
+
+        def callback(request, context):
+            # the body of the first attempt stalls on a slow origin until the hedge has finished, it is read
+            # outside of requests_mock, which serves one request at a time
+            body = serve(request, context)
+            if not stalled:
+                stalled.append(request)
+                return StalledBody(body)
+
+            return BytesIO(body)
+
+        batch_input = {
+            "URL": "https://download.test/file_name.txt",
+            "Bucket": "bucket_name",
+            "Key": "file_name.txt",
+            "Hedge": {"Percentile": 95, "MinSeconds": 0.1},
+        }
+        requests_mock.get(batch_input.get("URL"), body=callback)
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="bucket_name")
+        upload_id = s3_client.create_multipart_upload(Bucket="bucket_name", Key="file_name.txt")["UploadId"]
+
+        result = handler(
+            {
+                "BatchInput": {**batch_input, "MultipartUploadId": upload_id},
+                "Items": [{"index": 1, "start": 0, "end": 99}],
+            },
+            {},
+        )
+
+        [part] = s3_client.list_parts(Bucket="bucket_name", Key="file_name.txt", UploadId=upload_id)["Parts"]
+        assert result == [{"ETag": part["ETag"], "PartNumber": 1}]
+        assert part["Size"] == len(content)
+        assert (collector.total("HedgedParts"), collector.total("HedgeWins")) == (1, 1)
+
+    @mock_s3
+    @pytest.mark.parametrize("mocked_env", [{"LOGGER_LEVEL": "INFO"}], indirect=True)
+    def test_handler_with_copy(self, requests_mock, mocked_env, collector):
+        s3_client = boto3.client("s3")
+        for bucket in ("bucket_name", "source-bucket"):
+            s3_client.create_bucket(Bucket=bucket)
+        content = bytes(range(256)) * (2 * MIN_PART_SIZE // 256 + 1)
+        etag = s3_client.put_object(Bucket="source-bucket", Key="dir/file_name.bin", Body=content)["ETag"]
+        file = {
+            "URL": "s3://source-bucket/dir/file_name.bin",
+            "Bucket": "bucket_name",
+            "IfRange": etag,
+            "CopySource": {"Bucket": "source-bucket", "Key": "dir/file_name.bin"},
+        }
+        upload_id = s3_client.create_multipart_upload(Bucket="bucket_name", Key="file_name.bin")["UploadId"]
+        batch_input = {**file, "Key": "file_name.bin", "MultipartUploadId": upload_id}
+        items = [
+            {"index": idx + 1, "start": start, "end": min(start + MIN_PART_SIZE, len(content)) - 1}
+            for idx, start in enumerate(range(0, len(content), MIN_PART_SIZE))
+        ]
+
+        parts = handler({"BatchInput": batch_input, "Items": items}, {})
+        s3_client.complete_multipart_upload(
+            Bucket="bucket_name", Key="file_name.bin", UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+        result = handler({**file, "Key": "copy.bin", "Task": {"index": 1, "start": 0, "end": len(content) - 1}}, {})
+
+        # S3 copies every byte, none of them is downloaded
+        assert requests_mock.call_count == 0
+        assert [part["PartNumber"] for part in parts] == [1, 2, 3]
+        assert s3_client.get_object(Bucket="bucket_name", Key="file_name.bin")["Body"].read() == content
+        assert s3_client.get_object(Bucket="bucket_name", Key="copy.bin")["Body"].read() == content
+        assert result["ETag"] == etag
+        assert collector.total("CopiedBytes") == 2 * len(content)
+
+    def test_handler_with_changed_copy_source(self, monkeypatch, collector):
+        for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            monkeypatch.setenv(name, "testing")
+        s3 = boto3.client("s3")
+        stubber = Stubber(s3)
+        stubber.add_client_error("upload_part_copy", service_error_code="PreconditionFailed", http_status_code=412)
+        connection.set_s3_client(s3)
+        batch_input = {
+            "URL": "s3://source-bucket/file_name.bin",
+            "Bucket": "bucket_name",
+            "Key": "file_name.bin",
+            "MultipartUploadId": "upload-id",
+            "IfRange": '"v1"',
+            "CopySource": {"Bucket": "source-bucket", "Key": "file_name.bin"},
+        }
+
+        with stubber, pytest.raises(SourceChangedError, match="s3://source-bucket/file_name.bin has changed"):
+            handler({"BatchInput": batch_input, "Items": [{"index": 1, "start": 0, "end": 99}]}, {})
+
+    @pytest.mark.parametrize(
+        "mocked_env",
+        [
+            {"LOGGER_LEVEL": "INFO"},
+            {"LOGGER_LEVEL": "INFO", "DOWNLOAD_CONCURRENCY": "3", "STREAM_CHUNK_SIZE": "4"},
+        ],
+        indirect=True,
+    )
+    def test_handler_with_checksum(self, requests_mock, monkeypatch, mocked_env):
+        for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            monkeypatch.setenv(name, "testing")
+
+        batch_input = {
+            "URL": "https://download.test/file_name.txt",
+            "Bucket": "bucket_name",
+            "Key": "file_name.txt",
+            "MultipartUploadId": "upload-id",
+            "ChecksumAlgorithm": "CRC32",
+        }
+        content = bytes(range(100))
+        requests_mock.get(batch_input.get("URL"), content=serve_range(content))
+        sent = []
+
+        # moto does not decode aws-chunked part bodies, so the request botocore would send is inspected instead
+        class Raw:
+            def stream(self):
+                yield b""
+
+        def send(request, **kwargs):
+            sent.append((request.headers, request.body.read()))
+            headers = {"ETag": f'"etag-{len(sent)}"', "x-amz-checksum-crc32": f"crc32-{len(sent)}"}
+            return AWSResponse(request.url, HTTPStatus.OK, headers, Raw())
+
+        s3 = connection.get_s3_client(streaming=True)
+        s3.meta.events.register("before-send.s3.UploadPart", send)
+
+        result = handler({"BatchInput": batch_input, "Items": [{"index": 3, "start": 10, "end": 59}]}, {})
+
+        headers, body = sent[0]
+        assert headers["x-amz-sdk-checksum-algorithm"] == b"CRC32"
+        assert headers["x-amz-trailer"] == b"x-amz-checksum-crc32"
+        assert headers["X-Amz-Decoded-Content-Length"] == b"50"
+        assert b"x-amz-checksum-crc32:" in body
+        assert content[10:60] in body
+        assert result == [{"ETag": '"etag-1"', "PartNumber": 3, "ChecksumCRC32": "crc32-1"}]
+
+        resumed = {"index": 4, "start": 60, "end": 99, "ETag": '"etag-4"', "ChecksumCRC32": "crc32-4"}
+        assert handler({"BatchInput": batch_input, "Items": [resumed]}, {}) == [
+            {"ETag": '"etag-4"', "PartNumber": 4, "ChecksumCRC32": "crc32-4"}
+        ]
+
     @requests_mock.Mocker(kw="mock")
     @pytest.mark.parametrize(
         "start,end,status_code,err_msg",
@@ -85,15 +456,160 @@ class TestUploader:
 
         if err_msg is not None:
             with pytest.raises(ValueError, match=err_msg):
-                download_file("https://download.test/file_name.txt", start, end)
+                with download_file("https://download.test/file_name.txt", start, end):
+                    pass
+
+            return
+
+        with download_file("https://download.test/file_name.txt", start, end) as f:
+            assert f.read() == download_content[start : end + 1].encode()
+
+        assert m.last_request.headers.get("Range") == f"bytes={start}-{end}"
+        assert f.closed
+
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize(
+        "start,end,resp_headers,status_code,expected,err_msg",
+        [
+            (0, 9, {}, HTTPStatus.PARTIAL_CONTENT, "download_t", None),
+            (0, 30, {"Content-Length": "21"}, HTTPStatus.PARTIAL_CONTENT, "download_test_content", None),
+            (20, 10, {}, HTTPStatus.PARTIAL_CONTENT, None, "start value 20 is not less then end value 10"),
+            (0, 10, {}, HTTPStatus.OK, None, "download failed, received status code 200"),
+        ],
+    )
+    def test_open_range(self, start, end, resp_headers, status_code, expected, err_msg, **kwargs) -> None:
+        m = kwargs["mock"]
+        url = "https://download.test/file_name.txt"
+        m.get(url, text="download_test_content", headers=resp_headers, status_code=status_code)
+
+        if err_msg is not None:
+            with pytest.raises(ValueError, match=err_msg):
+                with open_range(url, start, end):
+                    pass
 
             return
 
-        file_name = download_file("https://download.test/file_name.txt", start, end)
+        with open_range(url, start, end, chunk_size=4) as body:
+            assert body.raw.length == len(expected)
+            assert body.read().decode() == expected
 
-        assert file_name == join(gettempdir(), "file_name.txt")
         assert m.last_request.headers.get("Range") == f"bytes={start}-{end}"
-        with open(file_name, "r") as f:
-            assert f.read() == download_content
 
-        remove(file_name)
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize(
+        "resp_headers,concurrency,err_msg",
+        [
+            ({"Content-Length": "30"}, 1, "received 30 bytes for requested range 0-20"),
+            (
+                {"Content-Range": "bytes 5-25/100"},
+                1,
+                "received range bytes 5-25/100 does not match requested range 0-20",
+            ),
+            (
+                {"Content-Range": "bytes 0-30/100"},
+                1,
+                "received range bytes 0-30/100 does not match requested range 0-20",
+            ),
+            ({"Content-Range": "bytes 0-10/100"}, 2, "download failed, received 21 bytes, expected 11"),
+            ({"Content-Length": "22"}, 2, "received 22 bytes for requested range 0-10"),
+        ],
+    )
+    def test_open_range_fails_on_mismatched_response(self, resp_headers, concurrency, err_msg, **kwargs) -> None:
+        url = "https://download.test/file_name.txt"
+        kwargs["mock"].get(
+            url, text="download_test_content", headers=resp_headers, status_code=HTTPStatus.PARTIAL_CONTENT
+        )
+
+        with pytest.raises(ValueError, match=err_msg):
+            with open_range(url, 0, 20, 11, concurrency) as body:
+                body.read()
+
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("status_code,concurrency", [(429, 1), (503, 1), (429, 3)])
+    def test_open_range_throttled(self, status_code, concurrency, **kwargs) -> None:
+        url = "https://download.test/file_name.txt"
+        kwargs["mock"].get(url, status_code=status_code, headers={"Retry-After": "1"})
+
+        with pytest.raises(throttle.ThrottledError, match=f"download failed, received status code {status_code}"):
+            with open_range(url, 0, 20, 7, concurrency) as body:
+                body.read()
+
+        # sub-ranges requested after the first was throttled may halve the limit again
+        assert throttle.get_limiter(url).limit <= throttle.DEFAULT_ORIGIN_CONCURRENCY / 2
+
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("concurrency", [1, 3])
+    @pytest.mark.parametrize("changed", [False, True])
+    def test_open_range_if_range(self, concurrency, changed, **kwargs) -> None:
+        url = "https://download.test/file_name.txt"
+        content = "download_test_content"
+        if changed:
+            kwargs["mock"].get(url, text=content, status_code=HTTPStatus.OK)
+        else:
+            kwargs["mock"].get(
+                url, text=content[:7], headers={"Content-Range": "bytes 0-6/21"}, status_code=HTTPStatus.PARTIAL_CONTENT
+            )
+
+        if changed:
+            with pytest.raises(
+                SourceChangedError, match=f'{url} has changed since it was planned, it no longer matches "a"'
+            ):
+                with open_range(url, 0, 6, 3, concurrency, if_range='"a"') as body:
+                    body.read()
+        else:
+            with open_range(url, 0, 6, 7, concurrency, if_range='"a"') as body:
+                assert body.read() == content[:7].encode()
+
+        assert all(request.headers["If-Range"] == '"a"' for request in kwargs["mock"].request_history)
+
+    @requests_mock.Mocker(kw="mock")
+    def test_download_file_fails_on_truncated_response(self, **kwargs) -> None:
+        url = "https://download.test/file_name.txt"
+        kwargs["mock"].get(
+            url, text="download_test_content", headers={"Content-Range": "bytes 0-29/30"}, status_code=206
+        )
+
+        with pytest.raises(ValueError, match="download incomplete, received 21 of 30 bytes"):
+            with download_file(url, 0, 29):
+                pass
+
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize(
+        "start,end,chunk_size,concurrency,buffers",
+        [(0, 99, 7, 3, 8), (10, 60, 100, 4, 8), (90, 120, 4, 8, 8), (99, 99, 1, 2, 8), (0, 99, 7, 3, 1)],
+    )
+    def test_open_range_in_parallel(self, start, end, chunk_size, concurrency, buffers, **kwargs) -> None:
+        url = "https://download.test/file_name.txt"
+        content = bytes(range(100))
+        kwargs["mock"].get(url, content=serve_range(content))
+        pool = buffer_pools.BufferPool(chunk_size, buffers)
+        buffer_pools._pools[chunk_size] = pool
+
+        with open_range(url, start, end, chunk_size, concurrency) as body:
+            assert body.raw.length == len(content[start : end + 1])
+            reads = list(iter(lambda: body.read(10), b""))
+
+        # a read spanning sub-ranges is still filled, as botocore sends a chunk per read
+        assert b"".join(reads) == content[start : end + 1]
+        assert all(len(read) == 10 for read in reads[:-1])
+        assert pool.allocated <= min(buffers, concurrency + 1)
+        assert pool.available == buffers
+
+    @requests_mock.Mocker(kw="mock")
+    def test_open_range_in_parallel_fails_on_full_response(self, **kwargs) -> None:
+        url = "https://download.test/file_name.txt"
+        kwargs["mock"].get(url, text="download_test_content", status_code=HTTPStatus.OK)
+
+        with pytest.raises(ValueError, match="download failed, received status code 200"):
+            with open_range(url, 0, 20, 4, 2):
+                pass
+
+    @requests_mock.Mocker(kw="mock")
+    @pytest.mark.parametrize("start,end,concurrency", [(0, 99, 1), (10, 60, 4), (90, 120, 8), (0, 2, 5)])
+    def test_download_file_in_parallel(self, start, end, concurrency, **kwargs) -> None:
+        url = "https://download.test/file_name.txt"
+        content = bytes(range(100))
+        kwargs["mock"].get(url, content=serve_range(content))
+
+        with download_file(url, start, end, concurrency) as f:
+            assert f.read() == content[start : end + 1]